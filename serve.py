@@ -1,10 +1,21 @@
 #!/usr/bin/env python
+from vaml.instrumentation import PROFILER
 from vaml.server import VamlServer
 
 HOSTNAME = 'localhost'
 WEB_PORT = 5678
 SOCKET_PORT = 12000
+HTTP_WORKERS = 8
+COMPUTE_WORKERS = 4
+# Set to a number of milliseconds to print the hot stacks of slower requests
+PROFILE_SLOW_MS = None
+# Seconds spent preloading data on startup, where None means no limit and 0
+# skips it
+WARMUP_BUDGET_S = 30.0
 
 if __name__ == '__main__':
-    server = VamlServer(HOSTNAME, WEB_PORT, SOCKET_PORT)
+    if PROFILE_SLOW_MS is not None:
+        PROFILER.configure(enabled=True, slow_ms=PROFILE_SLOW_MS)
+    server = VamlServer(HOSTNAME, WEB_PORT, SOCKET_PORT, workers=HTTP_WORKERS, compute_workers=COMPUTE_WORKERS,
+                        warmup_budget=WARMUP_BUDGET_S)
     server.serve()
@@ -0,0 +1,39 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from vaml.data.appendable import HEADER_SIZE, AppendableArray
+
+
+# Files written by np.save are converted before they are appended to
+class AppendableArrayTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.filename = os.path.join(self.folder, 'run_1_rewards.npy')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_converts_without_truncating_readers(self):
+        np.save(self.filename, np.arange(5, dtype=np.float32))
+        mapped = np.load(self.filename, mmap_mode='r')
+        array = AppendableArray(self.filename)
+        array.append([5.0, 6.0])
+        array.close()
+
+        # The old mapping still sees the old file, which was replaced whole
+        np.testing.assert_array_equal(mapped, np.arange(5))
+        np.testing.assert_array_equal(np.load(self.filename), np.arange(7))
+        self.assertEqual(os.path.getsize(self.filename), HEADER_SIZE + 7 * 8)
+        self.assertEqual(os.listdir(self.folder), ['run_1_rewards.npy'])
+
+    def test_reopens_appendable_files(self):
+        array = AppendableArray(self.filename, row_shape=(2,))
+        array.append([[1.0, 2.0]])
+        array.close()
+        array = AppendableArray(self.filename, row_shape=(2,))
+        array.append([[3.0, 4.0]])
+        array.close()
+        np.testing.assert_array_equal(np.load(self.filename), [[1.0, 2.0], [3.0, 4.0]])
@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+
+from vaml import catalog
+from vaml.catalog import FEEDING_FORMAT, RunCatalog
+from vaml.data.feed_data import create_feeder
+
+
+# The catalog of a data folder with a few converted runs
+class RunCatalogTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        for run_id in (1, 2):
+            self._add_run(run_id)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def _add_run(self, run_id):
+        run_folder = os.path.join(self.folder, 'run_{}'.format(run_id))
+        os.mkdir(run_folder)
+        np.save(os.path.join(run_folder, 'run_{}_rewards.npy'.format(run_id)), np.ones(10))
+
+    def test_converted_runs_are_not_live(self):
+        runs = RunCatalog(self.folder).runs()
+        self.assertEqual([run.is_live() for run in runs], [False, False])
+
+    def test_runs_being_fed_are_live(self):
+        open(FEEDING_FORMAT.format(folder=self.folder, run=2), 'w').close()
+        runs = RunCatalog(self.folder).runs()
+        self.assertEqual([run.is_live() for run in runs], [False, True])
+
+    def test_unreadable_runs_are_kept(self):
+        runs = RunCatalog(self.folder)
+        self.assertEqual(runs.run_ids(), [1, 2])
+        self._add_run(3)
+        with mock.patch.object(catalog, '_load_run_info', side_effect=OSError):
+            np.save(os.path.join(self.folder, 'run_2', 'run_2_rewards.npy'), np.ones(20))
+            self.assertEqual(runs.run_ids(), [1, 2, 3])
+        self.assertEqual([run.steps for run in runs.runs()], [10, 20, 10])
+
+    def test_delete_last_uses_run_folders(self):
+        self._add_run(3)
+        os.makedirs(os.path.join(self.folder, 'TOO_FEED', 'run_6'))
+        with mock.patch.object(catalog, '_load_run_info', side_effect=ValueError):
+            feeder = create_feeder(self.folder, 6, del_last=True)
+        self.assertEqual(feeder.run_id, 3)
+        self.assertTrue(os.path.exists(os.path.join(self.folder, 'run_2', 'run_2_rewards.npy')))
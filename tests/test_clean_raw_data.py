@@ -0,0 +1,20 @@
+import unittest
+
+from vaml.data.clean_raw_data import _parse_reward
+
+
+# Rewards are read from the top-level key of each step line
+class ParseRewardTest(unittest.TestCase):
+    def test_top_level_reward(self):
+        self.assertEqual(_parse_reward(b'{"step": 1, "reward": -0.5, "done": false}\n'), -0.5)
+
+    def test_nested_reward_is_ignored(self):
+        self.assertEqual(_parse_reward(b'{"info": {"reward": 3.0}, "reward": 1.5}\n'), 1.5)
+        self.assertEqual(_parse_reward(b'{"rewards": [{"reward": 3.0}], "reward": 2}\n'), 2.0)
+
+    def test_reward_as_a_value(self):
+        self.assertEqual(_parse_reward(b'{"kind": "reward", "reward": 4.0}\n'), 4.0)
+
+    def test_only_nested_reward(self):
+        with self.assertRaises(KeyError):
+            _parse_reward(b'{"info": {"reward": 3.0}}\n')
@@ -0,0 +1,105 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from vaml.data.compile_into_numpy import convert_all, parse_episode
+from vaml.episode_index import load_episode_index
+from vaml.run_store import load_run_store
+
+
+def _episode_text(rewards, compact=True):
+    steps = [{'reward': reward, 'step': index + 1} for index, reward in enumerate(rewards)]
+    data = {'steps': steps, 'metadata': {'steps': len(rewards), 'reward': float(np.sum(rewards))}}
+    return json.dumps(data, separators=(',', ':')) if compact else json.dumps(data, indent=2)
+
+
+# Episode files are read with or without the compact layout
+class ParseEpisodeTest(unittest.TestCase):
+    def test_compact_and_full_parse_agree(self):
+        rewards = [0.5, -1.25, float('inf'), 3e-7, 0.0]
+        for compact in (True, False):
+            metadata, values = parse_episode(_episode_text(rewards, compact).encode('utf8'))
+            np.testing.assert_array_equal(values, rewards)
+            self.assertEqual(metadata['steps'], 5)
+
+    def test_nested_step_fields(self):
+        text = b'{"steps":[{"info":{"reward":9},"reward":1.5,"step":1}],"metadata":{}}'
+        self.assertEqual(parse_episode(text)[1].tolist(), [1.5])
+
+    def test_empty_episode(self):
+        self.assertEqual(parse_episode(_episode_text([]).encode('utf8'))[1].size, 0)
+
+
+# Converts raw runs on the process pool
+class ConvertAllTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.raw_folder = os.path.join(self.folder, 'raw')
+        self.converted_folder = os.path.join(self.folder, 'converted')
+        self.rewards = {}
+        for run_number in (1, 2):
+            run_folder = os.path.join(self.raw_folder, 'run_{}'.format(run_number))
+            os.makedirs(run_folder)
+            with open(os.path.join(run_folder, 'metadata.json'), 'w') as fh:
+                json.dump({'run': run_number}, fh)
+            for ep_number in (1, 2, 3):
+                rewards = list(np.arange(ep_number + 2, dtype=np.float64) * run_number)
+                self._write_episode(run_number, ep_number, _episode_text(rewards))
+                self.rewards[(run_number, ep_number)] = rewards
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def _write_episode(self, run_number, ep_number, text):
+        filename = os.path.join(self.raw_folder, 'run_{}'.format(run_number), 'episode_{}.json'.format(ep_number))
+        with open(filename, 'w') as fh:
+            fh.write(text)
+
+    def _convert(self):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            failed = convert_all(self.raw_folder, self.converted_folder, workers=2)
+        return failed, output.getvalue()
+
+    def _run_rewards(self, run_number):
+        return np.load(os.path.join(self.converted_folder, 'run_{0}/run_{0}_rewards.npy'.format(run_number)))
+
+    def _expected(self, run_number, episodes):
+        return np.concatenate([self.rewards[(run_number, ep_number)] for ep_number in episodes])
+
+    def test_converts_every_run(self):
+        failed, _ = self._convert()
+        self.assertEqual(failed, [])
+        for run_number in (1, 2):
+            np.testing.assert_array_equal(self._run_rewards(run_number), self._expected(run_number, (1, 2, 3)))
+            self.assertEqual(list(load_run_store(self.converted_folder, run_number).episode_ids), [1, 2, 3])
+            self.assertEqual(len(load_episode_index(self.converted_folder, run_number)), 3)
+
+    def test_skips_converted_episodes(self):
+        self._convert()
+        run_file = os.path.join(self.converted_folder, 'run_1/run_1_rewards.npy')
+        modified = os.path.getmtime(run_file)
+        failed, output = self._convert()
+        self.assertEqual(failed, [])
+        self.assertIn('6/6 episodes (6 up to date, 0 failed)', output)
+        self.assertEqual(os.path.getmtime(run_file), modified)
+
+    def test_removed_source_rebuilds_the_run(self):
+        self._convert()
+        os.remove(os.path.join(self.raw_folder, 'run_1', 'episode_2.json'))
+        self._convert()
+        np.testing.assert_array_equal(self._run_rewards(1), self._expected(1, (1, 3)))
+        self.assertEqual(list(load_run_store(self.converted_folder, 1).episode_ids), [1, 3])
+        self.assertFalse(os.path.exists(os.path.join(self.converted_folder, 'run_1', 'episode_2_meta.json')))
+
+    def test_reports_failures(self):
+        self._write_episode(2, 2, '{"steps":[{"reward":')
+        failed, output = self._convert()
+        self.assertEqual([(run_number, ep_number) for run_number, ep_number, _ in failed], [(2, 2)])
+        self.assertIn('Failed to convert episode 2 of run 2', output)
+        np.testing.assert_array_equal(self._run_rewards(2), self._expected(2, (1, 3)))
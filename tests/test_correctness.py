@@ -0,0 +1,84 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import numpy as np
+
+from vaml import correctness
+from vaml.correctness import ACTIONS, load_correctness, parse_labels, sample_labels
+from vaml.data.clean_validation_data import GRID_FILE, GRID_INFO_FILE
+
+
+# Correctness scores match weighting each checkpoint's predictions by hand
+class CorrectnessTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.grids = {}
+        for run_id, samples in ((1, ['straight', 'left', 'right']), (2, ['left', 'straight']), (3, ['left'])):
+            os.mkdir(os.path.join(self.folder, 'run_{}'.format(run_id)))
+            self._save(run_id, samples, np.random.rand(len(samples), 20, ACTIONS))
+
+    def tearDown(self):
+        with correctness.CORRECTNESS_CACHE_LOCK:
+            correctness.CORRECTNESS_CACHE.clear()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def _save(self, run_id, samples, grid):
+        grid = (grid / grid.sum(axis=2, keepdims=True)).astype(np.float32)
+        run_folder = os.path.join(self.folder, 'run_{}'.format(run_id))
+        np.save(os.path.join(run_folder, GRID_FILE), grid)
+        with open(os.path.join(run_folder, GRID_INFO_FILE), 'w') as fh:
+            json.dump({'samples': samples, 'compression': 1000}, fh)
+        self.grids[run_id] = dict(zip(samples, grid))
+
+    def _expected(self, run_id, sample, labels):
+        return np.array([
+            sum(probability * label / 2 for probability, label in zip(checkpoint, labels))
+            for checkpoint in self.grids[run_id][sample]
+        ])
+
+    def test_sample_labels(self):
+        samples = ['straight', 'left']
+        compression, runs = load_correctness(self.folder, [1, 2, 3], samples)
+        self.assertEqual(compression, 1000)
+        # Run 3 has no predictions for the straight sample
+        self.assertEqual([run_id for run_id, _ in runs], [1, 2])
+        for run_id, scores in runs:
+            self.assertEqual(scores.shape, (2, 20))
+            for row, sample in enumerate(samples):
+                np.testing.assert_allclose(scores[row], self._expected(run_id, sample, sample_labels(sample)),
+                                           rtol=1e-5)
+            self.assertTrue(np.all((scores >= 0) & (scores <= 1)))
+
+    def test_custom_labels(self):
+        labels = parse_labels(','.join(['2'] * ACTIONS))
+        _, runs = load_correctness(self.folder, [1], ['right'], [labels])
+        # Every action is good, so each checkpoint scores all of its probability
+        np.testing.assert_allclose(runs[0][1][0], np.ones(20), rtol=1e-5)
+
+        labels = np.zeros(ACTIONS, dtype=np.int8)
+        labels[3] = 1
+        _, runs = load_correctness(self.folder, [1], ['right'], [labels])
+        np.testing.assert_allclose(runs[0][1][0], self._expected(1, 'right', labels), rtol=1e-5)
+
+    def test_invalid_labels(self):
+        for text in ('1,2', ','.join(['3'] * ACTIONS), ','.join(['-1'] * ACTIONS)):
+            with self.assertRaises(ValueError):
+                parse_labels(text)
+        with self.assertRaises(ValueError):
+            load_correctness(self.folder, [1], ['unknown'])
+
+    def test_fed_run_is_scored_again(self):
+        _, before = load_correctness(self.folder, [3], ['left'])
+        time.sleep(0.01)
+        self._save(3, ['left'], np.random.rand(1, 30, ACTIONS))
+        _, after = load_correctness(self.folder, [3], ['left'])
+        self.assertEqual(after[0][1].shape, (1, 30))
+        np.testing.assert_allclose(after[0][1][0], self._expected(3, 'left', sample_labels('left')), rtol=1e-5)
+        self.assertEqual(before[0][1].shape, (1, 20))
+
+
+if __name__ == '__main__':
+    unittest.main()
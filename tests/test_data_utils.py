@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from vaml import pyramid
+from vaml.data_utils import load_run_field_range, range_buckets
+from vaml.pyramid import RUN_FIELD_FORMAT
+
+
+# The picked buckets cover the requested steps with at most `points` buckets
+# of a power of two steps
+class RangeBucketsTest(unittest.TestCase):
+    def test_whole_run_fits(self):
+        self.assertEqual(range_buckets(100, 0, None, 1000), (1, 0, 100))
+
+    def test_covers_the_range(self):
+        for length, start, end, points in ((10000, 0, None, 100), (10000, 123, 4567, 50), (777, 5, 700, 7),
+                                           (1 << 20, 1000, 1 << 19, 1000), (50, 49, 50, 1)):
+            compression, first, count = range_buckets(length, start, end, points)
+            end = length if end is None else end
+            self.assertEqual(compression & (compression - 1), 0)
+            self.assertLessEqual(first * compression, start)
+            self.assertGreaterEqual((first + count) * compression, end)
+            self.assertLessEqual(end - start, compression * points)
+            # The next smaller bucket size would not fit
+            if compression > 1:
+                self.assertGreater(end - start, compression // 2 * points)
+            self.assertLessEqual(count, points + 1)
+
+    def test_range_is_clamped(self):
+        self.assertEqual(range_buckets(100, -10, 500, 1000), (1, 0, 100))
+        self.assertEqual(range_buckets(100, 200, 300, 10), (1, 100, 0))
+        self.assertEqual(range_buckets(100, 60, 40, 10), (1, 40, 0))
+        self.assertEqual(range_buckets(0, 0, None, 10), (1, 0, 0))
+
+
+# Range queries reduce the same steps as reducing the whole run by hand
+class LoadRunFieldRangeTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.folder, 'run_1'))
+        self.steps = np.random.rand(10000)
+        np.save(RUN_FIELD_FORMAT.format(folder=self.folder, run=1, field='rewards'), self.steps)
+
+    def tearDown(self):
+        with pyramid.PYRAMIDS_LOCK:
+            pyramid.PYRAMIDS.clear()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def _expected(self, first_step, compression, count, reduce):
+        return np.array([reduce(self.steps[step:step + compression])
+                         for step in range(first_step, first_step + count * compression, compression)])
+
+    def test_mean_min_max(self):
+        for mode, reduce in (('mean', np.mean), ('min', np.min), ('max', np.max)):
+            first_step, compression, values = load_run_field_range(self.folder, 1, 'rewards', 1234, 5678, 100, mode)
+            self.assertEqual(compression, 64)
+            self.assertEqual(first_step, 1234 // 64 * 64)
+            self.assertEqual(len(values), -(-5678 // 64) - 1234 // 64)
+            np.testing.assert_allclose(values, self._expected(first_step, compression, len(values), reduce))
+
+    def test_envelope(self):
+        first_step, compression, values = load_run_field_range(self.folder, 1, 'rewards', 0, None, 10, 'envelope')
+        self.assertEqual((first_step, compression), (0, 1024))
+        self.assertEqual(values.shape, (3, 10))
+        for row, reduce in enumerate((np.min, np.max, np.mean)):
+            np.testing.assert_allclose(values[row], self._expected(0, 1024, 10, reduce))
+
+    def test_missing_run(self):
+        first_step, compression, values = load_run_field_range(self.folder, 2, 'rewards', 0, None, 10)
+        self.assertEqual((first_step, compression, len(values)), (0, 1, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
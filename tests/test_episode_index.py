@@ -0,0 +1,52 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import numpy as np
+
+from vaml.catalog import _load_run_info
+from vaml.episode_index import INDEX_FORMAT, build_episode_index, find_episode, load_episode_index
+
+
+# Indexes of runs that only have episode files
+class EpisodeIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.run_folder = os.path.join(self.folder, 'run_1')
+        os.mkdir(self.run_folder)
+        for episode_id, length in enumerate([5, 3, 7]):
+            np.save(os.path.join(self.run_folder, 'episode_{}_rewards.npy'.format(episode_id)),
+                    np.arange(length, dtype=np.float64))
+            with open(os.path.join(self.run_folder, 'episode_{}_meta.json'.format(episode_id)), 'w') as fh:
+                json.dump({}, fh)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_index_is_not_a_field(self):
+        build_episode_index(self.folder, 1)
+        self.assertTrue(os.path.exists(INDEX_FORMAT.format(folder=self.folder, run=1)))
+        self.assertNotIn('episodes', _load_run_info(self.folder, 1).fields)
+
+    def test_concurrent_builds(self):
+        errors = []
+        barrier = threading.Barrier(8)
+
+        def build():
+            barrier.wait()
+            try:
+                build_episode_index(self.folder, 1)
+                self.assertEqual(find_episode(load_episode_index(self.folder, 1), 6)[0], 1)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=build) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual([name for name in os.listdir(self.run_folder) if name.endswith('.tmp')], [])
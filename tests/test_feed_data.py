@@ -0,0 +1,43 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from vaml.data.feed_data import DataFeeder
+
+
+# Feeding the episode files of a run without a store
+class DataFeederTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.src_folder = os.path.join(self.folder, 'TOO_FEED', 'run_6')
+        self.dst_folder = os.path.join(self.folder, 'run_1')
+        os.makedirs(self.src_folder)
+        os.mkdir(self.dst_folder)
+        for episode_id in range(1, 6):
+            np.save(os.path.join(self.src_folder, 'episode_{}_rewards.npy'.format(episode_id)),
+                    np.full(episode_id, float(episode_id)))
+            with open(os.path.join(self.src_folder, 'episode_{}_meta.json'.format(episode_id)), 'w') as fh:
+                json.dump({'episode': episode_id}, fh)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_cancelled_feed_keeps_fed_episodes(self):
+        feeder = DataFeeder(self.src_folder, self.dst_folder, 6, 1)
+        index_episode = feeder._index_episode
+
+        # Cancel once the second episode has been fed
+        def cancel_after_second(rewards):
+            index_episode(rewards)
+            if feeder.episode_id == 2:
+                feeder.cancel()
+        feeder._index_episode = cancel_after_second
+        feeder.feed(None)
+
+        rewards = np.load(os.path.join(self.dst_folder, 'run_1_rewards.npy'))
+        np.testing.assert_array_equal(rewards, [1.0, 2.0, 2.0])
+        with open(os.path.join(self.dst_folder, 'run_1_metadata.json'), 'r') as fh:
+            self.assertEqual(json.load(fh), {'episodes': 2, 'total_reward': 5.0, 'total_steps': 3})
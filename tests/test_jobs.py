@@ -0,0 +1,89 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import numpy as np
+
+from vaml.jobs import FeedJobManager
+
+
+# Feed jobs of the TOO_FEED run 6 into a data folder, as /data/jobs and
+# /data/reset start them
+class FeedJobManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        src_folder = os.path.join(self.folder, 'TOO_FEED', 'run_6')
+        os.makedirs(src_folder)
+        for episode_id in range(1, 6):
+            np.save(os.path.join(src_folder, 'episode_{}_rewards.npy'.format(episode_id)),
+                    np.full(episode_id, float(episode_id)))
+            with open(os.path.join(src_folder, 'episode_{}_meta.json'.format(episode_id)), 'w') as fh:
+                json.dump({'episode': episode_id}, fh)
+        os.mkdir(os.path.join(self.folder, 'run_1'))
+        self.jobs = FeedJobManager()
+
+    def tearDown(self):
+        for job in self.jobs.jobs():
+            job.cancel()
+            job.join(5)
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def _wait_for_episodes(self, job, episodes=1):
+        deadline = time.time() + 5
+        while time.time() < deadline and (job.feeder is None or job.feeder.episodes_fed < episodes):
+            time.sleep(0.01)
+        self.assertGreaterEqual(job.feeder.episodes_fed, episodes)
+
+    def test_feed_into_new_run(self):
+        job = self.jobs.start(self.folder, 6, 0.001)
+        job.join(5)
+        status = job.to_json()
+        self.assertEqual(status['state'], 'done')
+        self.assertEqual(status['run'], 2)
+        self.assertEqual((status['episodes'], status['steps']), (5, 15))
+        self.assertFalse(job.running)
+        self.assertEqual(self.jobs.running(), [])
+
+    def test_cancel(self):
+        job = self.jobs.start(self.folder, 6, 10.0)
+        self._wait_for_episodes(job)
+
+        # Cancelling wakes the feed from its delay rather than waiting it out
+        self.assertIs(self.jobs.cancel(job.id), job)
+        job.join(5)
+        self.assertEqual(job.state, 'cancelled')
+        self.assertLess(job.to_json()['episodes'], 5)
+        rewards = np.load(os.path.join(self.folder, 'run_2', 'run_2_rewards.npy'))
+        self.assertEqual(len(rewards), job.feeder.steps_fed)
+
+        self.assertIsNone(self.jobs.cancel(job.id + 1))
+        self.assertIsNone(self.jobs.get(job.id + 1))
+
+    def test_reset_replaces_running_feed(self):
+        first = self.jobs.start(self.folder, 6, 10.0)
+        self._wait_for_episodes(first)
+        self.assertEqual(first.run_id, 2)
+
+        # Replacing the newest run stops the feed writing to it first
+        second = self.jobs.start(self.folder, 6, 0.001, del_last=True)
+        second.join(5)
+        self.assertEqual(first.state, 'cancelled')
+        self.assertEqual(second.state, 'done')
+        self.assertEqual(second.run_id, 2)
+        self.assertEqual(second.to_json()['episodes'], 5)
+        self.assertEqual(len(np.load(os.path.join(self.folder, 'run_2', 'run_2_rewards.npy'))), 15)
+        self.assertFalse(os.path.exists(os.path.join(self.folder, 'run_3')))
+        self.assertEqual([job.id for job in self.jobs.jobs()], [first.id, second.id])
+
+    def test_missing_feed_run_fails(self):
+        job = self.jobs.start(self.folder, 7, None)
+        job.join(5)
+        status = job.to_json()
+        self.assertEqual(status['state'], 'failed')
+        self.assertIsNotNone(status['error'])
+
+
+if __name__ == '__main__':
+    unittest.main()
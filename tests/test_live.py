@@ -0,0 +1,42 @@
+import asyncio
+import json
+import unittest
+
+from vaml.live import handle_subscriptions
+
+
+# A websocket client that sends the given messages, then closes
+class FakeWebSocket:
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.sent = list()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if len(self.messages) == 0:
+            raise StopAsyncIteration
+        return self.messages.pop(0)
+
+    async def send(self, message):
+        self.sent.append(json.loads(message))
+
+
+# Malformed subscription messages get an error and leave the connection open
+class HandleSubscriptionsTest(unittest.TestCase):
+    def test_malformed_messages(self):
+        messages = [
+            'not json',
+            '[1, 2]',
+            json.dumps({'field': 'rewards', 'compression': 10}),
+            json.dumps({'run': 1, 'field': 'rewards', 'compression': 'x'}),
+            json.dumps({'run': 1, 'field': 'rewards', 'compression': 0}),
+            json.dumps({'action': 'replay', 'run': 1, 'field': 'rewards', 'compression': 10}),
+            json.dumps({'action': 'unsubscribe', 'run': 1, 'field': 'rewards'}),
+        ]
+        websocket = FakeWebSocket(messages)
+        asyncio.run(handle_subscriptions(websocket, None, '/nonexistent'))
+        self.assertEqual(websocket.messages, [])
+        self.assertEqual(len(websocket.sent), 6)
+        self.assertTrue(all('error' in message for message in websocket.sent))
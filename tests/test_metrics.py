@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from unittest import mock
+
+from vaml import metrics
+from vaml.metrics import MetricsState, load_metrics, load_metrics_numpy
+
+
+# Percentile bands across the runs of a data folder
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.runs = {}
+        for run_id, value in ((1, 1.0), (2, 2.0), (3, 100.0)):
+            run_folder = os.path.join(self.folder, 'run_{}'.format(run_id))
+            os.mkdir(run_folder)
+            self.runs[run_id] = np.full(100, value)
+            np.save(os.path.join(run_folder, 'run_{}_rewards.npy'.format(run_id)), self.runs[run_id])
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_default_bands_leave_out_the_newest_run(self):
+        bands, counts = load_metrics_numpy(self.folder, 10)
+        np.testing.assert_array_equal(counts, np.full(10, 2))
+        np.testing.assert_allclose(bands[1], np.full(10, 1.5))
+        self.assertEqual(load_metrics(self.folder, 10)['count'], [2] * 10)
+
+    def test_all_group_includes_the_newest_run(self):
+        bands, counts = load_metrics_numpy(self.folder, 10, group='all')
+        np.testing.assert_array_equal(counts, np.full(10, 3))
+        np.testing.assert_allclose(bands[1], np.full(10, 2.0))
+
+
+# Updating the state as runs grow gives the same bands as starting afresh,
+# while only computing the columns that changed
+class MetricsStateTest(unittest.TestCase):
+    PERCENTILES = (0, 25, 50, 75, 100)
+
+    def setUp(self):
+        self.runs = {run_id: np.random.rand(size) for run_id, size in ((1, 50), (2, 80), (3, 30))}
+
+    def _assert_matches_fresh(self, state):
+        fresh = MetricsState(self.runs.keys())
+        fresh.update(dict(self.runs))
+        np.testing.assert_array_equal(state.matrix, fresh.matrix)
+        np.testing.assert_array_equal(state.counts, fresh.counts)
+        np.testing.assert_allclose(state.bands(self.PERCENTILES), fresh.bands(self.PERCENTILES))
+
+    def _update(self, state):
+        with mock.patch.object(metrics, 'masked_percentiles', wraps=metrics.masked_percentiles) as computed:
+            state.update(dict(self.runs))
+            state.bands(self.PERCENTILES)
+        return sum(call[0][0].shape[1] for call in computed.call_args_list)
+
+    def test_appended_steps(self):
+        state = MetricsState(self.runs.keys())
+        self.assertEqual(self._update(state), 80)
+
+        # Growing the shortest run only recomputes its new columns
+        self.runs[3] = np.concatenate((self.runs[3], np.random.rand(20)))
+        self.assertEqual(self._update(state), 80 - 30)
+        self._assert_matches_fresh(state)
+
+        # Growing past the longest run adds columns
+        self.runs[2] = np.concatenate((self.runs[2], np.random.rand(40)))
+        self.assertEqual(self._update(state), 120 - 80)
+        self.assertEqual(state.length, 120)
+        self._assert_matches_fresh(state)
+
+    def test_changed_bucket(self):
+        state = MetricsState(self.runs.keys())
+        self._update(state)
+
+        # The last bucket of a run is refilled as its episodes come in
+        self.runs[1] = self.runs[1].copy()
+        self.runs[1][45] += 1
+        self.assertEqual(self._update(state), 80 - 45)
+        self._assert_matches_fresh(state)
+
+    def test_unchanged_runs(self):
+        state = MetricsState(self.runs.keys())
+        self._update(state)
+        self.assertEqual(self._update(state), 0)
+        self._assert_matches_fresh(state)
+
+    def test_shrunk_run(self):
+        state = MetricsState(self.runs.keys())
+        self._update(state)
+
+        # A replaced run can be shorter than the run it replaced, which only
+        # drops the columns past its new end
+        self.runs[2] = self.runs[2][0:60]
+        self.assertEqual(self._update(state), 0)
+        self.assertEqual(state.length, 60)
+        self._assert_matches_fresh(state)
@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import numpy as np
+
+from vaml.data.clean_validation_data import GRID_FILE, GRID_INFO_FILE
+from vaml.data_utils import load_prediction_grid
+
+
+# Grids of runs converted before grids existed are built by the first request
+class LazyPredictionGridTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.run_folder = os.path.join(self.folder, 'run_1')
+        os.mkdir(self.run_folder)
+        for sample in ('left', 'right', 'straight'):
+            np.save(os.path.join(self.run_folder, 'predictions_{}.npy'.format(sample)),
+                    np.random.rand(200, 40).astype(np.float32))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_concurrent_build(self):
+        errors = []
+        results = []
+        barrier = threading.Barrier(8)
+
+        def load():
+            barrier.wait()
+            try:
+                results.append(load_prediction_grid(self.folder, 1))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=load) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results), 8)
+        for samples, compression, grid in results:
+            self.assertEqual(samples, ['left', 'right', 'straight'])
+            self.assertEqual(grid.shape, (3, 200, 40))
+        # No temporary files are left behind
+        names = os.listdir(self.run_folder)
+        self.assertIn(GRID_FILE, names)
+        self.assertIn(GRID_INFO_FILE, names)
+        self.assertEqual([name for name in names if name.endswith('.tmp')], [])
@@ -0,0 +1,37 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from vaml import pyramid
+from vaml.pyramid import RUN_FIELD_FORMAT, get_run_pyramid
+
+
+# The process-wide pyramids stay within their byte budget
+class PyramidCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.budget = pyramid.PYRAMID_CACHE_BYTES
+        self.steps = {}
+        for run_id in range(1, 4):
+            os.mkdir(os.path.join(self.folder, 'run_{}'.format(run_id)))
+            steps = np.random.rand(10000)
+            np.save(RUN_FIELD_FORMAT.format(folder=self.folder, run=run_id, field='rewards'), steps)
+            self.steps[run_id] = steps
+
+    def tearDown(self):
+        pyramid.PYRAMID_CACHE_BYTES = self.budget
+        with pyramid.PYRAMIDS_LOCK:
+            pyramid.PYRAMIDS.clear()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def test_least_recently_used_are_evicted(self):
+        first = get_run_pyramid(self.folder, 1, 'rewards', self.steps[1])
+        pyramid.PYRAMID_CACHE_BYTES = first.nbytes * 2
+        for run_id in (2, 3, 1):
+            result = get_run_pyramid(self.folder, run_id, 'rewards', self.steps[run_id])
+            np.testing.assert_allclose(result.reduce(self.steps[run_id], 1000),
+                                       self.steps[run_id].reshape(-1, 1000).mean(axis=1))
+        keys = [key[1] for key in pyramid.PYRAMIDS]
+        self.assertEqual(keys, ['3', '1'])
@@ -0,0 +1,69 @@
+import unittest
+import numpy as np
+
+from vaml.pyramid import RunPyramid
+from vaml.reducers import LTTB_OVERSAMPLE, lttb, reduce_run
+
+
+def _buckets(steps, compression):
+    padding = (-steps.size) % compression
+    return [steps[start:start + compression] for start in range(0, steps.size + padding, compression)]
+
+
+# Reducers against computing each bucket directly from the steps
+class ReducersTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.steps = rng.normal(size=100003)
+        self.pyramid = RunPyramid()
+        self.pyramid.update(self.steps)
+
+    def test_bucket_modes(self):
+        for compression in (1, 7, 64, 1000, 4096):
+            for mode, function in (('mean', np.mean), ('min', np.min), ('max', np.max)):
+                expected = [function(bucket) for bucket in _buckets(self.steps, compression)]
+                np.testing.assert_allclose(reduce_run(self.pyramid, self.steps, compression, mode=mode), expected)
+
+    def test_envelope(self):
+        buckets = _buckets(self.steps, 1000)
+        envelope = reduce_run(self.pyramid, self.steps, 1000, first=10, count=20, mode='envelope')
+        expected = [[function(bucket) for bucket in buckets[10:30]] for function in (np.min, np.max, np.mean)]
+        np.testing.assert_allclose(envelope, expected)
+
+    def test_lttb_points_are_at_their_steps(self):
+        for compression in (5, 1000, 960):
+            points = reduce_run(self.pyramid, self.steps, compression, mode='lttb')
+            self.assertEqual(points.shape, (2, -(-self.steps.size // compression)))
+            steps = points[0].astype(np.int64)
+            np.testing.assert_array_equal(steps, points[0])
+            self.assertTrue(np.all(np.diff(steps) > 0))
+            np.testing.assert_array_equal(self.steps[steps - 1], points[1])
+
+    def test_lttb_matches_naive(self):
+        compression = 1000
+        fine = compression // 20
+        self.assertGreaterEqual(compression // fine, LTTB_OVERSAMPLE)
+
+        # Candidates from the raw steps, picked at the end of their bucket and
+        # then moved to the step they are at
+        buckets = _buckets(self.steps, fine)
+        ends = np.minimum(np.arange(1, len(buckets) + 1) * fine, self.steps.size)
+        x = np.repeat(ends, 2).astype(np.float64)
+        y = np.array([[bucket.min(), bucket.max()] for bucket in buckets]).reshape(-1)
+        picked = lttb(x, y, -(-len(buckets) // 20))
+        exact = [
+            index * fine + (np.argmin if candidate % 2 == 0 else np.argmax)(buckets[index]) + 1
+            for index, candidate in zip(picked // 2, picked)
+        ]
+        points = reduce_run(self.pyramid, self.steps, compression, mode='lttb')
+        np.testing.assert_array_equal(points[0], np.sort(exact))
+        np.testing.assert_array_equal(points[1], self.steps[np.sort(exact) - 1])
+
+    def test_lttb_keeps_spikes(self):
+        steps = np.zeros(100000)
+        steps[12345] = 50.0
+        pyramid = RunPyramid()
+        pyramid.update(steps)
+        points = reduce_run(pyramid, steps, 1000, mode='lttb')
+        self.assertIn(12346, points[0].tolist())
+        self.assertEqual(points[1].max(), 50.0)
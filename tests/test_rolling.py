@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+from vaml import rolling
+from vaml.pyramid import RUN_FIELD_FORMAT
+from vaml.rolling import RunCumulativeSums, get_run_sums
+
+
+# The process-wide cumulative sums stay within their byte budget
+class CumulativeSumsCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.budget = rolling.CUMULATIVE_SUMS_BYTES
+        self.steps = {}
+        for run_id in range(1, 4):
+            os.mkdir(os.path.join(self.folder, 'run_{}'.format(run_id)))
+            self.steps[run_id] = self._save(run_id, np.random.rand(10000))
+
+    def tearDown(self):
+        rolling.CUMULATIVE_SUMS_BYTES = self.budget
+        with rolling.CUMULATIVE_SUMS_LOCK:
+            rolling.CUMULATIVE_SUMS.clear()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def _save(self, run_id, steps):
+        filename = RUN_FIELD_FORMAT.format(folder=self.folder, run=run_id, field='rewards')
+        temp_filename = filename + '.new.npy'
+        np.save(temp_filename, steps)
+        os.replace(temp_filename, filename)
+        return steps
+
+    def test_least_recently_used_are_evicted(self):
+        first = get_run_sums(self.folder, 1, 'rewards', self.steps[1])
+        rolling.CUMULATIVE_SUMS_BYTES = first.nbytes * 2
+        for run_id in (2, 3, 1):
+            sums = get_run_sums(self.folder, run_id, 'rewards', self.steps[run_id])
+            np.testing.assert_allclose(sums.rolling(self.steps[run_id], 'mean', 1000, 1000, None),
+                                       self.steps[run_id].reshape(-1, 1000).mean(axis=1))
+        self.assertEqual([key[1] for key in rolling.CUMULATIVE_SUMS], ['3', '1'])
+
+    def test_replaced_run_starts_over(self):
+        old = get_run_sums(self.folder, 1, 'rewards', self.steps[1])
+        steps = self._save(1, np.random.rand(20000))
+        new = get_run_sums(self.folder, 1, 'rewards', steps)
+        self.assertIsNot(old, new)
+        self.assertEqual(new.length, 20000)
+        self.assertEqual(len(rolling.CUMULATIVE_SUMS), 1)
+
+
+# Rolling statistics against computing each window directly
+class RollingStatisticsTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        # A drifting signal with a constant stretch, fed in two parts
+        self.steps = np.concatenate((rng.random(200000) * 10 + np.linspace(0, 500, 200000), np.full(50, 3.25)))
+        self.sums = RunCumulativeSums()
+        self.sums.update(self.steps[0:123457])
+        self.sums.update(self.steps)
+
+    def _ends(self, compression):
+        return np.minimum(np.arange(1, -(-self.steps.size // compression) + 1) * compression, self.steps.size)
+
+    def _naive(self, function, compression, window):
+        ends = self._ends(compression)
+        return np.array([function(self.steps[max(end - window, 0):end]) for end in ends])
+
+    def test_mean_and_std(self):
+        for compression, window in ((1000, 1000), (1000, 250), (997, 5000), (50, 1)):
+            for stat, function in (('mean', np.mean), ('std', np.std)):
+                values = self.sums.rolling(self.steps, stat, compression, window, None)
+                np.testing.assert_allclose(values, self._naive(function, compression, window), rtol=1e-9, atol=1e-9)
+
+    def test_single_step_std_is_zero(self):
+        values = self.sums.rolling(self.steps, 'std', 1, 1, None)
+        self.assertLess(np.abs(values).max(), 1e-9)
+
+    def test_ewma(self):
+        for alpha in (1.0, 0.5, 0.01, 0.0001):
+            expected = np.zeros(self.steps.size)
+            expected[0] = self.steps[0]
+            for index in range(1, self.steps.size):
+                expected[index] = alpha * self.steps[index] + (1 - alpha) * expected[index - 1]
+            values = self.sums.rolling(self.steps, 'ewma', 1000, None, alpha)
+            np.testing.assert_allclose(values, expected[self._ends(1000) - 1], rtol=1e-9)
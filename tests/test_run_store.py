@@ -0,0 +1,100 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import numpy as np
+
+from vaml import run_store
+from vaml.data_utils import load_episode_field_numpy, load_episode_metadata
+from vaml.run_store import (EP_FIELD_FORMAT, EP_METADATA_FORMAT, STORE_FORMAT, RunStore, import_run,
+                            load_run_store, write_run_store)
+
+
+# Episodes read back out of a run store match what was written
+class RunStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.run_folder = os.path.join(self.folder, 'run_1')
+        os.mkdir(self.run_folder)
+        self.filename = STORE_FORMAT.format(folder=self.folder, run=1)
+
+    def tearDown(self):
+        with run_store.STORE_CACHE_LOCK:
+            run_store.STORE_CACHE.clear()
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+    def _episodes(self, episode_ids):
+        return [
+            (episode_id, {'episode': episode_id, 'reward': float(episode_id)},
+             {'rewards': np.random.rand(episode_id * 3), 'actions': np.arange(episode_id * 3, dtype=np.float64)})
+            for episode_id in episode_ids
+        ]
+
+    def test_round_trip(self):
+        episodes = self._episodes([2, 0, 7, 5])
+        write_run_store(self.filename, episodes, ('rewards', 'actions'))
+
+        store = RunStore(self.filename)
+        self.assertEqual(list(store.episode_ids), [2, 0, 7, 5])
+        self.assertEqual(sorted(store.fields), ['actions', 'rewards'])
+        self.assertEqual(store.steps, 3 * (2 + 0 + 7 + 5))
+        for episode_id, metadata, columns in episodes:
+            self.assertTrue(store.has_episode(episode_id))
+            self.assertEqual(store.episode_metadata(episode_id), metadata)
+            for field in ('rewards', 'actions'):
+                np.testing.assert_array_equal(store.episode_field(episode_id, field), columns[field])
+        np.testing.assert_array_equal(store.field('rewards'),
+                                      np.concatenate([c['rewards'] for _, _, c in episodes]))
+
+        self.assertFalse(store.has_episode(3))
+        self.assertIsNone(store.episode_field(3, 'rewards'))
+        self.assertIsNone(store.episode_field(2, 'values'))
+        self.assertIsNone(store.episode_metadata(3))
+
+    def test_empty_store(self):
+        write_run_store(self.filename, [])
+        store = RunStore(self.filename)
+        self.assertEqual(len(store.episode_ids), 0)
+        self.assertEqual(len(store.field('rewards')), 0)
+
+    def test_not_a_store(self):
+        with open(self.filename, 'wb') as fh:
+            fh.write(b'not a store at all')
+        with self.assertRaises(ValueError):
+            RunStore(self.filename)
+
+    def test_import_run(self):
+        episodes = self._episodes([1, 2, 3])
+        for episode_id, metadata, columns in episodes:
+            with open(EP_METADATA_FORMAT.format(folder=self.run_folder, id=episode_id), 'w') as fh:
+                json.dump(metadata, fh)
+            np.save(EP_FIELD_FORMAT.format(folder=self.run_folder, id=episode_id, field='rewards'),
+                    columns['rewards'])
+
+        self.assertIsNone(load_run_store(self.folder, 1))
+        self.assertEqual(import_run(self.folder, 1, remove_episodes=True), 3)
+        self.assertEqual(os.listdir(self.run_folder), [os.path.basename(self.filename)])
+
+        # Readers go through the store once the episode files are gone
+        for episode_id, metadata, columns in episodes:
+            self.assertEqual(load_episode_metadata(self.folder, 1, episode_id), metadata)
+            np.testing.assert_array_equal(load_episode_field_numpy(self.folder, 1, episode_id, 'rewards'),
+                                          columns['rewards'])
+
+    def test_replaced_store_is_reopened(self):
+        write_run_store(self.filename, self._episodes([1]))
+        first = load_run_store(self.folder, 1)
+        self.assertIs(load_run_store(self.folder, 1), first)
+
+        time.sleep(0.01)
+        write_run_store(self.filename, self._episodes([1, 2]))
+        second = load_run_store(self.folder, 1)
+        self.assertIsNot(second, first)
+        self.assertEqual(list(second.episode_ids), [1, 2])
+        self.assertEqual(list(first.episode_ids), [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
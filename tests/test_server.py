@@ -0,0 +1,125 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+import numpy as np
+
+from vaml.http_cache import http_date
+from vaml.pyramid import RUN_FIELD_FORMAT
+from vaml.server import VamlServer
+
+
+PORT = 18950
+
+
+# Runs a server against an empty data folder
+class EmptyFolderServerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.folder = tempfile.mkdtemp()
+        cls.server = VamlServer('localhost', PORT, PORT + 1, folder=cls.folder, warmup_budget=0)
+        threading.Thread(target=cls.server.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.server.shutdown()
+        cls.server.server.server_close()
+        cls.server.compute_pool.shutdown(wait=False)
+        shutil.rmtree(cls.folder, ignore_errors=True)
+
+    def _get(self, path, headers=None):
+        request = urllib.request.Request('http://localhost:{}{}'.format(PORT, path), headers=headers or {})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, response.headers, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers, e.read()
+
+    def test_empty_2d_f32_response(self):
+        status, headers, body = self._get('/data/metrics?compression=1000&format=f32')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['X-Array-Shape'], '4,0')
+        self.assertEqual(body, b'')
+
+    def test_empty_3d_f32_response(self):
+        status, headers, body = self._get('/data/prediction_grids?runs=all&format=f32')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['X-Array-Shape'], '0,0,0')
+        self.assertEqual(body, b'')
+
+    def test_requests_without_parameters(self):
+        for path in ('/data/prediction_grids', '/data/correctness'):
+            status, headers, body = self._get(path)
+            self.assertEqual(status, 200)
+
+    def test_gzip_body_has_its_own_etag(self):
+        path = '/data/metrics?compression=1&percentiles=' + ','.join(str(p) for p in range(101))
+        _, plain, _ = self._get(path)
+        status, gzipped, _ = self._get(path, {'Accept-Encoding': 'gzip'})
+        self.assertEqual(status, 200)
+        self.assertEqual(gzipped['Content-Encoding'], 'gzip')
+        self.assertEqual(gzipped['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzipped['ETag'], plain['ETag'][:-1] + '-gzip"')
+
+        # Each validator only matches its own encoding
+        status, _, _ = self._get(path, {'Accept-Encoding': 'gzip', 'If-None-Match': gzipped['ETag']})
+        self.assertEqual(status, 304)
+        status, _, _ = self._get(path, {'If-None-Match': gzipped['ETag']})
+        self.assertEqual(status, 200)
+
+    def test_run_field_range(self):
+        os.mkdir(os.path.join(self.folder, 'run_9'))
+        steps = np.arange(1000, dtype=np.float64)
+        np.save(RUN_FIELD_FORMAT.format(folder=self.folder, run=9, field='rewards'), steps)
+        try:
+            status, _, body = self._get('/data/run_field?run=9&field=rewards&start=100&end=300&points=50')
+            self.assertEqual(status, 200)
+            result = json.loads(body)
+            self.assertEqual((result['first_step'], result['compression']), (100, 4))
+            self.assertEqual(result['values'], [100 + 1.5 + 4 * idx for idx in range(50)])
+
+            status, headers, body = self._get('/data/run_field?run=9&field=rewards&start=100&end=300&points=50'
+                                              '&mode=envelope&format=f32')
+            self.assertEqual(status, 200)
+            self.assertEqual(headers['X-Array-Shape'], '3,50')
+            self.assertEqual(headers['X-Array-First-Step'], '100')
+            self.assertEqual(headers['X-Array-Compression'], '4')
+            np.testing.assert_array_equal(np.frombuffer(body, dtype=np.float32).reshape(3, 50)[0],
+                                          np.arange(100, 300, 4))
+        finally:
+            shutil.rmtree(os.path.join(self.folder, 'run_9'))
+
+    def test_static_file_last_modified(self):
+        status, headers, _ = self._get('/styles.css')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers['Last-Modified'], http_date(os.stat('www/styles.css').st_mtime))
+
+        status, _, body = self._get('/styles.css', {'If-Modified-Since': headers['Last-Modified']})
+        self.assertEqual((status, body), (304, b''))
+        status, _, _ = self._get('/styles.css', {'If-Modified-Since': http_date(0)})
+        self.assertEqual(status, 200)
+
+    def test_invalid_compression(self):
+        for path in ('/data/metrics?compression=0', '/data/metrics?compression=-5', '/data/metrics?compression=x',
+                     '/data/metrics', '/data/run_field?run=1&field=rewards&compression=0',
+                     '/data/run_fields?runs=all&field=rewards&compression=-1',
+                     '/data/run_field?run=1&field=rewards&points=0',
+                     '/data/run_rolling?run=1&field=rewards&compression=0',
+                     '/data/run_rolling?run=1&field=rewards&stat=std'):
+            status, _, body = self._get(path)
+            self.assertEqual(status, 400, path)
+            self.assertIn('error', json.loads(body))
+
+    def test_missing_run_or_field(self):
+        for path in ('/data/run_field', '/data/run_field?run=1&compression=10', '/data/run_fields?compression=10',
+                     '/data/run_rolling?field=rewards&compression=10'):
+            status, _, body = self._get(path)
+            self.assertEqual(status, 400, path)
+
+
+if __name__ == '__main__':
+    unittest.main()
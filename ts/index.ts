@@ -1,15 +1,20 @@
 // Author: Grant Fennessy
 
 // - Constants -
+// Run constants are replaced from the server's run catalog on startup
 let ALL_RUN_COUNT = 6
 let FINISHED_RUN_COUNT = 5
 let CURRENT_RUN_ID = 6
+let RUN_IDS = [1, 2, 3, 4, 5, 6]
 let DATA_COMPRESSION_LINES = 1000
 let DATA_COMPRESSION_SHAPE = 1000
 let DATA_COMPRESSION_PREDICTIONS = 10000
 let EWMA_BETA_LINES = 0.03
 let EWMA_BETA_SHAPE = 0.03
 
+// Filled in by the server when serving the page
+declare let WEBSOCKET_PORT: number
+
 let NUM_ACTIONS = 40
 let THROTTLE_ACTIONS = 8
 let STEER_ACTIONS = 5
@@ -239,6 +244,22 @@ class DataRunField extends DataField {
   }
 }
 
+// A run as listed in the server's run catalog
+class RunSummary {
+  id: number
+  episodes: number
+  steps: number
+  fields: string[]
+  live: boolean
+  constructor(id: number, episodes: number, steps: number, fields: string[], live: boolean) {
+    this.id = id
+    this.episodes = episodes
+    this.steps = steps
+    this.fields = fields
+    this.live = live
+  }
+}
+
 // Contains fields for multiple runs
 class DataAllRunFields extends DataFieldI {
     runs: DataRunField[]
@@ -286,30 +307,31 @@ class DataMetrics extends DataFieldI {
 class Prediction {
   // The 0-1 probability of the action being taken -> softmax result
   data: number[]
-  // Probabilities normalized so highest probability is 1 and lowest is 0
-  dataNormalized: number[]
   // correctness value (0 to 1)
   correctness: number
+  private _dataNormalized: number[]
 
-  static build(data: number[], labels: number[]) {
-    // let max = data.reduce((p, v) => v > p ? v : p, data[0])
-    // this.dataNormalized = data.map(v => v / max)
-    let dataNormalized = normalizeValues(data)
-
-    // // Measure the correctness
-    let score = data.map((probability, index) => {
-      // Label is 0 (wrong = 0 points), 1 (neutral = 0.5 points), or 2 (good = 1 point)
-      return probability * (labels[index] / 2)
-    })
-    let correctness = score.reduce((p, c) => p + c, 0)
-    return new Prediction(data, dataNormalized, correctness)
+  // The correctness is scored against the sample's labels by the server
+  // (see `/data/correctness`), where label 0 (wrong) is worth 0 points,
+  // 1 (neutral) 0.5 points and 2 (good) 1 point.
+  static build(data: number[], correctness: number) {
+    return new Prediction(data, undefined, correctness)
   }
 
   constructor(data: number[], dataNormalized: number[], correctness: number) {
     this.data = data
-    this.dataNormalized = dataNormalized
+    this._dataNormalized = dataNormalized
     this.correctness = correctness
   }
+
+  // Probabilities normalized so highest probability is 1 and lowest is 0.
+  // Only worked out for the predictions that are actually shown.
+  get dataNormalized(): number[] {
+    if (this._dataNormalized === undefined) {
+      this._dataNormalized = normalizeValues(this.data)
+    }
+    return this._dataNormalized
+  }
 }
 
 // The name of a sample, along with its user-defined labels (bad, neutral, or good)
@@ -411,13 +433,29 @@ class EpisodeEvent {
 class DataCollector {
 
   // Converts an array of numbers into points, where the index is stored in the X value
-  private _arrayToPoints(values: number[], compression: number): Point[] {
+  private _arrayToPoints(values: ArrayLike<number>, compression: number): Point[] {
     let points: Point[] = []
-    values.forEach((value, index) =>
-      points.push(new Point((index + 1) * compression, value)))
+    for (let index = 0; index < values.length; index++) {
+      points.push(new Point((index + 1) * compression, values[index]))
+    }
     return points
   }
 
+  // Rejects error responses, rather than decoding their bodies as data
+  private _checkOk(response: Response): Response {
+    if (!response.ok) {
+      throw new Error('Request for ' + response.url + ' failed: ' + response.status)
+    }
+    return response
+  }
+
+  // Reads a raw float32 array response, returning the values along with the
+  // response headers (which hold the shape and any keys)
+  private async _readFloat32(response: Response): Promise<[Float32Array, Headers]> {
+    return this._checkOk(response).arrayBuffer()
+      .then(buffer => [new Float32Array(buffer), response.headers] as [Float32Array, Headers])
+  }
+
   // For a given run, loads all values in the provided field
   // (such as rewards).  Data is then compressed, where steps are bucketized
   // by mean so as to reduce data requirements with millions of steps.
@@ -425,9 +463,10 @@ class DataCollector {
     let atp = this._arrayToPoints
     return fetch('data/run_field?run=' + run
                  + '&compression=' + compression
-                 + '&field=' + field)
-        .then(response => response.json() )
-        .then(function(values) {
+                 + '&field=' + field
+                 + '&format=f32')
+        .then(response => this._readFloat32(response) )
+        .then(function([values, _]) {
           return atp(values, compression)
         })
         .then(function(points) {
@@ -435,35 +474,58 @@ class DataCollector {
         })
   }
 
-  // Returns the individual run data for all runs
+  // Returns the individual run data for all runs, loaded in a single request
   async getAllRunFields(compression: number, field: string): Promise<DataAllRunFields> {
-    let promises = []
-    console.error("Need to determine number of runs")
-    // TODO - query to get number of groups
-    for (let run_id = 1; run_id <= ALL_RUN_COUNT; run_id++) {
-      promises.push(this.getRunField(run_id, compression, field))
-    }
-    return Promise.all(promises)
-      .then(function(all_runs: DataRunField[]) {
-        return new DataAllRunFields(all_runs)
+    let atp = this._arrayToPoints
+    return fetch('data/run_fields?runs=all'
+                 + '&compression=' + compression
+                 + '&field=' + field
+                 + '&format=f32')
+        .then(response => this._readFloat32(response) )
+        .then(function([values, headers]) {
+          // Runs are sent back to back
+          let runs = headers.get('X-Array-Runs').split(',')
+          let lengths = headers.get('X-Array-Lengths').split(',').map(it => parseInt(it))
+          let offset = 0
+          return runs.map((run_id, index) => {
+            let run = values.subarray(offset, offset + lengths[index])
+            offset += lengths[index]
+            return new DataRunField(parseInt(run_id), field, atp(run, compression))
+          })
+        })
+        .then(function(all_runs: DataRunField[]) {
+          return new DataAllRunFields(all_runs)
+        })
+  }
+
+  // Lists the runs in the data folder
+  async getRuns(): Promise<RunSummary[]> {
+    return fetch('data/runs')
+      .then(response => this._checkOk(response).json())
+      .then(function(runs: any[]) {
+        return runs.map(run => new RunSummary(run.id, run.episodes, run.steps, run.fields, run.live))
       })
   }
 
   async resetCurrent(): Promise<void> {
     return fetch('data/reset')
-      .then(function(response) { return response.json(); })
+      .then(response => this._checkOk(response).json())
   }
 
   // Returns metrics, which includes rewards percentiles.
+  // The bands are of the runs before the newest, which is drawn against them
   async getMetrics(compression: number): Promise<DataMetrics> {
     let atp = this._arrayToPoints
-    return fetch('data/metrics?compression=' + compression)
-        .then(function(response) { return response.json(); })
-        .then(function(metrics) {
+    return fetch('data/metrics?compression=' + compression + '&group=previous&format=f32')
+        .then(response => this._readFloat32(response) )
+        .then(function([values, headers]) {
+          // One row per percentile
+          let keys = headers.get('X-Array-Keys').split(',')
+          let length = parseInt(headers.get('X-Array-Shape').split(',')[1])
           let data: any = {}
-          for (let key in metrics) {
-            data[key] = atp(metrics[key], compression)
-          }
+          keys.forEach((key, index) => {
+            data[key] = atp(values.subarray(index * length, (index + 1) * length), compression)
+          })
           return data
         })
         .then(function(metrics) {
@@ -477,73 +539,85 @@ class DataCollector {
     return Promise.resolve(samples)
   }
 
-  // Returns the entire set of predictions for a sample within a run.
-  // Basically, how well did this experiment within the batch handle the given sample over training?
-  // TODO - needs to eventually be something where you pass in specific runs
-  async getPredictionsForRun(
-    run_id: number,
-    sample: Sample,
-    compression: number
-  ): Promise<PredictionsForRun> {
-    // TODO - SINCE THIS IS MOCK
-    run_id = 6
-    return fetch('data/predictions?run=' + run_id + '&sample=' + sample.name.toLowerCase())
-        .then(response => response.json() )
-        .then(data => {
-          let steps = data.map(preds => {
-            let new_preds = new Array(40).fill(0)
-            for (let idx = 0; idx < 40; idx++) {
-              let col = idx % 5
-              let row = 7 - (Math.floor(idx / 5))
-              let new_idx = col + row * 5
-              new_preds[new_idx] = preds[idx]
-            }
-            return Prediction.build(new_preds, sample.labels)
-          })
-          return new PredictionsForRun(sample, run_id, steps)
-        })
-  }
-
-  // Returns predictions for all runs.
-  async getSamplePredictionsAllRuns(
-    sample: Sample,
-    compression: number
-  ): Promise<PredictionsAllRuns> {
-    let promises: Promise<PredictionsForRun>[] = []
-    for (let run_id = 1; run_id <= ALL_RUN_COUNT; run_id++) {
-      promises.push(this.getPredictionsForRun(run_id, sample, compression))
-    }
-    return Promise.all(promises)
-      .then(values => {
-        let filtered = values.filter(it => {
-          return it.predictions.length > 0
-        })
-        return new PredictionsAllRuns(sample, filtered)
-      })
-  }
-
-  // Within an experiment group, returns data for all runs against all samples
+  // Within an experiment group, returns data for all runs against all samples.
+  // Every sample of every run comes back in one request, with the actions
+  // already remapped into grid order by the server, and its correctness in
+  // a second request made alongside it.
   async getSampleDataRepo(
     compression: number
   ): Promise<SampleDataRepo> {
     return this.getAllSamples().then(samples => {
-      let promises: Promise<PredictionsAllRuns>[] = []
-      samples.forEach(sample => {
-        promises.push(this.getSamplePredictionsAllRuns(sample, compression))
-      })
-      return Promise
-        .all(promises)
-        .then(values => {
-          let filtered = values.filter(it => {
-            return it.runs.length > 0
+      let names = samples.map(sample => sample.name.toLowerCase()).join(',')
+      let labels = samples.map(sample => sample.labels.join(',')).join(';')
+      return Promise.all([
+        fetch('data/prediction_grids?runs=all&samples=' + names + '&format=f32')
+          .then(response => this._readFloat32(response) ),
+        fetch('data/correctness?runs=all&samples=' + names + '&labels=' + labels + '&format=f32')
+          .then(response => this._readFloat32(response) )
+      ])
+        .then(([[values, headers], [correctness, _]]) => {
+          // The values are (samples, checkpoints, actions), with the runs
+          // joined along the checkpoints, and the correctness (samples,
+          // checkpoints).  Both leave out the same runs, those without
+          // predictions for every sample.
+          let shape = headers.get('X-Array-Shape').split(',').map(it => parseInt(it))
+          let runs = headers.get('X-Array-Runs') ? headers.get('X-Array-Runs').split(',') : []
+          let lengths = runs.length > 0 ? headers.get('X-Array-Lengths').split(',').map(it => parseInt(it)) : []
+          let checkpoints = shape[1]
+          let actions = shape[2]
+          let data = samples.map((sample, sampleIndex) => {
+            let first = 0
+            let runPredictions = runs.map((run_id, runIndex) => {
+              let predictions: Prediction[] = []
+              for (let checkpoint = first; checkpoint < first + lengths[runIndex]; checkpoint++) {
+                let offset = (sampleIndex * checkpoints + checkpoint) * actions
+                predictions.push(Prediction.build(
+                  Array.from(values.subarray(offset, offset + actions)),
+                  correctness[sampleIndex * checkpoints + checkpoint]
+                ))
+              }
+              first += lengths[runIndex]
+              return new PredictionsForRun(sample, parseInt(run_id), predictions)
+            })
+            return new PredictionsAllRuns(sample, runPredictions.filter(it => it.predictions.length > 0))
           })
-          return new SampleDataRepo(filtered)
+          return new SampleDataRepo(data.filter(it => it.runs.length > 0))
         })
     })
   }
 
 }
 
+// Subscribes to a run field over the websocket.  The server pushes only the
+// buckets that changed since its last message, starting at `start`, which are
+// merged into the stored values before the callback is given the full run.
+class LiveRunFeed {
+  private _socket: WebSocket
+  private _values: number[] = []
+
+  constructor(run: number, compression: number, field: string, callback: (runData: DataRunField) => void) {
+    this._socket = new WebSocket('ws://' + window.location.hostname + ':' + WEBSOCKET_PORT)
+    this._socket.onopen = () => {
+      this._socket.send(JSON.stringify({
+        action: 'subscribe',
+        run: run,
+        field: field,
+        compression: compression
+      }))
+    }
+    this._socket.onmessage = (event) => {
+      let delta = JSON.parse(event.data)
+      if (delta.error !== undefined) {
+        console.log('Live feed error: ' + delta.error)
+        return
+      }
+      this._values = this._values.slice(0, delta.start).concat(delta.values)
+      let points = this._values.map((value, index) => new Point((index + 1) * compression, value))
+      callback(new DataRunField(run, field, points))
+    }
+  }
+}
+
 // "Main" - run on bootup
 let DATA = new DataCollector()
 
@@ -1301,29 +1375,32 @@ class RewardsGraph extends ShapeRegion {
   loadRunLine() {
     // Add lines
     DATA.getRunField(CURRENT_RUN_ID, DATA_COMPRESSION_LINES, 'rewards')
-      .then(runData => {
-        // Empty?
-        if (runData.points.length == 0) return
-
-        // Apply
-        runData.applyEwma(EWMA_BETA_LINES)
-        if (this._runLines.length == 0) {
-          let line = this.addLine(runData.points, 'red')
-          line.g.attr('class', 'runLine')
-          this._runLines.push(line)
-        }
-        else {
-          this._runLines[0].points = runData.points
-          this._runLines[0].rebuild()
-        }
-      })
-      .then(() => {
-        // If automatic selection, select last step
-        if (!IS_MANUAL_SELECTION) {
-          setSelectedStep(-1, false)
-          REWARDS_GRAPH.deselectEvents()
-        }
-      })
+      .then(runData => this.applyRunLine(runData))
+  }
+
+  // Shows the run data as the run line, which is also used for the updates
+  // pushed while the run is live
+  applyRunLine(runData: DataRunField) {
+    // Empty?
+    if (runData.points.length == 0) return
+
+    // Apply
+    runData.applyEwma(EWMA_BETA_LINES)
+    if (this._runLines.length == 0) {
+      let line = this.addLine(runData.points, 'red')
+      line.g.attr('class', 'runLine')
+      this._runLines.push(line)
+    }
+    else {
+      this._runLines[0].points = runData.points
+      this._runLines[0].rebuild()
+    }
+
+    // If automatic selection, select last step
+    if (!IS_MANUAL_SELECTION) {
+      setSelectedStep(-1, false)
+      REWARDS_GRAPH.deselectEvents()
+    }
   }
 
   runLine() {
@@ -2110,8 +2187,21 @@ let MAIN_PREDICTIONS = new PredictionMatrix(d3.select('#predictions'))
 let STORED_DATA: SampleDataRepo
 let EVENTS: EpisodeEvent[] = []
 
+// The newest run is the current one, and every run before it is finished
+function applyRunCatalog(runs: RunSummary[]) {
+  if (runs.length == 0) return
+  RUN_IDS = runs.map(run => run.id)
+  ALL_RUN_COUNT = runs.length
+  FINISHED_RUN_COUNT = runs.length - 1
+  CURRENT_RUN_ID = RUN_IDS[RUN_IDS.length - 1]
+}
+
+let RUNS_LOADED = DATA.getRuns()
+  .then(runs => applyRunCatalog(runs))
+
 // Populate the rewards
-REWARDS_GRAPH.loadCurveBoxplotData()
+RUNS_LOADED
+  .then(() => REWARDS_GRAPH.loadCurveBoxplotData())
   .then(() => {
     fireCurrentUpdateQuery()
   })
@@ -2310,8 +2400,12 @@ d3.select('#new-event').on('mousedown', () => {
   // createEvent(SELECTED_STEP)
 })
 
-setInterval(function() {
-  if (UPDATE_ON) {
-    fireCurrentUpdateQuery()
-  }
-}, 1000)
+// The current run is pushed by the server as it grows, rather than polled
+let LIVE_RUN: LiveRunFeed
+RUNS_LOADED.then(() => {
+  LIVE_RUN = new LiveRunFeed(CURRENT_RUN_ID, DATA_COMPRESSION_LINES, 'rewards', runData => {
+    if (UPDATE_ON) {
+      REWARDS_GRAPH.applyRunLine(runData)
+    }
+  })
+})
@@ -0,0 +1,250 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import threading
+import time
+import urllib.request
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from vaml import correctness, data_utils, metrics, pyramid, rolling, run_store
+from vaml.data_utils import compress_array, load_all_runs_field_numpy, load_run_field, load_run_field_range
+from vaml.data_utils import load_episode_field_numpy, load_predictions_numpy
+from vaml.metrics import load_metrics
+from vaml.pyramid import build_run_pyramid
+from vaml.run_store import import_run
+
+
+# Benchmarks for the data loaders and the HTTP endpoints, run against a
+# synthetic data folder laid out like the converted thesis data.  Run with
+#   python -m vaml.benchmark --runs 6 --steps 1000000 --output report.json
+# and compare the JSON reports between changes.
+
+SAMPLES = ['straight', 'left', 'right', 'slow', 'fast', 'intersection']
+ACTIONS = 40
+PREDICTION_STEPS = 300
+# Number of buckets the benchmarks ask for, as the frontend does
+POINTS = 1000
+
+
+# Writes a data folder with `runs` runs of `steps` steps each, split randomly
+# into `episodes` episodes.  Every run gets the same files the conversion
+# scripts produce: episode files, the run file and its pyramid, the run
+# store, metadata, and predictions for every sample.
+def generate_dataset(folder, runs, episodes, steps, seed=0):
+    rng = np.random.default_rng(seed)
+    for run_id in range(1, runs + 1):
+        run_folder = '{folder}/run_{run}'.format(folder=folder, run=run_id)
+        os.makedirs(run_folder, exist_ok=True)
+
+        # Rewards trend upwards with noise, like a run that is learning
+        rewards = np.linspace(0, 1, steps) + rng.normal(0, 0.3, steps)
+        cuts = np.sort(rng.choice(np.arange(1, steps), size=min(episodes, steps) - 1, replace=False))
+        for episode_id, episode_rewards in enumerate(np.split(rewards, cuts), start=1):
+            np.save('{base}/episode_{ep}_rewards.npy'.format(base=run_folder, ep=episode_id), episode_rewards)
+            with open('{base}/episode_{ep}_meta.json'.format(base=run_folder, ep=episode_id), 'w') as fh:
+                json.dump({'run': run_id, 'episode': episode_id, 'steps': int(episode_rewards.size)}, fh)
+
+        np.save('{base}/run_{run}_rewards.npy'.format(base=run_folder, run=run_id), rewards)
+        build_run_pyramid(folder, run_id, 'rewards')
+        import_run(folder, run_id)
+        with open('{base}/run_{run}_metadata.json'.format(base=run_folder, run=run_id), 'w') as fh:
+            json.dump({'episodes': episodes, 'total_steps': steps}, fh)
+        for sample in SAMPLES:
+            predictions = rng.dirichlet(np.ones(ACTIONS), PREDICTION_STEPS)
+            np.save('{base}/predictions_{sample}.npy'.format(base=run_folder, sample=sample), predictions)
+
+
+# Empties the in-process caches, so the next call pays the full loading cost
+def clear_caches():
+    with data_utils.ARRAY_CACHE_LOCK:
+        data_utils.ARRAY_CACHE.clear()
+    with pyramid.PYRAMIDS_LOCK:
+        pyramid.PYRAMIDS.clear()
+    with run_store.STORE_CACHE_LOCK:
+        run_store.STORE_CACHE.clear()
+    with rolling.CUMULATIVE_SUMS_LOCK:
+        rolling.CUMULATIVE_SUMS.clear()
+    with correctness.CORRECTNESS_CACHE_LOCK:
+        correctness.CORRECTNESS_CACHE.clear()
+    metrics.METRICS = metrics.MetricsEngine()
+
+
+# Latency statistics in milliseconds
+def summarize(durations):
+    durations = np.asarray(durations) * 1000
+    return {
+        'count': int(durations.size),
+        'mean_ms': float(durations.mean()),
+        'min_ms': float(durations.min()),
+        'p50_ms': float(np.percentile(durations, 50)),
+        'p95_ms': float(np.percentile(durations, 95)),
+        'max_ms': float(durations.max())
+    }
+
+
+# Times a call with empty caches, then `repeat` more times with them warm
+def time_call(function, repeat):
+    clear_caches()
+    start = time.perf_counter()
+    function()
+    cold = time.perf_counter() - start
+
+    durations = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    result = summarize(durations)
+    result['cold_ms'] = cold * 1000
+    return result
+
+
+def benchmark_loaders(folder, steps, repeat):
+    compression = max(1, steps // POINTS)
+    run_steps = np.load('{folder}/run_1/run_1_rewards.npy'.format(folder=folder))
+    cases = {
+        'compress_array': lambda: compress_array(run_steps, compression),
+        'load_run_field': lambda: load_run_field(folder, 1, 'rewards', compression),
+        'load_run_field_lttb': lambda: load_run_field(folder, 1, 'rewards', compression, 'lttb'),
+        'load_run_field_range': lambda: load_run_field_range(folder, 1, 'rewards', steps // 4, steps // 2, POINTS),
+        'load_all_runs_field_numpy': lambda: load_all_runs_field_numpy(folder, 'rewards', compression),
+        'load_metrics': lambda: load_metrics(folder, compression),
+        'load_episode_field_numpy': lambda: load_episode_field_numpy(folder, 1, 1, 'rewards'),
+        'load_predictions_numpy': lambda: load_predictions_numpy(folder, 1, 'left'),
+    }
+    results = {}
+    for name, function in cases.items():
+        print("Timing {}".format(name))
+        results[name] = time_call(function, repeat)
+    return results
+
+
+def _fetch(url):
+    start = time.perf_counter()
+    with urllib.request.urlopen(url) as response:
+        size = len(response.read())
+    return time.perf_counter() - start, size
+
+
+# Times each endpoint one request at a time, then with `clients` concurrent
+# clients each making `repeat` requests
+def benchmark_endpoints(folder, steps, port, repeat, clients):
+    from vaml.server import VamlServer
+    compression = max(1, steps // POINTS)
+    paths = {
+        'runs': '/data/runs',
+        'metrics': '/data/metrics?compression={}'.format(compression),
+        'metrics_f32': '/data/metrics?compression={}&format=f32'.format(compression),
+        'run_field': '/data/run_field?run=1&field=rewards&compression={}'.format(compression),
+        'run_field_f32': '/data/run_field?run=1&field=rewards&compression={}&format=f32'.format(compression),
+        'run_field_range': '/data/run_field?run=1&field=rewards&start={}&end={}&points={}'.format(
+            steps // 4, steps // 2, POINTS),
+        'run_rolling_std_f32': '/data/run_rolling?run=1&field=rewards&compression={}&stat=std&window={}&format=f32'.format(
+            compression, compression * 10),
+        'run_rolling_ewma_f32': '/data/run_rolling?run=1&field=rewards&compression={}&stat=ewma&format=f32'.format(
+            compression),
+        'run_fields_f32': '/data/run_fields?runs=all&field=rewards&compression={}&format=f32'.format(compression),
+        'episode': '/data/episode?run_id=1&id=1&field=rewards',
+        'episodes_step': '/data/episodes?run=1&step={}'.format(steps // 2),
+        'episodes_top': '/data/episodes?run=1&top=10',
+        'predictions_f32': '/data/predictions?run=1&sample=left&format=f32',
+        'prediction_grids_f32': '/data/prediction_grids?runs=all&format=f32',
+        'correctness_f32': '/data/correctness?runs=all&format=f32',
+    }
+    if os.path.exists('www/index.html'):
+        paths['index'] = '/index.html'
+
+    server = VamlServer('localhost', port, port + 1, folder=folder)
+    thread = threading.Thread(target=server.server.serve_forever, daemon=True)
+    thread.start()
+    base = 'http://localhost:{}'.format(port)
+
+    results = {}
+    try:
+        for name, path in paths.items():
+            print("Timing {}".format(path))
+            clear_caches()
+            cold, size = _fetch(base + path)
+            sequential = [_fetch(base + path)[0] for _ in range(repeat)]
+
+            with ThreadPoolExecutor(max_workers=clients) as executor:
+                start = time.perf_counter()
+                concurrent = list(executor.map(lambda _: _fetch(base + path)[0], range(clients * repeat)))
+                elapsed = time.perf_counter() - start
+
+            results[name] = {
+                'path': path,
+                'bytes': size,
+                'cold_ms': cold * 1000,
+                'sequential': summarize(sequential),
+                'concurrent': dict(summarize(concurrent), clients=clients, requests_per_s=len(concurrent) / elapsed)
+            }
+    finally:
+        server.server.shutdown()
+        server.server.server_close()
+        server.compute_pool.shutdown(wait=False)
+    return results
+
+
+def run_benchmarks(runs, episodes, steps, repeat, clients, port, folder=None, http=True):
+    generated = folder is None
+    folder = folder or tempfile.mkdtemp(prefix='vaml_benchmark_')
+    try:
+        if generated or not os.path.exists('{}/run_1'.format(folder)):
+            print("Generating {} runs of {} steps in {}".format(runs, steps, folder))
+            start = time.perf_counter()
+            generate_dataset(folder, runs, episodes, steps)
+            generate_time = time.perf_counter() - start
+        else:
+            generate_time = None
+
+        report = {
+            'config': {
+                'runs': runs,
+                'episodes': episodes,
+                'steps': steps,
+                'repeat': repeat,
+                'clients': clients,
+                'generate_s': generate_time
+            },
+            'environment': {
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'cpus': os.cpu_count()
+            },
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'loaders': benchmark_loaders(folder, steps, repeat),
+        }
+        if http:
+            report['endpoints'] = benchmark_endpoints(folder, steps, port, repeat, clients)
+        return report
+    finally:
+        if generated:
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the data loaders and server endpoints')
+    parser.add_argument('--runs', type=int, default=6)
+    parser.add_argument('--episodes', type=int, default=1000, help='episodes per run')
+    parser.add_argument('--steps', type=int, default=1000000, help='steps per run')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--clients', type=int, default=8, help='concurrent HTTP clients')
+    parser.add_argument('--port', type=int, default=5690)
+    parser.add_argument('--folder', default=None, help='existing data folder to use instead of a generated one')
+    parser.add_argument('--no-http', action='store_true', help='only time the loaders')
+    parser.add_argument('--output', default=None, help='file to write the JSON report to')
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.runs, args.episodes, args.steps, args.repeat, args.clients, args.port,
+                            args.folder, not args.no_http)
+    output = json.dumps(report, indent=2)
+    if args.output is not None:
+        with open(args.output, 'w') as fh:
+            fh.write(output)
+    print(output)
@@ -0,0 +1,169 @@
+import os
+import threading
+import time
+
+from vaml.data_utils import load_all_run_ids, load_numpy
+from vaml.run_store import load_run_store
+
+
+# How often the catalog checks the data folder for changes
+POLL_INTERVAL = 1.0
+# A run counts as live while it is being fed and its steps were written this
+# recently, so a feed that died without cleaning up stops counting
+LIVE_TIMEOUT = 30.0
+# Marker a feed keeps in the run's folder while it is writing the run
+FEEDING_FORMAT = '{folder}/run_{run}/feeding'
+
+
+def _stat_version(filename):
+    try:
+        stat = os.stat(filename)
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
+
+
+# What the catalog knows about one run
+class RunInfo:
+    def __init__(self, run_id, episodes, steps, fields, modified, feeding=False):
+        self.id = run_id
+        self.episodes = episodes
+        self.steps = steps
+        self.fields = fields
+        self.modified = modified
+        self.feeding = feeding
+
+    def is_live(self, now=None):
+        return (self.feeding and self.modified is not None
+                and (now or time.time()) - self.modified < LIVE_TIMEOUT)
+
+    def to_json(self, now=None):
+        return {
+            'id': self.id,
+            'episodes': self.episodes,
+            'steps': self.steps,
+            'fields': self.fields,
+            'live': self.is_live(now)
+        }
+
+
+# Reads the details of a run from its folder
+def _load_run_info(folder, run_id):
+    run_folder = '{folder}/run_{run}'.format(folder=folder, run=run_id)
+    prefix = 'run_{run}_'.format(run=run_id)
+    fields = set()
+    episodes = 0
+    for filename in os.listdir(run_folder):
+        if filename.startswith(prefix) and filename.endswith('.npy'):
+            fields.add(filename[len(prefix):-len('.npy')])
+        elif filename.startswith('episode_') and filename.endswith('_meta.json'):
+            episodes += 1
+
+    store = load_run_store(folder, run_id)
+    if store is not None:
+        episodes = max(episodes, len(store.episode_ids))
+        fields.update(store.fields)
+
+    steps = 0
+    modified = None
+    rewards_file = '{base}/{prefix}rewards.npy'.format(base=run_folder, prefix=prefix)
+    if os.path.exists(rewards_file):
+        steps = len(load_numpy(rewards_file))
+        modified = os.path.getmtime(rewards_file)
+    feeding = os.path.exists(FEEDING_FORMAT.format(folder=folder, run=run_id))
+    return RunInfo(run_id, episodes, steps, sorted(fields), modified, feeding)
+
+
+# In-memory index of the runs in a data folder.  Refreshing only stats the
+# data folder and each run's folder and step file; directories are only
+# listed again when their modification time changes.  Once started, a
+# background thread keeps it current so requests never touch the disk.
+class RunCatalog:
+    def __init__(self, folder):
+        self.folder = folder
+        self._runs = {}
+        self._versions = {}
+        self._folder_version = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def refresh(self):
+        with self._lock:
+            folder_version = _stat_version(self.folder)
+            if folder_version != self._folder_version:
+                self._folder_version = folder_version
+                run_ids = set(load_all_run_ids(self.folder)) if folder_version is not None else set()
+                for run_id in list(self._runs):
+                    if run_id not in run_ids:
+                        del self._runs[run_id]
+                        del self._versions[run_id]
+                for run_id in run_ids:
+                    self._versions.setdefault(run_id, None)
+
+            # Re-read runs whose folder, steps or store changed
+            for run_id in list(self._versions):
+                run_folder = '{folder}/run_{run}'.format(folder=self.folder, run=run_id)
+                version = (
+                    _stat_version(run_folder),
+                    _stat_version('{base}/run_{run}_rewards.npy'.format(base=run_folder, run=run_id)),
+                    _stat_version('{base}/run_{run}_store.vrs'.format(base=run_folder, run=run_id)),
+                    _stat_version(FEEDING_FORMAT.format(folder=self.folder, run=run_id))
+                )
+                if version != self._versions[run_id]:
+                    try:
+                        self._runs[run_id] = _load_run_info(self.folder, run_id)
+                        self._versions[run_id] = version
+                    except (OSError, ValueError):
+                        # Being written or removed, so keep what was last read
+                        # (or just the id) and try again on the next poll
+                        self._runs.setdefault(run_id, RunInfo(run_id, 0, 0, [], None))
+
+    # Starts a daemon thread which refreshes the catalog every `interval`
+    def start(self, interval=POLL_INTERVAL):
+        if self._thread is not None:
+            return
+
+        def poll():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.refresh()
+                except Exception as e:
+                    print(e)
+        self._thread = threading.Thread(target=poll, daemon=True)
+        self._thread.start()
+
+    # Without a polling thread the catalog is refreshed whenever it is read
+    def _current(self):
+        if self._thread is None:
+            self.refresh()
+
+    def runs(self):
+        self._current()
+        with self._lock:
+            return [self._runs[run_id] for run_id in sorted(self._runs)]
+
+    def run_ids(self):
+        return [run.id for run in self.runs()]
+
+    def highest_run_id(self):
+        return max(self.run_ids(), default=0)
+
+    def to_json(self):
+        now = time.time()
+        return [run.to_json(now) for run in self.runs()]
+
+
+CATALOGS = {}
+CATALOGS_LOCK = threading.Lock()
+
+
+# Returns the shared catalog of a data folder
+def get_catalog(folder):
+    with CATALOGS_LOCK:
+        catalog = CATALOGS.get(folder)
+        if catalog is None:
+            catalog = RunCatalog(folder)
+            catalog.refresh()
+            CATALOGS[folder] = catalog
+        return catalog
@@ -0,0 +1,179 @@
+import hashlib
+import os
+import threading
+import numpy as np
+from collections import OrderedDict
+
+from vaml.data.clean_validation_data import GRID_FILE, GRID_ROWS, GRID_COLUMNS
+from vaml.data_utils import load_prediction_grid
+from vaml.instrumentation import timed
+
+
+# Labels of every action of each sample, in the same grid order as the
+# prediction grids (and the frontend's SAMPLE_LABELS).  Each action is 0
+# (wrong), 1 (neutral) or 2 (good).
+SAMPLE_LABELS = {
+    'straight': [
+        [0, 1, 1, 1, 0],
+        [0, 1, 2, 1, 0],
+        [0, 1, 2, 1, 0],
+        [0, 1, 2, 1, 0],
+        [0, 1, 1, 1, 0],
+        [0, 1, 1, 1, 0],
+        [0, 0, 1, 0, 0],
+        [0, 0, 0, 0, 0],
+    ],
+    'left': [
+        [1, 1, 0, 0, 0],
+        [2, 1, 1, 0, 0],
+        [2, 2, 1, 0, 0],
+        [2, 1, 1, 0, 0],
+        [1, 1, 0, 0, 0],
+        [1, 1, 0, 0, 0],
+        [1, 0, 0, 0, 0],
+        [1, 0, 0, 0, 0],
+    ],
+    'right': [
+        [0, 0, 0, 1, 1],
+        [0, 0, 1, 1, 2],
+        [0, 0, 1, 2, 2],
+        [0, 0, 1, 1, 2],
+        [0, 0, 0, 1, 1],
+        [0, 0, 0, 1, 1],
+        [0, 0, 0, 0, 1],
+        [0, 0, 0, 0, 1],
+    ],
+    'slow': [
+        [0, 1, 2, 1, 0],
+        [0, 1, 2, 1, 0],
+        [0, 1, 1, 1, 0],
+        [0, 1, 1, 1, 0],
+        [0, 0, 1, 0, 0],
+        [0, 0, 0, 0, 0],
+        [0, 0, 0, 0, 0],
+        [0, 0, 0, 0, 0],
+    ],
+    'fast': [
+        [0, 0, 1, 0, 0],
+        [0, 0, 1, 0, 0],
+        [0, 0, 1, 0, 0],
+        [0, 1, 1, 1, 0],
+        [0, 1, 2, 1, 0],
+        [0, 1, 2, 1, 0],
+        [0, 1, 2, 1, 0],
+        [0, 1, 1, 1, 0],
+    ],
+    'intersection': [
+        [0, 0, 1, 0, 0],
+        [0, 1, 2, 1, 0],
+        [0, 1, 2, 1, 0],
+        [0, 1, 2, 1, 0],
+        [0, 1, 2, 1, 0],
+        [0, 1, 1, 1, 0],
+        [0, 0, 1, 0, 0],
+        [0, 0, 1, 0, 0],
+    ],
+}
+
+ACTIONS = GRID_ROWS * GRID_COLUMNS
+CORRECTNESS_CACHE_SIZE = 1024
+
+
+def sample_labels(sample):
+    labels = SAMPLE_LABELS.get(sample)
+    return None if labels is None else np.asarray(labels, dtype=np.int8).reshape(ACTIONS)
+
+
+# Parses labels given as `ACTIONS` comma separated values of 0, 1 or 2
+def parse_labels(text):
+    labels = np.array([int(label) for label in text.split(',')], dtype=np.int8)
+    if labels.size != ACTIONS or labels.min() < 0 or labels.max() > 2:
+        raise ValueError('Expected {} labels of 0, 1 or 2'.format(ACTIONS))
+    return labels
+
+
+def labels_key(labels):
+    return hashlib.sha1(np.ascontiguousarray(labels, dtype=np.int8).tobytes()).hexdigest()
+
+
+# LRU cache of correctness series by run, sample and labels.  Entries hold
+# the version of the run's grid file, so a run that is fed again is scored
+# again, along with the steps per checkpoint and the series.
+CORRECTNESS_CACHE = OrderedDict()
+CORRECTNESS_CACHE_LOCK = threading.Lock()
+
+
+def _grid_version(folder, run_id):
+    try:
+        stat = os.stat('{folder}/run_{run}/{name}'.format(folder=folder, run=run_id, name=GRID_FILE))
+        return stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
+
+
+# Scores every checkpoint of one run against each sample's labels.  A
+# checkpoint's correctness is the sum of its action probabilities weighted by
+# their label, where good actions count fully and neutral ones half, so it
+# ranges from 0 to 1.  All samples missing from the cache are scored in one
+# pass over the (samples, checkpoints, actions) grid.  Returns the steps per
+# checkpoint and a series for each sample, or None if the run has no
+# predictions for all of the samples.
+def run_correctness(folder, run_id, samples, labels):
+    version = _grid_version(folder, run_id)
+    keys = [(folder, run_id, sample, labels_key(values)) for sample, values in zip(samples, labels)]
+    series = [None] * len(samples)
+    compression = None
+    with CORRECTNESS_CACHE_LOCK:
+        for index, key in enumerate(keys):
+            cached = CORRECTNESS_CACHE.get(key)
+            if cached is not None and cached[0] == version:
+                CORRECTNESS_CACHE.move_to_end(key)
+                compression, series[index] = cached[1:]
+
+    missing = [index for index, values in enumerate(series) if values is None]
+    if len(missing) == 0:
+        return compression, series
+
+    loaded = load_prediction_grid(folder, run_id)
+    if loaded is None:
+        return None
+    run_samples, compression, grid = loaded
+    if not all(samples[index] in run_samples for index in missing):
+        return None
+
+    with timed('correctness'):
+        grid = grid[[run_samples.index(samples[index]) for index in missing]]
+        weights = np.asarray([labels[index] for index in missing], dtype=np.float32) / 2
+        scores = np.einsum('sca,sa->sc', grid, weights, dtype=np.float32)
+
+    with CORRECTNESS_CACHE_LOCK:
+        for row, index in enumerate(missing):
+            series[index] = scores[row]
+            CORRECTNESS_CACHE[keys[index]] = (version, compression, scores[row])
+            CORRECTNESS_CACHE.move_to_end(keys[index])
+        while len(CORRECTNESS_CACHE) > CORRECTNESS_CACHE_SIZE:
+            CORRECTNESS_CACHE.popitem(last=False)
+    return compression, series
+
+
+# Scores the runs against each sample.  Labels default to the sample's own
+# labels, which only the samples in SAMPLE_LABELS have.  Runs without
+# predictions for all of the samples are left out.
+# Returns the steps per checkpoint, and a list of run id and (samples,
+# checkpoints) array pairs.
+def load_correctness(folder, run_ids, samples, labels=None):
+    if labels is None:
+        labels = [sample_labels(sample) for sample in samples]
+    if any(values is None for values in labels):
+        raise ValueError('No labels for samples {}'.format(
+            ','.join(sample for sample, values in zip(samples, labels) if values is None)))
+    compression = None
+    runs = list()
+    for run_id in run_ids:
+        scored = run_correctness(folder, run_id, samples, labels)
+        if scored is None:
+            continue
+        run_compression, series = scored
+        compression = compression or run_compression
+        runs.append((run_id, np.stack(series) if len(series) > 0 else np.zeros((0, 0), dtype=np.float32)))
+    return compression, runs
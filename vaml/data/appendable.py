@@ -0,0 +1,92 @@
+import os
+import struct
+import tempfile
+import numpy as np
+
+
+# Total size of the .npy preamble (magic string, version, header length and
+# header dictionary).  The header is always padded out to this size so the
+# shape can be rewritten in place as rows are appended.
+HEADER_SIZE = 128
+
+
+def _build_header(dtype, shape):
+    header = "{{'descr': {descr!r}, 'fortran_order': False, 'shape': {shape!r}, }}".format(
+        descr=np.lib.format.dtype_to_descr(dtype),
+        shape=tuple(shape)
+    )
+    preamble = np.lib.format.magic(1, 0)
+    header_length = HEADER_SIZE - len(preamble) - 2
+    header = header.ljust(header_length - 1) + '\n'
+    return preamble + struct.pack('<H', header_length) + header.encode('latin1')
+
+
+# A .npy file that can be grown in place.  Rows are written past the current
+# end first and the shape in the header is only updated afterwards, so any
+# reader using `np.load` (with or without `mmap_mode`) sees a consistent prefix
+# of the data while the writer is still running.
+class AppendableArray:
+    def __init__(self, filename, dtype=np.float64, row_shape=()):
+        self.filename = filename
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.rows = 0
+        self._row_bytes = self.dtype.itemsize * int(np.prod(self.row_shape, dtype=np.int64))
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            self._open_existing()
+        else:
+            self._fh = open(filename, 'w+b')
+            self._write_header()
+
+    def _open_existing(self):
+        # Reuse the file if it is already appendable, otherwise rewrite it
+        with open(self.filename, 'rb') as fh:
+            version = np.lib.format.read_magic(fh)
+            if version == (1, 0):
+                shape, _, dtype = np.lib.format.read_array_header_1_0(fh)
+            else:
+                shape, _, dtype = np.lib.format.read_array_header_2_0(fh)
+            appendable = (fh.tell() == HEADER_SIZE and dtype == self.dtype
+                          and tuple(shape[1:]) == self.row_shape)
+        if not appendable:
+            shape = self._rewrite()
+        self._fh = open(self.filename, 'r+b')
+        self.rows = shape[0]
+
+    # Converts the file to the appendable layout.  The converted copy is moved
+    # over the original, since readers may still have the old one mapped.
+    def _rewrite(self):
+        existing = np.ascontiguousarray(np.load(self.filename), dtype=self.dtype).reshape((-1,) + self.row_shape)
+        fd, temp_filename = tempfile.mkstemp(prefix=os.path.basename(self.filename) + '.', suffix='.tmp',
+                                             dir=os.path.dirname(os.path.abspath(self.filename)))
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(_build_header(self.dtype, existing.shape))
+                fh.write(existing.tobytes())
+            os.replace(temp_filename, self.filename)
+        except BaseException:
+            os.remove(temp_filename)
+            raise
+        return existing.shape
+
+    def _write_header(self):
+        self._fh.seek(0)
+        self._fh.write(_build_header(self.dtype, (self.rows,) + self.row_shape))
+        self._fh.flush()
+
+    def append(self, values):
+        values = np.ascontiguousarray(values, dtype=self.dtype).reshape((-1,) + self.row_shape)
+        if values.shape[0] == 0:
+            return
+
+        # Data first, then publish the new length
+        self._fh.seek(HEADER_SIZE + self.rows * self._row_bytes)
+        self._fh.write(values.tobytes())
+        self._fh.flush()
+        self.rows += values.shape[0]
+        self._write_header()
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
@@ -1,6 +1,8 @@
+import argparse
 import json
 import os
-from io import StringIO
+import re
+import numpy as np
 
 
 def _to_json(obj):
@@ -11,50 +13,92 @@ def _to_json(obj):
     )
 
 
+# Number of steps held in memory before they are written out
+CHUNK_STEPS = 4096
+
+# Pulls the reward straight out of a raw step line, without building the dict
+REWARD_PATTERN = re.compile(rb'"reward"\s*:\s*(-?Infinity|NaN|-?[0-9][0-9.eE+-]*)')
+
+
+# Step lines are JSON objects with the step's reward under a top-level
+# "reward" key.  The pattern is only trusted when "reward" appears once in the
+# line, directly inside the outer object; a nested "reward" or the word used
+# as a value means parsing the whole line.
+def _parse_reward(line):
+    match = REWARD_PATTERN.search(line) if line.count(b'"reward"') == 1 else None
+    if match is None or _depth(line[0:match.start()]) != 1:
+        return json.loads(line)['reward']
+    return float(match.group(1))
+
+
+# Objects and arrays open at the end of some JSON text
+def _depth(text):
+    return text.count(b'{') + text.count(b'[') - text.count(b'}') - text.count(b']')
+
+
+def _to_compact_json(obj):
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'))
+
+
 class EpisodeConverter:
     def __init__(self):
+        self._rewards = np.zeros(CHUNK_STEPS)
         self._reset()
 
     def _reset(self):
-        self.step_list = list()
+        self._filled = 0
         self.metadata = {'steps': 0, 'reward': 0, 'episode': 0, 'run': 0}
 
+    # Streams the raw step log into the episode file.  Rewards are collected
+    # into a fixed size buffer which is written out whenever it fills, so memory
+    # use does not depend on the episode length.
     def convert(self, filename, run, episode, save_folder):
-        self.load(filename, run, episode)
-        self.save(save_folder)
-
-    def load(self, filename, run, episode):
         # Reset the data
         self._reset()
         self.metadata['run'] = run
         self.metadata['episode'] = episode
 
-        # Open the file and read all steps
-        with open(filename, 'r') as fh:
-            for line in fh:
-                step_json = json.load(StringIO(line.strip()))
-                step_keep = {
-                    'step': self.metadata['steps'] + 1,
-                    'reward': step_json['reward']
-                }
-                self.step_list.append(step_keep)
-                self.metadata['steps'] += 1
-                self.metadata['reward'] += step_json['reward']
-
-    def save(self, save_folder):
-        # Save data
-        steps_filename = '{base}/episode_{ep}.json'.format(base=save_folder, ep=self.metadata['episode'])
-        with open(steps_filename, 'w') as fh:
-            json_obj = {
-                'metadata': self.metadata,
-                'steps': self.step_list
-            }
-            fh.write(_to_json(json_obj))
-
-
-ROOT_FOLDER = '../../data'
-OLD_FOLDER = ROOT_FOLDER + '/old'
-CONVERTED_FOLDER = ROOT_FOLDER + '/converted'
+        steps_filename = '{base}/episode_{ep}.json'.format(base=save_folder, ep=episode)
+        with open(filename, 'rb') as src, open(steps_filename, 'w') as dst:
+            dst.write('{"steps":[')
+            for line in src:
+                if line.isspace():
+                    continue
+                self._rewards[self._filled] = _parse_reward(line)
+                self._filled += 1
+                if self._filled == CHUNK_STEPS:
+                    self._flush(dst)
+            self._flush(dst)
+
+            # Metadata is only complete once every step is read
+            dst.write('],"metadata":')
+            dst.write(_to_compact_json(self.metadata))
+            dst.write('}')
+
+    def _flush(self, dst):
+        if self._filled == 0:
+            return
+        rewards = self._rewards[0:self._filled]
+        first_step = self.metadata['steps'] + 1
+        if np.isfinite(rewards).all():
+            values = [repr(reward) for reward in rewards.tolist()]
+        else:
+            values = [json.dumps(reward) for reward in rewards.tolist()]
+        if first_step > 1:
+            dst.write(',')
+        dst.write(','.join(
+            '{{"reward":{reward},"step":{step}}}'.format(reward=reward, step=first_step + idx)
+            for idx, reward in enumerate(values)
+        ))
+        self.metadata['steps'] += self._filled
+        self.metadata['reward'] += float(rewards.sum())
+        self._filled = 0
+
+
+# Default data folder, relative to the repository root the script is run from
+DATA_FOLDER = 'data'
+OLD_FOLDER = 'old'
+CONVERTED_FOLDER = 'converted'
 
 
 def convert_run(converter: EpisodeConverter, input_folder, run_number, output_folder):
@@ -100,5 +144,9 @@ def convert_all(old_folder, new_folder):
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert raw step logs into the episode log format')
+    parser.add_argument('--folder', default=DATA_FOLDER, help='data folder holding the old and converted logs')
+    args = parser.parse_args()
+
     print("Converting data.")
-    convert_all(OLD_FOLDER, CONVERTED_FOLDER)
+    convert_all(os.path.join(args.folder, OLD_FOLDER), os.path.join(args.folder, CONVERTED_FOLDER))
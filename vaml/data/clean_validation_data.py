@@ -1,36 +1,158 @@
+import argparse
+import json
+import math
 import os
+import tempfile
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from numpy.lib.format import open_memmap
 
 
-ROOT_FOLDER = '../../../thesis_data'
-RAW_DATA_FOLDER = ROOT_FOLDER + '/raw/validation'
-CONVERTED_FOLDER = ROOT_FOLDER + '/validation'
+# Default data folder, relative to the repository root the script is run from
+DATA_FOLDER = '../thesis_data'
+RAW_DATA_FOLDER = 'raw/validation'
+CONVERTED_FOLDER = 'validation'
 
+# Steps between validation checkpoints, used when they cannot be inferred
+CHECKPOINT_STEPS = 10000
+# Threads loading the raw files, where None lets the pool decide
+WORKERS = None
 
-def load_all_data(folder):
-    all_files = os.listdir(folder)
-    cache = {}
-    for filename in all_files:
+# The 40 actions form a grid of 8 throttle rows by 5 steering columns.  The
+# model orders the rows from the highest throttle, while the grid is drawn
+# with the highest throttle at the bottom.
+GRID_ROWS = 8
+GRID_COLUMNS = 5
+GRID_FILE = 'predictions_grid.npy'
+GRID_INFO_FILE = 'predictions_grid.json'
+
+
+# Finds the raw prediction files, named `{name}_{sample}_{step}.npy`, grouped
+# by sample as lists of (step, filename)
+def list_raw_files(folder):
+    samples = {}
+    for filename in os.listdir(folder):
         tokens = filename.replace('.npy', '').split('_')
+        if not filename.endswith('.npy') or len(tokens) < 3:
+            continue
+        try:
+            step = int(tokens[2])
+        except ValueError:
+            continue
+        samples.setdefault(tokens[1], list()).append((step, filename))
+    return samples
+
+
+# Infers the steps between checkpoints and the number of checkpoints from the
+# steps in the file names, where the first checkpoint is after one interval
+def infer_checkpoints(samples):
+    steps = [step for files in samples.values() for step, _ in files]
+    interval = 0
+    for step in steps:
+        interval = math.gcd(interval, step)
+    interval = interval or CHECKPOINT_STEPS
+    return interval, max(steps) // interval if len(steps) > 0 else 0
+
+
+def _load_checkpoint(folder, filename, output, row):
+    output[row] = np.load(os.path.join(folder, filename)).reshape(-1)
+
+
+# Compiles the raw validation files into one predictions file per sample,
+# plus the grid of every sample.  The number of checkpoints and classes are
+# taken from the files.  Files are loaded on a thread pool straight into
+# memory mapped outputs, and each sample is flushed as soon as it is done, so
+# only the file currently being read is held in memory.
+def compile_validation_data(raw_folder, output_folder, workers=WORKERS):
+    samples = list_raw_files(raw_folder)
+    if len(samples) == 0:
+        return 0
+    interval, checkpoints = infer_checkpoints(samples)
+    first_file = next(iter(samples.values()))[0][1]
+    classes = np.load(os.path.join(raw_folder, first_file), mmap_mode='r').size
+    names = sorted(samples)
+
+    # The grid can only be drawn for the action layout it knows.  It is
+    # written to a temporary file and moved into place once complete.
+    grid = None
+    if classes == GRID_ROWS * GRID_COLUMNS:
+        grid_file = _temp_file(output_folder, GRID_FILE)
+        grid = open_memmap(grid_file, mode='w+', dtype=np.float32, shape=(len(names), checkpoints, classes))
 
-        # Get the sample set from the data cache
-        if tokens[1] not in cache:
-            # cache[tokens[1]] = [0 for _ in range(300)]
-            cache[tokens[1]] = np.zeros((300, 40))
-        sample_set = cache[tokens[1]]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for index, sample in enumerate(names):
+            output = open_memmap(os.path.join(output_folder, 'predictions_{}.npy'.format(sample)), mode='w+',
+                                 dtype=np.float64, shape=(checkpoints, classes))
+            futures = [
+                executor.submit(_load_checkpoint, raw_folder, filename, output, step // interval - 1)
+                for step, filename in samples[sample] if step >= interval
+            ]
+            for future in futures:
+                future.result()
+            output.flush()
+            if grid is not None:
+                grid[index] = remap_to_grid(output)
+            del output
+            print("Compiled {sample}: {files} of {checkpoints} checkpoints".format(
+                sample=sample, files=len(futures), checkpoints=checkpoints))
 
-        # Store the data into the set
-        step = int(int(tokens[2]) / 10000 - 1)
-        sample_set[step] = np.load(os.path.join(folder, filename))
-    return cache
+    if grid is not None:
+        grid.flush()
+        del grid
+        os.replace(grid_file, os.path.join(output_folder, GRID_FILE))
+        _save_grid_info(output_folder, names, interval)
+    return len(names)
 
 
-def save_all_data(folder, data):
-    for key in data:
-        np.save(os.path.join(folder, 'predictions_{}.npy'.format(key)), data[key])
+# A unique file beside `name` in the folder, to be moved over it once written
+def _temp_file(folder, name):
+    fd, filename = tempfile.mkstemp(prefix=name + '.', suffix='.tmp', dir=folder)
+    os.close(fd)
+    return filename
+
+
+# The info file is written last, as readers take it to mean the grid is there
+def _save_grid_info(folder, samples, compression):
+    filename = _temp_file(folder, GRID_INFO_FILE)
+    with open(filename, 'w') as fh:
+        json.dump({'samples': samples, 'compression': compression}, fh)
+    os.replace(filename, os.path.join(folder, GRID_INFO_FILE))
+
+
+# Reorders the actions of every checkpoint into the layout the grid is drawn in
+def remap_to_grid(predictions):
+    rows = predictions.reshape(-1, GRID_ROWS, GRID_COLUMNS)[:, ::-1, :]
+    return rows.reshape(-1, GRID_ROWS * GRID_COLUMNS)
+
+
+# Saves every sample's remapped predictions as one (samples, checkpoints,
+# actions) float32 array, with the sample names and step compression beside it.
+# Both files are moved into place whole, so readers never see them half written.
+def save_grid(folder, data, compression=CHECKPOINT_STEPS):
+    samples = sorted(data)
+    grid = np.stack([remap_to_grid(np.asarray(data[key])) for key in samples]).astype(np.float32)
+    filename = _temp_file(folder, GRID_FILE)
+    with open(filename, 'wb') as fh:
+        np.save(fh, grid)
+    os.replace(filename, os.path.join(folder, GRID_FILE))
+    _save_grid_info(folder, samples, compression)
+
+
+# Builds the grid of a folder which only has the per-sample predictions files
+def build_grid_from_predictions(folder):
+    data = {}
+    for filename in os.listdir(folder):
+        if filename.startswith('predictions_') and filename.endswith('.npy') and filename != GRID_FILE:
+            data[filename[len('predictions_'):-len('.npy')]] = np.load(os.path.join(folder, filename))
+    if len(data) > 0:
+        save_grid(folder, data)
+    return len(data)
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert validation predictions into numpy files')
+    parser.add_argument('--folder', default=DATA_FOLDER, help='data folder holding the raw and converted data')
+    args = parser.parse_args()
+
     print("Converting validation data")
-    all_data = load_all_data(RAW_DATA_FOLDER)
-    save_all_data(CONVERTED_FOLDER, all_data)
+    compile_validation_data(os.path.join(args.folder, RAW_DATA_FOLDER), os.path.join(args.folder, CONVERTED_FOLDER))
@@ -1,8 +1,16 @@
+import argparse
 import json
 import os
+import sys
+import time
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from shutil import copyfile
 
+from vaml.data.clean_raw_data import REWARD_PATTERN
+from vaml.episode_index import INDEX_FORMAT, build_episode_index
+from vaml.pyramid import build_run_pyramid
+from vaml.run_store import STORE_FORMAT, import_run
 
 
 def _to_json(obj):
@@ -13,89 +21,266 @@ def _to_json(obj):
     )
 
 
-# ROOT_FOLDER = '../../data'
-ROOT_FOLDER = '../../../thesis_data'
+# Default data folder, relative to the repository root the script is run from
+DATA_FOLDER = '../thesis_data'
+# Raw runs are read from {name}_old in the data folder and converted into {name}
 NAME = 'nodsf'
-OLD_FOLDER = ROOT_FOLDER + '/' + NAME + '_old'
-CONVERTED_FOLDER = ROOT_FOLDER + '/' + NAME
 
+# Episodes converted into a run at its last build, so removing an episode's
+# source rebuilds the run files even though none of them are newer
+SOURCES_FORMAT = '{folder}/run_{run}/sources.json'
 
+# Number of worker processes, where None uses every core
+WORKERS = None
+# Seconds between progress reports
+REPORT_INTERVAL = 5.0
+
+
+# Outputs are up to date when they all exist and are newer than every source
+def _is_up_to_date(sources, outputs):
+    try:
+        newest_source = max(os.path.getmtime(source) for source in sources)
+        return all(os.path.getmtime(output) >= newest_source for output in outputs)
+    except OSError:
+        return False
+
+
+# Converts one episode, returning the number of steps and input bytes.  Runs
+# in a worker process, and skips episodes that were already converted.
 def convert_episode(input_folder, episode_number, output_folder):
-    # Load the file
-    with open('{base}/episode_{num}.json'.format(base=input_folder, num=episode_number), 'r') as fh:
-        json_data = json.load(fh)
+    src = '{base}/episode_{num}.json'.format(base=input_folder, num=episode_number)
+    out_ep = '{base}/episode_{num}'.format(base=output_folder, num=episode_number)
+    if _is_up_to_date([src], ['{}_meta.json'.format(out_ep), '{}_rewards.npy'.format(out_ep)]):
+        return None
+
+    with open(src, 'rb') as fh:
+        metadata, rewards = parse_episode(fh.read())
 
     # Save the raw metadata
-    out_ep = '{base}/episode_{num}'.format(base=output_folder, num=episode_number)
     with open('{}_meta.json'.format(out_ep), 'w') as fh:
-        json.dump(json_data['metadata'], fh)
+        json.dump(metadata, fh)
 
-    # Convert steps into numpy
-    steps = json_data['steps']
-    rewards = np.array([x for x in map(lambda x: x['reward'], steps)])
     np.save('{}_rewards'.format(out_ep), rewards)
-    return {
-        'rewards': rewards
-    }
+    return rewards.size, os.path.getsize(src)
 
 
-def convert_run(input_folder, run_number, output_folder):
-    print("Converting run " + str(run_number))
-    # Create the folder
-    save_run_folder = '{base}/run_{run}'.format(base=output_folder, run=run_number)
-    if not os.path.exists(save_run_folder):
-        os.mkdir(save_run_folder)
+# Every byte but JSON's brackets, for stripping text down to its nesting
+NOT_BRACKETS = bytes(code for code in range(256) if code not in b'{}[]')
+
+
+# Reads the metadata and rewards of an episode file.  Files in the compact
+# layout clean_raw_data writes, {"steps":[{"reward":R,"step":N},...],
+# "metadata":{...}}, have their rewards pulled out of the text in one pass,
+# without building a dict per step.  Anything else is parsed in full.
+def parse_episode(text):
+    head = b'{"steps":['
+    tail = b'],"metadata":'
+    split = text.find(tail)
+    if text.startswith(head) and split >= 0 and text.count(tail) == 1:
+        steps = text[len(head):split]
+        values = REWARD_PATTERN.findall(steps)
+        # Every step must be a flat object holding exactly one reward
+        brackets = steps.translate(None, NOT_BRACKETS)
+        if brackets == b'{}' * len(values) and steps.count(b'"reward"') == len(values):
+            metadata = json.loads(text[split + len(tail):text.rindex(b'}')])
+            return metadata, np.array(values, dtype=bytes).astype(np.float64).reshape(-1)
 
-    # Determine list of files
+    json_data = json.loads(text)
+    rewards = np.array([step['reward'] for step in json_data['steps']], dtype=np.float64).reshape(-1)
+    return json_data['metadata'], rewards
+
+
+def list_episodes(input_folder):
     def extract_episode_id(filename):
         try:
             return int(filename.split('_')[1].split('.')[0])
         except:
             return 0
-    all_episodes = list(map(extract_episode_id, list(os.listdir(input_folder))))
+    all_episodes = [ep for ep in map(extract_episode_id, os.listdir(input_folder)) if ep > 0]
     all_episodes.sort()
+    return all_episodes
 
-    # Convert all episodes
-    all_data = {
-        'rewards': list()
-    }
-    for ep_number in all_episodes:
-        if ep_number <= 0:
-            continue
-        try:
-            ep_data = convert_episode(
-                input_folder=input_folder,
-                episode_number=ep_number,
-                output_folder=save_run_folder
-            )
-            for key in ep_data:
-                all_data[key].append(ep_data[key])
-        except Exception as ex:
-            print("Failed to convert episode number {}".format(ep_number))
-            pass
-
-    # Write the run reward file
-    for key in all_data:
-        data_field = np.concatenate(all_data[key])
-        np.save('{base}/run_{run}_{key}'.format(base=save_run_folder, run=run_number, key=key), data_field)
+
+# Combines the converted episodes of a run into the run level files
+def finish_run(input_folder, run_number, output_folder, episodes):
+    save_run_folder = '{base}/run_{run}'.format(base=output_folder, run=run_number)
+    episode_files = [
+        '{base}/episode_{num}_rewards.npy'.format(base=save_run_folder, num=ep_number)
+        for ep_number in episodes
+    ]
+
+    # The run files only count as up to date if they were built from the same
+    # episodes, as removing a source leaves every output newer than the rest
+    sources_file = SOURCES_FORMAT.format(folder=output_folder, run=run_number)
+    try:
+        with open(sources_file, 'r') as fh:
+            previous = json.load(fh)
+    except (OSError, ValueError):
+        previous = None
+    same_sources = previous == episodes
+
+    # Episodes that are no longer in the run are dropped from its folder
+    for ep_number in set(previous or []) - set(episodes):
+        for suffix in ('meta.json', 'rewards.npy'):
+            filename = '{base}/episode_{num}_{suffix}'.format(base=save_run_folder, num=ep_number, suffix=suffix)
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def is_up_to_date(sources, outputs):
+        return same_sources and _is_up_to_date(sources, outputs)
+
+    # Write the run reward file, along with its downsampling pyramid
+    for key in ['rewards']:
+        run_file = '{base}/run_{run}_{key}.npy'.format(base=save_run_folder, run=run_number, key=key)
+        if len(episode_files) > 0 and not is_up_to_date(episode_files, [run_file]):
+            data_field = np.concatenate([np.load(filename) for filename in episode_files])
+            np.save(run_file, data_field)
+            build_run_pyramid(output_folder, run_number, key)
+
+    # Gather the episodes into the run store.  The episode files are kept, as
+    # they let an interrupted conversion resume where it left off.
+    store_file = STORE_FORMAT.format(folder=output_folder, run=run_number)
+    meta_files = ['{base}/episode_{num}_meta.json'.format(base=save_run_folder, num=ep_number) for ep_number in episodes]
+    if len(episodes) > 0 and not is_up_to_date(episode_files + meta_files, [store_file]):
+        import_run(output_folder, run_number, episode_ids=episodes)
+
+    # Summarize the episodes from the store
+    index_file = INDEX_FORMAT.format(folder=output_folder, run=run_number)
+    if len(episodes) > 0 and not is_up_to_date([store_file], [index_file]):
+        build_episode_index(output_folder, run_number)
 
     # Copy over the metadata file
-    copyfile(
-        src='{base}/metadata.json'.format(base=input_folder),
-        dst='{base}/run_{run}_metadata.json'.format(base=save_run_folder, run=run_number)
-    )
+    src = '{base}/metadata.json'.format(base=input_folder)
+    dst = '{base}/run_{run}_metadata.json'.format(base=save_run_folder, run=run_number)
+    if not _is_up_to_date([src], [dst]):
+        copyfile(src=src, dst=dst)
+
+    with open(sources_file, 'w') as fh:
+        json.dump(episodes, fh)
+
+
+# Tracks and reports conversion throughput, along with the episodes that
+# failed to convert as (run, episode, error) tuples
+class ConversionProgress:
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.skipped = 0
+        self.failed = list()
+        self.steps = 0
+        self.bytes = 0
+        self.start = time.time()
+        self.last_report = self.start
+
+    def add(self, result):
+        self.done += 1
+        if result is None:
+            self.skipped += 1
+        else:
+            self.steps += result[0]
+            self.bytes += result[1]
+        self._maybe_report()
+
+    def fail(self, run_number, episode_number, ex):
+        self.done += 1
+        self.failed.append((run_number, episode_number, ex))
+        print("Failed to convert episode {episode} of run {run}: {error}".format(
+            episode=episode_number, run=run_number, error=ex))
+        self._maybe_report()
+
+    def _maybe_report(self):
+        if time.time() - self.last_report >= REPORT_INTERVAL or self.done == self.total:
+            self.report()
+
+    def report(self):
+        self.last_report = time.time()
+        elapsed = max(self.last_report - self.start, 1e-6)
+        print("{done}/{total} episodes ({skipped} up to date, {failed} failed), {steps:.0f} steps/s, {mb:.1f} MB/s".format(
+            done=self.done,
+            total=self.total,
+            skipped=self.skipped,
+            failed=len(self.failed),
+            steps=self.steps / elapsed,
+            mb=self.bytes / elapsed / 1e6
+        ))
 
 
-def convert_all(old_folder, new_folder):
+def convert_run(input_folder, run_number, output_folder, workers=WORKERS):
+    return convert_runs([(input_folder, run_number)], output_folder, workers)
+
+
+# Converts the episodes of all runs in parallel on a process pool.  Each run's
+# files are written as soon as all of its episodes are done, leaving out any
+# that failed.  Returns the failures as (run, episode, error) tuples.
+def convert_runs(runs, output_folder, workers=WORKERS):
+    # Create the folders and find every episode
+    pending = {}
+    for input_folder, run_number in runs:
+        save_run_folder = '{base}/run_{run}'.format(base=output_folder, run=run_number)
+        if not os.path.exists(save_run_folder):
+            os.mkdir(save_run_folder)
+        pending[run_number] = list_episodes(input_folder)
+    progress = ConversionProgress(sum(len(episodes) for episodes in pending.values()))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for input_folder, run_number in runs:
+            print("Converting run " + str(run_number))
+            for ep_number in pending[run_number]:
+                future = executor.submit(
+                    convert_episode,
+                    input_folder=input_folder,
+                    episode_number=ep_number,
+                    output_folder='{base}/run_{run}'.format(base=output_folder, run=run_number)
+                )
+                futures[future] = (input_folder, run_number, ep_number)
+
+        remaining = {run_number: len(episodes) for run_number, episodes in pending.items()}
+        converted = {run_number: list() for run_number in pending}
+        for future in as_completed(futures):
+            input_folder, run_number, ep_number = futures[future]
+            try:
+                progress.add(future.result())
+                converted[run_number].append(ep_number)
+            except Exception as ex:
+                progress.fail(run_number, ep_number, ex)
+
+            remaining[run_number] -= 1
+            if remaining[run_number] == 0:
+                finish_run(input_folder, run_number, output_folder, sorted(converted[run_number]))
+
+    # Runs without any episodes still get their metadata
+    for input_folder, run_number in runs:
+        if len(pending[run_number]) == 0:
+            finish_run(input_folder, run_number, output_folder, list())
+    return progress.failed
+
+
+def convert_all(old_folder, new_folder, workers=WORKERS):
     if not os.path.exists(new_folder):
         os.mkdir(new_folder)
+    runs = list()
     for folder in os.listdir(old_folder):
         if os.path.isdir(old_folder + '/' + folder):
             run_number = int(folder.split('_')[1])
             folder_path = '{base}/{folder}'.format(base=old_folder, folder=folder)
             if os.path.isdir(folder_path):
-                convert_run(folder_path, run_number, new_folder)
+                runs.append((folder_path, run_number))
+    runs.sort(key=lambda run: run[1])
+    return convert_runs(runs, new_folder, workers)
 
 
 if __name__ == '__main__':
-    convert_all(OLD_FOLDER, CONVERTED_FOLDER)
+    parser = argparse.ArgumentParser(description='Convert raw runs into numpy files and run stores')
+    parser.add_argument('--folder', default=DATA_FOLDER, help='data folder holding the raw and converted runs')
+    parser.add_argument('--name', default=NAME, help='converts {folder}/{name}_old into {folder}/{name}')
+    parser.add_argument('--workers', type=int, default=WORKERS, help='worker processes, every core by default')
+    args = parser.parse_args()
+
+    converted_folder = os.path.join(args.folder, args.name)
+    failed = convert_all(converted_folder + '_old', converted_folder, args.workers)
+    if len(failed) > 0:
+        print("{} episodes failed to convert:".format(len(failed)))
+        for run_number, ep_number, ex in failed:
+            print("  run {run} episode {episode}: {error}".format(run=run_number, episode=ep_number, error=ex))
+        sys.exit(1)
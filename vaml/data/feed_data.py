@@ -1,29 +1,61 @@
 
+import argparse
 import os
 import json
-import time
+import threading
 import numpy as np
 from shutil import copyfile, rmtree
 
+from vaml.catalog import FEEDING_FORMAT
+from vaml.data_utils import load_all_run_ids
+from vaml.data.appendable import AppendableArray
+from vaml.episode_index import INDEX_FORMAT, EpisodeIndexWriter, build_episode_index
+from vaml.run_store import RunStore, import_run_folder, write_run_store
+
 
 RUN_METADATA_FORMAT = '{folder}/run_{id}_metadata.json'
 RUN_REWARDS_FORMAT = '{folder}/run_{id}_rewards.npy'
 EP_METADATA_FORMAT = '{folder}/episode_{id}_meta.json'
 EP_REWARDS_FORMAT = '{folder}/episode_{id}_rewards.npy'
+RUN_STORE_FORMAT = '{folder}/run_{id}_store.vrs'
 
 
 class DataFeeder:
 
-    def __init__(self, src_folder, dst_folder, old_run_id, new_run_id):
+    def __init__(self, src_folder, dst_folder, old_run_id, new_run_id, on_update=None):
         self.src_folder = src_folder
         self.dst_folder = dst_folder
         self.run_id = new_run_id
         self.old_run_id = old_run_id
         self.episode_id = 1
         self.step_count = 0
-        self.data = None
+        self.total_reward = 0.0
+        self.run_rewards = None
+        self.episode_index = None
+        self.on_update = on_update
+        self.src_store = self._open_source_store()
+
+        # Progress, and a flag to stop feeding after the current episode
+        self.episodes_fed = 0
+        self.steps_fed = 0
+        self.bytes_written = 0
+        self.cancelled = threading.Event()
+
+    def _wrote(self, filename):
+        self.bytes_written += os.path.getsize(filename)
+
+    # Episodes are read from the source run's store if it has one
+    def _open_source_store(self):
+        filename = RUN_STORE_FORMAT.format(folder=self.src_folder, id=self.old_run_id)
+        return RunStore(filename) if os.path.exists(filename) else None
 
     def _load_episode_metadata(self):
+        if self.src_store is not None:
+            metadata = self.src_store.episode_metadata(self.episode_id)
+            if metadata is None:
+                raise KeyError(self.episode_id)
+            return dict(metadata, run=self.run_id)
+
         filename = EP_METADATA_FORMAT.format(
             folder=self.src_folder,
             id=self.episode_id
@@ -41,8 +73,12 @@ class DataFeeder:
         )
         with open(filename, 'w') as fh:
             json.dump(metadata, fh)
+        self._wrote(filename)
 
     def _load_episode_rewards(self):
+        if self.src_store is not None:
+            return np.array(self.src_store.episode_field(self.episode_id, 'rewards'))
+
         filename = EP_REWARDS_FORMAT.format(
             folder=self.src_folder,
             id=self.episode_id
@@ -55,30 +91,81 @@ class DataFeeder:
             id=self.episode_id
         )
         np.save(filename, rewards)
+        self._wrote(filename)
 
     def _copy_run_metadata(self):
         src = RUN_METADATA_FORMAT.format(folder=self.src_folder, id=self.old_run_id)
         dst = RUN_METADATA_FORMAT.format(folder=self.dst_folder, id=self.run_id)
         copyfile(src, dst)
+        self._wrote(dst)
 
     def _save_run_metadata(self):
         dst = RUN_METADATA_FORMAT.format(folder=self.dst_folder, id=self.run_id)
         meta = {
-            'episodes': self.episode_id,
-            'total_reward': np.sum(self.data),
-            'total_steps': self.data.size
+            'episodes': self.episodes_fed,
+            'total_reward': self.total_reward,
+            'total_steps': self.step_count
         }
         with open(dst, 'w') as fh:
             json.dump(meta, fh)
+        self._wrote(dst)
+
+    # Copies the source store with its episodes moved to the new run id
+    def _copy_run_store(self):
+        store = self.src_store
+        episodes = [
+            (int(episode_id), dict(metadata, run=self.run_id), {'rewards': store.episode_field(episode_id, 'rewards')})
+            for episode_id, metadata in zip(store.episode_ids, store.metadata)
+        ]
+        dst = RUN_STORE_FORMAT.format(folder=self.dst_folder, id=self.run_id)
+        write_run_store(dst, episodes)
+        self._wrote(dst)
+        self.episodes_fed = len(episodes)
+        self.steps_fed = store.steps
+
+    # Adds the episode to the run's episode index, so it can be found by step
+    # or reward while the run is still being fed
+    def _index_episode(self, rewards):
+        if self.episode_index is None:
+            filename = INDEX_FORMAT.format(folder=os.path.dirname(self.dst_folder), run=self.run_id)
+            self.episode_index = EpisodeIndexWriter(filename)
+        self.episode_index.append(self.episode_id, rewards)
+
+    # Gathers the fed episodes into the run's store
+    def _build_run_store(self):
+        dst = RUN_STORE_FORMAT.format(folder=self.dst_folder, id=self.run_id)
+        import_run_folder(self.dst_folder, dst)
+        self._wrote(dst)
 
     def _copy_run_rewards(self):
         src = RUN_REWARDS_FORMAT.format(folder=self.src_folder, id=self.old_run_id)
         dst = RUN_REWARDS_FORMAT.format(folder=self.dst_folder, id=self.run_id)
         copyfile(src, dst)
+        self._wrote(dst)
 
-    def _save_run_rewards(self):
+    # Writes the run rewards from the episodes fed so far, for runs that were
+    # fed without a delay and stopped before the end
+    def _save_fed_run_rewards(self):
+        rewards = [
+            np.load(EP_REWARDS_FORMAT.format(folder=self.dst_folder, id=episode_id))
+            for episode_id in range(1, self.episodes_fed + 1)
+        ]
+        rewards = np.concatenate(rewards) if len(rewards) > 0 else np.zeros(0)
         dst = RUN_REWARDS_FORMAT.format(folder=self.dst_folder, id=self.run_id)
-        np.save(dst, self.data)
+        np.save(dst, rewards)
+        self._wrote(dst)
+        self.step_count = rewards.size
+        self.total_reward = float(np.sum(rewards))
+
+    # Extends the run rewards file in place, rather than rewriting the whole run
+    def _append_run_rewards(self, rewards):
+        if self.run_rewards is None:
+            dst = RUN_REWARDS_FORMAT.format(folder=self.dst_folder, id=self.run_id)
+            self.run_rewards = AppendableArray(dst)
+        self.run_rewards.append(rewards)
+        self.bytes_written += rewards.nbytes
+        self.step_count += rewards.size
+        self.total_reward += float(np.sum(rewards))
 
     def _episode_iterator(self):
         while True:
@@ -90,7 +177,16 @@ class DataFeeder:
             except:
                 break
 
+    # Feeds the run, marking it as being fed for the catalog until done
     def feed(self, ep_delay):
+        marker = FEEDING_FORMAT.format(folder=os.path.dirname(self.dst_folder), run=self.run_id)
+        open(marker, 'w').close()
+        try:
+            self._feed(ep_delay)
+        finally:
+            os.remove(marker)
+
+    def _feed(self, ep_delay):
         # Feed validation data first
         for file in os.listdir(self.src_folder):
             if file.startswith('predictions_'):
@@ -98,45 +194,61 @@ class DataFeeder:
                     src=os.path.join(self.src_folder, file),
                     dst=os.path.join(self.dst_folder, file)
                 )
+                self._wrote(os.path.join(self.dst_folder, file))
+
+        # Without a delay a stored run is copied whole, rather than per episode
+        if ep_delay is None and self.src_store is not None:
+            self._copy_run_store()
+            build_episode_index(os.path.dirname(self.dst_folder), self.run_id)
+            self._copy_run_metadata()
+            self._copy_run_rewards()
+            return
 
-        # Process all episodes
+        # Process all episodes, stopping early if cancelled
         for metadata, rewards in self._episode_iterator():
+            if self.cancelled.is_set():
+                break
             print("Converting episode " + str(self.episode_id))
             self._save_episode_metadata(metadata)
             self._save_episode_rewards(rewards)
+            self._index_episode(rewards)
+            self.episodes_fed += 1
+            self.steps_fed += rewards.size
             if ep_delay is not None:
-                # Append to current data
-                if self.data is None:
-                    self.data = rewards
-                else:
-                    self.data = np.concatenate((self.data, rewards))
-
                 # Save run-level info
+                self._append_run_rewards(rewards)
                 self._save_run_metadata()
-                self._save_run_rewards()
-                # Sleep
-                time.sleep(ep_delay)
+                if self.on_update is not None:
+                    self.on_update(self.run_id)
+                # Sleep, waking early on cancel
+                self.cancelled.wait(ep_delay)
 
-        # Save the run data if not already
-        if ep_delay is None:
+        # Save the run data if not already.  A cancelled run keeps the
+        # episodes fed so far, so the source's run files no longer match it.
+        if self.run_rewards is not None:
+            self.run_rewards.close()
+        if self.episode_index is not None:
+            self.episode_index.close()
+        if ep_delay is None and not self.cancelled.is_set():
             self._copy_run_metadata()
             self._copy_run_rewards()
+        elif ep_delay is None:
+            self._save_fed_run_rewards()
+            self._save_run_metadata()
+        self._build_run_store()
 
 
-def _highest_run_id(data_folder):
-    highest_id = 0
-    for folder in os.listdir(data_folder):
-        try:
-            run_number = int(folder.split('_')[1])
-            highest_id = max(highest_id, run_number)
-        except:
-            pass
-    return highest_id
+    def cancel(self):
+        self.cancelled.set()
 
 
-def feed_folder(data_folder, feed_run, ep_delay, del_last=False):
-    # First we need to determine the next run id
-    highest_run_id = _highest_run_id(data_folder)
+# Creates the feeder of a run from the TOO_FEED folder into the next run id.
+# `on_update` is called with the run id whenever an episode has been added to
+# the run.
+def create_feeder(data_folder, feed_run, del_last=False, on_update=None):
+    # First we need to determine the next run id from the run folders
+    # themselves, as the catalog leaves out runs it could not read
+    highest_run_id = max(load_all_run_ids(data_folder), default=0)
     if del_last:
         next_run_id = highest_run_id
         rmtree('{data_folder}/run_{run_id}'.format(
@@ -155,12 +267,33 @@ def feed_folder(data_folder, feed_run, ep_delay, del_last=False):
         run_id=next_run_id
     )
 
-    # Make the dst folder
-    os.mkdir(dst_folder)
+    # Make the dst folder, which reserves the run id.  If another feed took the
+    # id first, move on to the next one.
+    while True:
+        try:
+            os.mkdir(dst_folder)
+            break
+        except FileExistsError:
+            next_run_id += 1
+            dst_folder = '{data_folder}/run_{run_id}'.format(
+                data_folder=data_folder,
+                run_id=next_run_id
+            )
+
+    return DataFeeder(src_folder, dst_folder, feed_run, next_run_id, on_update)
 
-    # Create and run
-    DataFeeder(src_folder, dst_folder, feed_run, next_run_id).feed(ep_delay)
+
+# Feeds a run from the TOO_FEED folder into the next run id
+def feed_folder(data_folder, feed_run, ep_delay, del_last=False, on_update=None):
+    create_feeder(data_folder, feed_run, del_last, on_update).feed(ep_delay)
 
 
 if __name__ == '__main__':
-    feed_folder(data_folder='../../../thesis_data', feed_run=6, ep_delay=0.2)
+    parser = argparse.ArgumentParser(description='Feed a run from the TOO_FEED folder as if it were training')
+    parser.add_argument('--folder', default='../thesis_data', help='data folder, relative to where this is run from')
+    parser.add_argument('--run', type=int, default=6, help='run in the TOO_FEED folder to feed')
+    parser.add_argument('--delay', type=float, default=0.2, help='seconds between episodes')
+    parser.add_argument('--del-last', action='store_true', help='delete the newest run first')
+    args = parser.parse_args()
+
+    feed_folder(data_folder=args.folder, feed_run=args.run, ep_delay=args.delay, del_last=args.del_last)
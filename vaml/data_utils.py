@@ -1,37 +1,173 @@
 import json
 import os
+import threading
 import numpy as np
+from collections import OrderedDict
 
-
-# Loads the 25, 50, and 75 percentile data for rewards across all runs.
-# Then applies compression to keep data size down.
-def load_metrics(folder, compression):
-    run_ids = load_all_run_ids(folder)[0:-1]
-    data = load_all_runs_field_numpy(folder, 'rewards', compression, run_ids)
-    percentiles = {
-        'p' + str(p): list(np.percentile(data, p, axis=0))
-        for p in [25, 50, 75]
-    }
-    return percentiles
+from vaml.data.clean_validation_data import GRID_FILE, GRID_INFO_FILE, build_grid_from_predictions
+from vaml.instrumentation import timed
+from vaml.pyramid import get_run_pyramid
+from vaml.reducers import reduce_run, reducer_keys
+from vaml.rolling import get_run_sums
+from vaml.run_store import load_run_store
 
 
 # Loads all of the specified field values within a given run.
-def load_run_field(folder, run_id, field, compression):
+def load_run_field(folder, run_id, field, compression, mode='mean'):
+    return reduced_to_json(load_run_field_numpy(folder, run_id, field, compression, mode), mode)
+
+
+def load_run_field_numpy(folder, run_id, field, compression, mode='mean'):
     # Read files
     reward_data = load_all_episodes_field_numpy(folder, run_id, field)
     if reward_data is None:
-        return list()
-    compressed = compress_array(reward_data, compression)
-    return compressed.tolist()
+        return empty_reduced(mode)
+    return compress_run_field(folder, run_id, field, reward_data, compression, mode=mode)
+
+
+# Same result as `compress_array`, but answered from the run's pyramid so
+# the cost depends on the output size rather than the run length.  `mode`
+# picks the reducer, see `vaml.reducers`.
+def compress_run_field(folder, run_id, field, steps, compression, first=0, count=None, mode='mean'):
+    with timed('pyramid'):
+        pyramid = get_run_pyramid(folder, run_id, field, steps)
+    with timed('reduce'):
+        return reduce_run(pyramid, steps, compression, first, count, mode)
+
+
+# Reducers with several rows are sent as a dictionary of lists by row name
+def reduced_to_json(values, mode):
+    keys = reducer_keys(mode)
+    with timed('serialize'):
+        if keys is None:
+            return values.tolist()
+        return {key: values[idx].tolist() for idx, key in enumerate(keys)}
+
+
+def empty_reduced(mode):
+    keys = reducer_keys(mode)
+    return np.zeros(0) if keys is None else np.zeros((len(keys), 0))
+
+
+# Loads the steps from `start` to `end` of a run field as at most `points`
+# buckets.  The bucket size is picked as the smallest power of two that fits,
+# so buckets come straight off a pyramid level, and the window is widened to
+# whole buckets.  Returns the first step covered, the bucket size, and the
+# reduced buckets.
+def load_run_field_range(folder, run_id, field, start, end, points, mode='mean'):
+    steps = load_all_episodes_field_numpy(folder, run_id, field)
+    if steps is None:
+        return 0, 1, empty_reduced(mode)
+    compression, first, count = range_buckets(len(steps), start, end, points)
+    values = compress_run_field(folder, run_id, field, steps, compression, first, count, mode)
+    return first * compression, compression, values
+
+
+# Picks the buckets for the steps from `start` to `end` of a run of `length`
+# steps, returning the bucket size, first bucket and number of buckets
+def range_buckets(length, start, end, points):
+    end = length if end is None else max(0, min(end, length))
+    start = max(0, min(start, end))
+
+    compression = 1
+    while (end - start) > compression * max(points, 1):
+        compression *= 2
+    first = start // compression
+    count = -(-end // compression) - first
+    return compression, first, count
+
+
+# Rolling statistics of a run field, one value at the end of every bucket of
+# `compression` steps.  `stat` is the 'mean' or 'std' over the trailing
+# `window` steps (one bucket by default), or the 'ewma' with smoothing factor
+# `alpha` (2 / (window + 1) by default).  See `vaml.rolling`.
+def load_run_rolling(folder, run_id, field, stat, compression, window=None, alpha=None, first=0, count=None):
+    steps = load_all_episodes_field_numpy(folder, run_id, field)
+    if steps is None:
+        return np.zeros(0)
+    window = window or compression
+    alpha = alpha or 2.0 / (window + 1)
+    with timed('cumsum'):
+        sums = get_run_sums(folder, run_id, field, steps)
+    with timed('reduce'):
+        return sums.rolling(steps, stat, compression, window, alpha, first, count)
+
+
+# Same as `load_run_field_range`, for the rolling statistics.  The window
+# defaults to one bucket of the picked size.
+def load_run_rolling_range(folder, run_id, field, stat, start, end, points, window=None, alpha=None):
+    steps = load_all_episodes_field_numpy(folder, run_id, field)
+    if steps is None:
+        return 0, 1, np.zeros(0)
+    compression, first, count = range_buckets(len(steps), start, end, points)
+    values = load_run_rolling(folder, run_id, field, stat, compression, window, alpha, first, count)
+    return first * compression, compression, values
 
 
 # Loads all of the predictions being made against the sample
 def load_predictions(folder, run_id, sample):
-    return np.load('{folder}/run_{run}/predictions_{sample}.npy'.format(
+    predictions = load_predictions_numpy(folder, run_id, sample)
+    with timed('serialize'):
+        return predictions.tolist()
+
+
+def load_predictions_numpy(folder, run_id, sample):
+    return load_numpy('{folder}/run_{run}/predictions_{sample}.npy'.format(
         folder=folder,
         run=run_id,
         sample=sample
-    )).tolist()
+    ))
+
+
+# Loads the prediction grids of a run as a (samples, checkpoints, actions)
+# array, along with the sample names and the steps per checkpoint.  Runs that
+# only have the per-sample predictions files get their grid built on first
+# use.  Returns None if the run has no predictions.
+def load_prediction_grid(folder, run_id):
+    run_folder = '{folder}/run_{run}'.format(folder=folder, run=run_id)
+    info_file = '{base}/{name}'.format(base=run_folder, name=GRID_INFO_FILE)
+    if not os.path.exists(info_file):
+        # Only one request builds a run's grid, the rest wait for it
+        with _grid_lock(run_folder):
+            if not os.path.exists(info_file):
+                try:
+                    if build_grid_from_predictions(run_folder) == 0:
+                        return None
+                except OSError:
+                    return None
+    with open(info_file, 'r') as fh:
+        info = json.load(fh)
+    grid = load_numpy('{base}/{name}'.format(base=run_folder, name=GRID_FILE))
+    return info['samples'], info['compression'], grid
+
+
+GRID_LOCKS = {}
+GRID_LOCKS_LOCK = threading.Lock()
+
+
+def _grid_lock(run_folder):
+    with GRID_LOCKS_LOCK:
+        return GRID_LOCKS.setdefault(run_folder, threading.Lock())
+
+
+# Loads the grids of several runs for the given samples (every sample of the
+# first run by default).  Runs missing any of the samples are left out.
+# Returns the samples, the steps per checkpoint, and a list of run id and
+# (samples, checkpoints, actions) array pairs.
+def load_prediction_grids(folder, run_ids, samples=None):
+    compression = None
+    runs = list()
+    for run_id in run_ids:
+        loaded = load_prediction_grid(folder, run_id)
+        if loaded is None:
+            continue
+        run_samples, run_compression, grid = loaded
+        samples = samples or run_samples
+        if not all(sample in run_samples for sample in samples):
+            continue
+        compression = compression or run_compression
+        runs.append((run_id, grid[[run_samples.index(sample) for sample in samples]]))
+    return samples or [], compression, runs
 
 
 # Compresses the size of a number array by bucketizing values across their mean.
@@ -49,7 +185,7 @@ def compress_array(steps, compression):
 
     # Padding section
     if padding > 0:
-        reduced[-1] = steps[-compression:-padding].mean()
+        reduced[-1] = steps[-(compression - padding):].mean()
     return reduced
 
 
@@ -59,6 +195,36 @@ def iterate_episodes(run_metadata):
         yield episode_id
 
 
+#################### SHARED ARRAY CACHE ####################
+
+ARRAY_CACHE_SIZE = 256
+ARRAY_CACHE = OrderedDict()
+ARRAY_CACHE_LOCK = threading.Lock()
+
+
+# Opens a .npy file memory-mapped and keeps it in a bounded LRU cache keyed by
+# path, so concurrent requests share the same mapped pages.  Entries are
+# replaced once the file's mtime or size changes, which keeps runs that are
+# still being fed up to date.  The returned arrays are read-only.
+def load_numpy(filename):
+    stat = os.stat(filename)
+    version = (stat.st_mtime_ns, stat.st_size)
+    with ARRAY_CACHE_LOCK:
+        cached = ARRAY_CACHE.get(filename)
+        if cached is not None and cached[0] == version:
+            ARRAY_CACHE.move_to_end(filename)
+            return cached[1]
+
+    with timed('load'):
+        array = np.load(filename, mmap_mode='r')
+    with ARRAY_CACHE_LOCK:
+        ARRAY_CACHE[filename] = (version, array)
+        ARRAY_CACHE.move_to_end(filename)
+        while len(ARRAY_CACHE) > ARRAY_CACHE_SIZE:
+            ARRAY_CACHE.popitem(last=False)
+    return array
+
+
 #################### DIRECT LOADING OF FILES ####################
 
 def load_all_run_ids(folder):
@@ -84,31 +250,38 @@ def load_run_field_json(folder, run_id, field):
         return json.load(fh)
 
 
+# Loads a field of every run as a (runs, buckets) array.  Runs differ in
+# length, so shorter runs are padded with NaN up to the longest one.
 def load_all_runs_field_numpy(folder, field, compression, run_ids=None):
     # Ensure run ids loaded
     run_ids = run_ids or load_all_run_ids(folder)
 
     # Load all data
     data = list()
-    shortest_length = 99999999
     for run_id in run_ids:
         item = load_all_episodes_field_numpy(folder, run_id, field)
         if item is not None:
-            item = compress_array(item, compression)
-            data.append(item)
-            shortest_length = min(shortest_length, item.size)
+            data.append(compress_run_field(folder, run_id, field, item, compression))
+    return pad_runs(data)
 
-    # Trim each item as needed
-    for idx in range(0, len(data)):
-        data[idx] = np.reshape(data[idx][0:shortest_length], (1, shortest_length))
 
-    # Convert into a volume of data
-    combined = np.concatenate(data, axis=0)
+# Stacks runs of different lengths into a NaN padded (runs, longest) array
+def pad_runs(runs):
+    combined = np.full((len(runs), max((len(run) for run in runs), default=0)), np.nan)
+    for idx, run in enumerate(runs):
+        combined[idx, 0:len(run)] = run
     return combined
 
 
+# Episodes are sliced out of the run store when the run has one, falling back
+# to the per-episode files otherwise
 def load_episode_field_numpy(folder, run_id, episode_id, field):
-    return np.load('{folder}/run_{run}/episode_{ep}_{field}.npy'.format(
+    store = load_run_store(folder, run_id)
+    if store is not None:
+        values = store.episode_field(episode_id, field)
+        if values is not None:
+            return values
+    return load_numpy('{folder}/run_{run}/episode_{ep}_{field}.npy'.format(
         folder=folder,
         run=run_id,
         ep=episode_id,
@@ -116,9 +289,27 @@ def load_episode_field_numpy(folder, run_id, episode_id, field):
     ))
 
 
+# Returns the metadata of an episode, or None if the episode does not exist
+def load_episode_metadata(folder, run_id, episode_id):
+    store = load_run_store(folder, run_id)
+    if store is not None:
+        metadata = store.episode_metadata(episode_id)
+        if metadata is not None:
+            return metadata
+    try:
+        with open('{folder}/run_{run}/episode_{ep}_meta.json'.format(
+            folder=folder,
+            run=run_id,
+            ep=episode_id
+        ), 'r') as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
+
+
 def load_all_episodes_field_numpy(folder, run_id, field):
     try:
-        return np.load('{folder}/run_{run}/run_{run}_{field}.npy'.format(
+        return load_numpy('{folder}/run_{run}/run_{run}_{field}.npy'.format(
             folder=folder,
             run=run_id,
             field=field
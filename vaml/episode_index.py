@@ -0,0 +1,160 @@
+import os
+import tempfile
+import threading
+import numpy as np
+
+from vaml.data.appendable import AppendableArray
+from vaml.data_utils import load_numpy
+from vaml.run_store import EP_FIELD_FORMAT, list_episode_files, load_run_store
+
+
+# The episode index of a run is a small table with one row per episode,
+# stored as a (episodes, columns) float64 .npy file that can be appended to
+# while the run is being fed.  `start` is the position of the episode's first
+# step in the run's steps, so the starts are sorted and an episode can be
+# found from a step with a binary search.  The name is kept apart from the
+# run_{run}_{field}.npy files so the index is not taken for a field.
+INDEX_FORMAT = '{folder}/run_{run}/episode_index.npy'
+INDEX_COLUMNS = ['episode', 'start', 'length', 'total', 'min', 'max']
+COLUMN = {name: index for index, name in enumerate(INDEX_COLUMNS)}
+
+INDEX_LOCKS = {}
+INDEX_LOCKS_LOCK = threading.Lock()
+
+
+def _index_lock(folder, run_id):
+    with INDEX_LOCKS_LOCK:
+        return INDEX_LOCKS.setdefault((folder, str(run_id)), threading.Lock())
+
+
+# Summary rows of episodes given their ids, starts and rewards.  Episodes
+# without any steps have a min and max of NaN.
+def summarize_episodes(episode_ids, starts, lengths, rewards):
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    rows = np.full((len(episode_ids), len(INDEX_COLUMNS)), np.nan)
+    rows[:, COLUMN['episode']] = episode_ids
+    rows[:, COLUMN['start']] = starts
+    rows[:, COLUMN['length']] = lengths
+    rows[:, COLUMN['total']] = 0.0
+    filled = lengths > 0
+    if np.any(filled):
+        # Offsets of the non-empty episodes into `rewards`
+        offsets = (starts - starts[0])[filled]
+        rows[filled, COLUMN['total']] = np.add.reduceat(rewards, offsets)
+        rows[filled, COLUMN['min']] = np.minimum.reduceat(rewards, offsets)
+        rows[filled, COLUMN['max']] = np.maximum.reduceat(rewards, offsets)
+    return rows
+
+
+# Adds episodes to a run's index as they are written
+class EpisodeIndexWriter:
+    def __init__(self, filename):
+        self._rows = AppendableArray(filename, row_shape=(len(INDEX_COLUMNS),))
+        self.next_start = 0
+        if self._rows.rows > 0:
+            last = np.load(filename, mmap_mode='r')[-1]
+            self.next_start = int(last[COLUMN['start']] + last[COLUMN['length']])
+
+    def append(self, episode_id, rewards):
+        rewards = np.asarray(rewards, dtype=np.float64)
+        self._rows.append(summarize_episodes([episode_id], [self.next_start], [rewards.size], rewards))
+        self.next_start += rewards.size
+
+    def close(self):
+        self._rows.close()
+
+
+# Writes the index of a run from its store, or from its episode files if it
+# has not been imported, and returns the number of episodes
+def build_episode_index(folder, run_id):
+    with _index_lock(folder, run_id):
+        return _build_episode_index(folder, run_id)
+
+
+def _build_episode_index(folder, run_id):
+    store = load_run_store(folder, run_id)
+    if store is not None and 'rewards' in store.fields:
+        offsets = np.asarray(store.offsets)
+        rows = summarize_episodes(store.episode_ids, offsets[:-1], np.diff(offsets), store.field('rewards'))
+    else:
+        run_folder = '{folder}/run_{run}'.format(folder=folder, run=run_id)
+        episode_ids = list_episode_files(run_folder)
+        rewards = [np.load(EP_FIELD_FORMAT.format(folder=run_folder, id=episode_id, field='rewards'))
+                   for episode_id in episode_ids]
+        lengths = [episode.size for episode in rewards]
+        starts = np.concatenate(([0], np.cumsum(lengths)))[:-1]
+        rows = summarize_episodes(episode_ids, starts, lengths,
+                                  np.concatenate(rewards) if len(rewards) > 0 else np.zeros(0))
+
+    # Written beside the index and moved over it, so readers never see half
+    filename = INDEX_FORMAT.format(folder=folder, run=run_id)
+    fd, temp_filename = tempfile.mkstemp(prefix='episode_index.', suffix='.tmp', dir=os.path.dirname(filename))
+    os.close(fd)
+    try:
+        writer = AppendableArray(temp_filename, row_shape=(len(INDEX_COLUMNS),))
+        writer.append(rows)
+        writer.close()
+        os.replace(temp_filename, filename)
+    except BaseException:
+        os.remove(temp_filename)
+        raise
+    return len(rows)
+
+
+# Returns the index of a run, building it on first use for runs converted
+# before indexes existed, or None if the run does not exist
+def load_episode_index(folder, run_id):
+    filename = INDEX_FORMAT.format(folder=folder, run=run_id)
+    if not os.path.exists(filename):
+        # Only one request builds a run's index, the rest wait for it
+        with _index_lock(folder, run_id):
+            if not os.path.exists(filename):
+                try:
+                    _build_episode_index(folder, run_id)
+                except OSError:
+                    return None
+    return load_numpy(filename)
+
+
+# The episode holding a step, or None if the step is past the end of the run
+def find_episode(index, step):
+    starts = index[:, COLUMN['start']]
+    position = int(np.searchsorted(starts, step, side='right')) - 1
+    if position < 0 or step >= starts[position] + index[position, COLUMN['length']]:
+        return None
+    return index[position]
+
+
+# The episodes with any steps in [start, end)
+def episodes_in_range(index, start, end):
+    starts = index[:, COLUMN['start']]
+    ends = starts + index[:, COLUMN['length']]
+    first = int(np.searchsorted(ends, start, side='right'))
+    last = int(np.searchsorted(starts, end, side='left'))
+    return index[first:max(first, last)]
+
+
+# The `k` episodes with the highest (or lowest) value of a column, in order
+def top_episodes(index, k, column='total', ascending=False):
+    values = np.asarray(index[:, COLUMN[column]])
+    values = values if ascending else -values
+    k = min(k, len(values))
+    if k <= 0:
+        return index[0:0]
+    # Partition first, so only the top k are sorted.  NaNs end up last.
+    candidates = np.argpartition(values, k - 1)[:k] if k < len(values) else np.arange(len(values))
+    return index[candidates[np.argsort(values[candidates], kind='stable')]]
+
+
+# Column oriented JSON for a set of rows
+def index_to_json(rows):
+    rows = np.asarray(rows).reshape(-1, len(INDEX_COLUMNS))
+    data = {}
+    for name in INDEX_COLUMNS:
+        values = rows[:, COLUMN[name]]
+        if name in ('episode', 'start', 'length'):
+            data[name] = values.astype(np.int64).tolist()
+        else:
+            data[name] = [None if np.isnan(value) else float(value) for value in values]
+    return data
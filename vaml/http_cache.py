@@ -0,0 +1,110 @@
+import gzip
+import hashlib
+import os
+import threading
+import zlib
+from email.utils import formatdate, parsedate_to_datetime
+
+
+# Bodies smaller than this are sent as-is, since compressing them saves little
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+COMPRESSIBLE_TYPES = ('text/html', 'text/css', 'text/javascript', 'application/json')
+
+
+def is_compressible(content_type, body):
+    return content_type in COMPRESSIBLE_TYPES and len(body) >= GZIP_MIN_SIZE
+
+
+def gzip_body(body):
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+# Picks the content encoding to use from an Accept-Encoding header, preferring
+# gzip since static files are kept precompressed with it
+def negotiate_encoding(accept_encoding):
+    accepted = set()
+    for token in (accept_encoding or '').split(','):
+        parts = token.strip().split(';')
+        if len(parts) > 1 and parts[1].strip() in ('q=0', 'q=0.0'):
+            continue
+        accepted.add(parts[0].strip().lower())
+    for encoding in ('gzip', 'deflate'):
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+def encode_body(body, encoding):
+    if encoding == 'gzip':
+        return gzip_body(body)
+    return zlib.compress(body, GZIP_LEVEL)
+
+
+# ETag for a file, which changes whenever its mtime or size does
+def file_etag(stat):
+    return '"{:x}-{:x}"'.format(stat.st_mtime_ns, stat.st_size)
+
+
+# ETag for a computed response, built from a hash of the body
+def content_etag(body):
+    return '"{}"'.format(hashlib.md5(body).hexdigest())
+
+
+# ETag of a body sent with a content encoding.  The encoded bytes differ from
+# the identity ones, so each encoding gets its own strong validator.
+def encoded_etag(etag, encoding):
+    if encoding is None:
+        return etag
+    return '{}-{}"'.format(etag[:-1], encoding)
+
+
+def http_date(timestamp):
+    return formatdate(timestamp, usegmt=True)
+
+
+# Checks the conditional request headers against the current validators
+def is_not_modified(headers, etag, mtime=None):
+    if_none_match = headers.get('If-None-Match')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return etag in tags or '*' in tags
+    if_modified_since = headers.get('If-Modified-Since')
+    if if_modified_since is not None and mtime is not None:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+# A file body held in memory along with its precompressed copy
+class CachedFile:
+    def __init__(self, content_type, body, stat):
+        self.content_type = content_type
+        self.body = body
+        self.gzipped = gzip_body(body) if is_compressible(content_type, body) else None
+        self.etag = file_etag(stat)
+        self.mtime = stat.st_mtime
+
+
+STATIC_FILES = {}
+STATIC_FILES_LOCK = threading.Lock()
+
+
+# Returns the in-memory copy of a static file, only re-reading and
+# re-compressing it when the file on disk has changed.  `loader` reads the
+# file, returning its content type and body.
+def load_static_file(filename, loader):
+    stat = os.stat(filename)
+    etag = file_etag(stat)
+    with STATIC_FILES_LOCK:
+        cached = STATIC_FILES.get(filename)
+    if cached is not None and cached.etag == etag:
+        return cached
+
+    content_type, body = loader()
+    cached = CachedFile(content_type, body, stat)
+    with STATIC_FILES_LOCK:
+        STATIC_FILES[filename] = cached
+    return cached
@@ -0,0 +1,241 @@
+import sys
+import threading
+import time
+import traceback
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+
+
+# Upper bounds in milliseconds of the latency histogram buckets, with a final
+# bucket for anything slower
+HISTOGRAM_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+# Frames kept from the innermost end of each sampled stack
+STACK_DEPTH = 16
+# Hot stacks reported for each slow request
+TOP_STACKS = 10
+
+_local = threading.local()
+
+
+# Time spent by one request in each phase, such as loading arrays, reducing
+# them, serializing the response or writing it to the socket.  Phases can be
+# added from the compute threads working on the request, so phases run in
+# parallel are summed across threads.
+class RequestTimer:
+    def __init__(self, route, path):
+        self.route = route
+        self.path = path
+        self.start = time.perf_counter()
+        self.phases = OrderedDict()
+        self.samples = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, phase, seconds):
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def add_sample(self, stack):
+        with self._lock:
+            self.samples[stack] += 1
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    # Value for the Server-Timing header, in milliseconds
+    def server_timing(self):
+        with self._lock:
+            phases = list(self.phases.items())
+        phases.append(('total', self.elapsed()))
+        return ', '.join('{};dur={:.2f}'.format(phase, seconds * 1000) for phase, seconds in phases)
+
+
+def current_timer():
+    return getattr(_local, 'timer', None)
+
+
+# Times the block as a phase of the request being handled on this thread, and
+# does nothing outside of a request
+@contextmanager
+def timed(phase):
+    timer = current_timer()
+    if timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(phase, time.perf_counter() - start)
+
+
+# Attributes the work done on this thread to the request's timer
+@contextmanager
+def request_context(timer):
+    previous = current_timer()
+    _local.timer = timer
+    PROFILER.register(timer)
+    try:
+        yield
+    finally:
+        _local.timer = previous
+        PROFILER.register(previous)
+
+
+# Leaves the current thread out of the profile while it waits on other
+# threads, so its idle stack does not hide where the work happens
+@contextmanager
+def waiting():
+    PROFILER.register(None)
+    try:
+        yield
+    finally:
+        PROFILER.register(current_timer())
+
+
+# Latency histogram and phase totals for one route
+class RouteStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * (len(HISTOGRAM_BUCKETS_MS) + 1)
+        self.phases = OrderedDict()
+
+    def add(self, timer, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        bucket = 0
+        while bucket < len(HISTOGRAM_BUCKETS_MS) and seconds * 1000 > HISTOGRAM_BUCKETS_MS[bucket]:
+            bucket += 1
+        self.histogram[bucket] += 1
+        for phase, phase_seconds in timer.phases.items():
+            self.phases[phase] = self.phases.get(phase, 0.0) + phase_seconds
+
+    def to_json(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count * 1000 if self.count > 0 else 0.0,
+            'max_ms': self.max * 1000,
+            'histogram': {
+                'le_ms': HISTOGRAM_BUCKETS_MS + ['inf'],
+                'counts': self.histogram
+            },
+            'phases_mean_ms': {
+                phase: seconds / self.count * 1000 for phase, seconds in self.phases.items()
+            }
+        }
+
+
+# Aggregated timings of every request, by route
+class RequestStats:
+    def __init__(self):
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def record(self, timer):
+        seconds = timer.elapsed()
+        with self._lock:
+            self._routes.setdefault(timer.route, RouteStats()).add(timer, seconds)
+
+    def reset(self):
+        with self._lock:
+            self._routes = {}
+
+    def to_json(self):
+        with self._lock:
+            return {route: stats.to_json() for route, stats in sorted(self._routes.items())}
+
+
+STATS = RequestStats()
+
+
+def _stack_key(frame):
+    return tuple(
+        '{}:{} {}'.format(entry.filename, entry.lineno, entry.name)
+        for entry in traceback.extract_stack(frame)[-STACK_DEPTH:]
+    )
+
+
+# Samples the stacks of the threads working on requests every `interval`
+# seconds while enabled.  Requests slower than `slow_ms` have their hottest
+# stacks printed and kept for /data/stats.
+class SamplingProfiler:
+    def __init__(self):
+        self.slow_ms = 250.0
+        self.interval = 0.005
+        self.slow_requests = deque(maxlen=20)
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._enabled = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return self._enabled.is_set()
+
+    def configure(self, enabled, slow_ms=None, interval_ms=None):
+        if slow_ms is not None:
+            self.slow_ms = float(slow_ms)
+        if interval_ms is not None:
+            self.interval = float(interval_ms) / 1000
+        if not enabled:
+            self._enabled.clear()
+            return
+        self._enabled.set()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample, daemon=True)
+                self._thread.start()
+
+    # Marks the current thread as working on a request, or idle if None
+    def register(self, timer):
+        ident = threading.get_ident()
+        with self._lock:
+            if timer is None:
+                self._threads.pop(ident, None)
+            else:
+                self._threads[ident] = timer
+
+    def _sample(self):
+        while True:
+            self._enabled.wait()
+            frames = sys._current_frames()
+            with self._lock:
+                threads = list(self._threads.items())
+            for ident, timer in threads:
+                frame = frames.get(ident)
+                if frame is not None:
+                    timer.add_sample(_stack_key(frame))
+            time.sleep(self.interval)
+
+    # Reports the request if it was slow
+    def finish(self, timer):
+        milliseconds = timer.elapsed() * 1000
+        if not self.enabled or milliseconds < self.slow_ms or len(timer.samples) == 0:
+            return
+        report = {
+            'route': timer.route,
+            'path': timer.path,
+            'ms': milliseconds,
+            'samples': sum(timer.samples.values()),
+            'stacks': [
+                {'count': count, 'stack': list(stack)}
+                for stack, count in timer.samples.most_common(TOP_STACKS)
+            ]
+        }
+        self.slow_requests.append(report)
+        print("Slow request {path} took {ms:.1f}ms".format(path=timer.path, ms=milliseconds))
+        for entry in report['stacks'][0:3]:
+            print("  {count} samples: {frame}".format(count=entry['count'], frame=entry['stack'][-1]))
+
+    def to_json(self):
+        return {
+            'enabled': self.enabled,
+            'slow_ms': self.slow_ms,
+            'interval_ms': self.interval * 1000,
+            'slow_requests': list(self.slow_requests)
+        }
+
+
+PROFILER = SamplingProfiler()
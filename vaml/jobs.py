@@ -0,0 +1,132 @@
+import itertools
+import threading
+import time
+
+from vaml.catalog import get_catalog
+from vaml.data.feed_data import create_feeder
+
+
+# A feed of one run running on its own thread
+class FeedJob:
+    def __init__(self, job_id, folder, feed_run, ep_delay, del_last, on_update):
+        self.id = job_id
+        self.folder = folder
+        self.feed_run = feed_run
+        self.ep_delay = ep_delay
+        self.del_last = del_last
+        self.on_update = on_update
+        self.state = 'starting'
+        self.error = None
+        self.feeder = None
+        self.started = time.time()
+        self.finished = None
+        self._cancelled = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self.state in ('starting', 'running')
+
+    @property
+    def run_id(self):
+        return None if self.feeder is None else self.feeder.run_id
+
+    def _run(self, wait_for):
+        try:
+            for job in wait_for:
+                job.join()
+            if not self._cancelled.is_set():
+                self.feeder = create_feeder(self.folder, self.feed_run, self.del_last, self.on_update)
+                if self._cancelled.is_set():
+                    self.feeder.cancel()
+                self.state = 'running'
+                self.feeder.feed(self.ep_delay)
+            self.state = 'cancelled' if self._cancelled.is_set() else 'done'
+        except Exception as e:
+            self.state = 'failed'
+            self.error = str(e)
+            print("Feed job {} failed: {}".format(self.id, e))
+        finally:
+            self.finished = time.time()
+
+    def start(self, wait_for=()):
+        self._thread = threading.Thread(target=self._run, args=(list(wait_for),), daemon=True)
+        self._thread.start()
+
+    # Stops the feed after the episode it is on, without waiting for it
+    def cancel(self):
+        self._cancelled.set()
+        if self.feeder is not None:
+            self.feeder.cancel()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def to_json(self):
+        elapsed = (self.finished or time.time()) - self.started
+        feeder = self.feeder
+        episodes = 0 if feeder is None else feeder.episodes_fed
+        return {
+            'id': self.id,
+            'feed_run': self.feed_run,
+            'run': self.run_id,
+            'state': self.state,
+            'error': self.error,
+            'episodes': episodes,
+            'steps': 0 if feeder is None else int(feeder.steps_fed),
+            'bytes_written': 0 if feeder is None else feeder.bytes_written,
+            'elapsed_s': elapsed,
+            'episodes_per_s': episodes / elapsed if elapsed > 0 else 0.0
+        }
+
+
+# Starts, cancels and reports on feeds, several of which can run at once
+# into different run ids.  Nothing here blocks on a feed.
+class FeedJobManager:
+    def __init__(self):
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    # Starts feeding `feed_run` into a new run.  With `del_last` the newest run
+    # is replaced instead, so any job still writing to it is cancelled first
+    # and the new job waits for it to stop before deleting the run.
+    def start(self, folder, feed_run, ep_delay, del_last=False, on_update=None):
+        with self._lock:
+            wait_for = list()
+            if del_last:
+                catalog = get_catalog(folder)
+                catalog.refresh()
+                replaced = catalog.highest_run_id()
+                for job in self._jobs.values():
+                    if job.running and (job.run_id is None or job.run_id == replaced):
+                        job.cancel()
+                        wait_for.append(job)
+            job = FeedJob(next(self._ids), folder, feed_run, ep_delay, del_last, on_update)
+            self._jobs[job.id] = job
+        job.start(wait_for)
+        return job
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel()
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def running(self):
+        return [job for job in self.jobs() if job.running]
+
+    def to_json(self):
+        return [job.to_json() for job in self.jobs()]
+
+
+JOBS = FeedJobManager()
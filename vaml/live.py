@@ -0,0 +1,141 @@
+import asyncio
+import json
+import os
+import websockets
+
+from vaml.data_utils import load_all_episodes_field_numpy, compress_run_field
+
+
+# How often subscriptions check the run files when no feeder notifies them,
+# which covers runs being written by another process.
+POLL_INTERVAL = 1.0
+
+
+# Wakes every live subscription on the websocket event loop.  `notify` is safe
+# to call from any thread, such as the one running a DataFeeder.
+class RunNotifier:
+    def __init__(self):
+        self._loop = None
+        self._event = None
+
+    def attach(self, loop):
+        self._loop = loop
+        self._event = asyncio.Event()
+
+    def notify(self, run_id=None):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        self._event.set()
+        self._event = asyncio.Event()
+
+    # Waits until notified, or until the timeout passes
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+NOTIFIER = RunNotifier()
+
+
+def _file_version(filename):
+    try:
+        stat = os.stat(filename)
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
+
+
+# Returns the number of steps in the run, along with the compressed buckets
+# from `first` onwards.
+def load_run_delta(folder, run_id, field, compression, first):
+    steps = load_all_episodes_field_numpy(folder, run_id, field)
+    if steps is None:
+        return 0, None
+    return len(steps), compress_run_field(folder, run_id, field, steps, compression, first)
+
+
+# Pushes a run field to the websocket as it grows.  Each message holds the
+# buckets from `start` onwards, which replace anything the client has from that
+# bucket on.  Only the buckets that changed are sent: new complete buckets and
+# the trailing partial one.  A replaced run is sent again from the start.
+async def push_run_deltas(websocket, executor, folder, run_id, field, compression):
+    loop = asyncio.get_event_loop()
+    filename = '{folder}/run_{run}/run_{run}_{field}.npy'.format(folder=folder, run=run_id, field=field)
+    version = None
+    first = 0
+    try:
+        while True:
+            current = _file_version(filename)
+            if current != version:
+                if version is None or current is None or current[0] != version[0]:
+                    first = 0
+                version = current
+
+                length, values = await loop.run_in_executor(
+                    executor, load_run_delta, folder, run_id, field, compression, first)
+                if values is not None:
+                    await websocket.send(json.dumps({
+                        'run': run_id,
+                        'field': field,
+                        'compression': compression,
+                        'start': first,
+                        'values': values.tolist()
+                    }))
+                    # The last bucket is sent again next time if it is partial
+                    first = length // compression
+            await NOTIFIER.wait(POLL_INTERVAL)
+    except websockets.ConnectionClosed:
+        pass
+
+
+# Reads a subscription message as its action, run id, field and compression
+# (None when unsubscribing).  Raises ValueError if it is malformed.
+def parse_subscription(message):
+    try:
+        request = json.loads(message)
+    except ValueError:
+        raise ValueError('Expected a JSON object')
+    if not isinstance(request, dict):
+        raise ValueError('Expected a JSON object')
+    action = request.get('action', 'subscribe')
+    if action not in ('subscribe', 'unsubscribe'):
+        raise ValueError('Unknown action: {}'.format(action))
+    try:
+        run_id = int(request['run'])
+        field = str(request['field'])
+        compression = int(request['compression']) if action == 'subscribe' else None
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Expected an integer run, a field and an integer compression')
+    if compression is not None and compression < 1:
+        raise ValueError('Expected a positive compression')
+    return action, run_id, field, compression
+
+
+# Handles the subscriptions of one websocket client.  Clients send
+# {"action": "subscribe", "run", "field", "compression"} to start receiving
+# updates for a run field, or "unsubscribe" to stop them.  Malformed messages
+# are answered with {"error"} and the connection is kept open.
+async def handle_subscriptions(websocket, executor, folder):
+    subscriptions = {}
+    try:
+        async for message in websocket:
+            try:
+                action, run_id, field, compression = parse_subscription(message)
+            except ValueError as e:
+                await websocket.send(json.dumps({'error': str(e)}))
+                continue
+            key = (run_id, field)
+            if key in subscriptions:
+                subscriptions.pop(key).cancel()
+            if action == 'subscribe':
+                subscriptions[key] = asyncio.ensure_future(push_run_deltas(
+                    websocket, executor, folder, run_id, field, compression))
+    except websockets.ConnectionClosed:
+        pass
+    finally:
+        for task in subscriptions.values():
+            task.cancel()
@@ -0,0 +1,230 @@
+import json
+import os
+import threading
+import numpy as np
+from collections import OrderedDict
+
+from vaml.catalog import get_catalog
+from vaml.data_utils import load_all_episodes_field_numpy, compress_run_field
+from vaml.instrumentation import timed
+from vaml.reducers import BUCKET_MODES
+
+
+PERCENTILES = [25, 50, 75]
+# Named run groups of a data folder, as {"name": [run ids]}
+GROUPS_FORMAT = '{folder}/groups.json'
+# Groups every data folder has: every run, every run but the newest, and the
+# runs that are no longer being written
+BUILTIN_GROUPS = ('all', 'previous', 'complete')
+# The dashboard draws the newest run against the bands of the runs before it,
+# so it is left out unless a group is asked for
+DEFAULT_GROUP = 'previous'
+METRICS_CACHE_SIZE = 64
+# Percentile sets kept per group and compression level
+BANDS_CACHE_SIZE = 8
+
+
+# Percentiles of every column of a NaN padded (runs, buckets) matrix, given
+# the number of runs in each column, as a (percentiles, buckets) array.  Each
+# column is sorted with its NaNs last, so the percentiles interpolate between
+# the column's `counts` real values the same way `np.percentile` does, for
+# every column and percentile at once.
+def masked_percentiles(matrix, counts, percentiles):
+    if matrix.shape[1] == 0:
+        return np.zeros((len(percentiles), 0))
+    ordered = np.sort(matrix, axis=0)
+    last = np.maximum(counts - 1, 0)[None, :]
+    positions = np.asarray(percentiles, dtype=np.float64)[:, None] / 100 * last
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.minimum(lower + 1, last)
+    low = np.take_along_axis(ordered, lower, axis=0)
+    high = np.take_along_axis(ordered, upper, axis=0)
+    bands = low + (high - low) * (positions - lower)
+    bands[:, counts == 0] = np.nan
+    return bands
+
+
+# Cached aggregates of one run group for one field and compression level.
+# Keeps the last compressed values seen for every run in a NaN padded matrix,
+# so runs of any length count towards the buckets they reach, and only the
+# buckets that changed since the previous request have their percentiles
+# recomputed.
+class MetricsState:
+    def __init__(self, run_ids):
+        self.run_ids = list(run_ids)
+        self.runs = {}
+        self.matrix = np.zeros((len(self.run_ids), 0))
+        self.counts = np.zeros(0, dtype=np.int64)
+        self._bands = OrderedDict()
+
+    @property
+    def length(self):
+        return self.matrix.shape[1]
+
+    # Updates the matrix with the latest compressed data for every run
+    def update(self, compressed):
+        # Find the first bucket that differs from the cached values
+        dirty_from = None
+        for run_id, values in compressed.items():
+            changed = _first_change(self.runs.get(run_id), values)
+            if changed is not None:
+                dirty_from = changed if dirty_from is None else min(dirty_from, changed)
+            self.runs[run_id] = values
+        if dirty_from is None:
+            return
+
+        # Rebuild the dirty columns, padding runs that end before the longest
+        length = max(values.size for values in compressed.values())
+        keep = min(dirty_from, self.length, length)
+        matrix = np.full((len(self.run_ids), length), np.nan)
+        matrix[:, 0:keep] = self.matrix[:, 0:keep]
+        for row, run_id in enumerate(self.run_ids):
+            values = self.runs[run_id]
+            matrix[row, keep:values.size] = values[keep:]
+        counts = np.zeros(length, dtype=np.int64)
+        counts[0:keep] = self.counts[0:keep]
+        counts[keep:] = np.count_nonzero(~np.isnan(matrix[:, keep:]), axis=0)
+        self.matrix = matrix
+        self.counts = counts
+
+        # Cached bands are only valid up to the first dirty column
+        for percentiles, (valid, bands) in self._bands.items():
+            self._bands[percentiles] = (min(valid, keep), bands)
+
+    # Returns the percentiles per bucket, computing only the columns that
+    # changed since they were last asked for
+    def bands(self, percentiles):
+        key = tuple(percentiles)
+        valid, bands = self._bands.pop(key, (0, np.zeros((len(key), 0))))
+        if valid < self.length:
+            fresh = masked_percentiles(self.matrix[:, valid:], self.counts[valid:], key)
+            bands = np.concatenate((bands[:, 0:valid], fresh), axis=1)
+        else:
+            bands = bands[:, 0:self.length]
+        self._bands[key] = (self.length, bands)
+        while len(self._bands) > BANDS_CACHE_SIZE:
+            self._bands.popitem(last=False)
+        return bands
+
+
+def _first_change(old, new):
+    if old is None:
+        return 0
+    common = min(old.size, new.size)
+    changed = np.flatnonzero(old[0:common] != new[0:common])
+    if changed.size > 0:
+        return int(changed[0])
+    if old.size != new.size:
+        return common
+    return None
+
+
+# Serves percentile metrics across run groups, reusing the aggregates
+# computed by previous requests.
+class MetricsEngine:
+    def __init__(self):
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Returns the bands as a (percentiles, buckets) array, along with the
+    # number of runs that reach each bucket.  Only reducers with a single
+    # value per bucket can be used, as percentiles are taken per bucket.
+    # `group` names the set of runs in the cache, which defaults to the ids.
+    def load(self, folder, field, compression, run_ids, mode='mean', percentiles=PERCENTILES, group=None):
+        if mode not in BUCKET_MODES:
+            raise ValueError("Invalid reducer for metrics: {}".format(mode))
+
+        # Compress every run, which is cheap thanks to the run pyramids
+        compressed = OrderedDict()
+        for run_id in run_ids:
+            steps = load_all_episodes_field_numpy(folder, run_id, field)
+            if steps is not None and len(steps) > 0:
+                compressed[run_id] = compress_run_field(folder, run_id, field, steps, compression, mode=mode)
+        if len(compressed) == 0:
+            return np.zeros((len(percentiles), 0)), np.zeros(0, dtype=np.int64)
+
+        # Reuse the cached state if the group's runs are unchanged
+        key = (folder, field, compression, mode, group or tuple(compressed))
+        with self._lock:
+            state = self._states.pop(key, None)
+            if state is None or state.run_ids != list(compressed):
+                state = MetricsState(compressed)
+            self._states[key] = state
+            while len(self._states) > METRICS_CACHE_SIZE:
+                self._states.popitem(last=False)
+            with timed('percentile'):
+                state.update(compressed)
+                return state.bands(percentiles), state.counts
+
+
+METRICS = MetricsEngine()
+
+
+# Named groups from the data folder's groups.json, if it has one
+def load_groups(folder):
+    filename = GROUPS_FORMAT.format(folder=folder)
+    if not os.path.exists(filename):
+        return {}
+    with open(filename, 'r') as fh:
+        return {name: [int(run_id) for run_id in run_ids] for name, run_ids in json.load(fh).items()}
+
+
+# The runs of a group that exist, in order
+def group_run_ids(folder, group):
+    catalog = get_catalog(folder)
+    run_ids = catalog.run_ids()
+    if group == 'all':
+        return run_ids
+    if group == 'previous':
+        return run_ids[0:-1]
+    if group == 'complete':
+        return [run.id for run in catalog.runs() if not run.is_live()]
+    groups = load_groups(folder)
+    if group not in groups:
+        raise ValueError("Unknown run group: {}".format(group))
+    members = set(groups[group])
+    return [run_id for run_id in run_ids if run_id in members]
+
+
+# Every group with its runs
+def load_all_groups(folder):
+    groups = {group: group_run_ids(folder, group) for group in BUILTIN_GROUPS}
+    for group in load_groups(folder):
+        groups.setdefault(group, group_run_ids(folder, group))
+    return groups
+
+
+# Loads the percentiles (25, 50, and 75 by default) of rewards across the
+# runs of a group (every run but the newest by default), along with the
+# number of runs in each bucket.  Then applies compression to keep data size
+# down.
+def load_metrics(folder, compression, mode='mean', percentiles=PERCENTILES, group=DEFAULT_GROUP, run_ids=None):
+    bands, counts = load_metrics_numpy(folder, compression, mode, percentiles, group, run_ids)
+    with timed('serialize'):
+        metrics = {
+            metrics_key(p): [None if np.isnan(value) else value for value in bands[idx].tolist()]
+            for idx, p in enumerate(percentiles)
+        }
+        metrics['count'] = counts.tolist()
+        return metrics
+
+
+# Runs can be given directly instead of by group
+def load_metrics_numpy(folder, compression, mode='mean', percentiles=PERCENTILES, group=DEFAULT_GROUP, run_ids=None):
+    if run_ids is None:
+        run_ids = group_run_ids(folder, group)
+        key = group
+    else:
+        key = None
+    return METRICS.load(folder, 'rewards', compression, run_ids, mode, percentiles, key)
+
+
+def parse_percentiles(text):
+    percentiles = [float(p) for p in text.split(',') if p != '']
+    if len(percentiles) == 0 or any(not 0 <= p <= 100 for p in percentiles):
+        raise ValueError("Percentiles must be between 0 and 100")
+    return [int(p) if p.is_integer() else p for p in percentiles]
+
+
+def metrics_key(percentile):
+    return 'p' + str(percentile)
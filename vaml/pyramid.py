@@ -0,0 +1,227 @@
+import os
+import threading
+import numpy as np
+from collections import OrderedDict
+
+
+PYRAMID_FORMAT = '{folder}/run_{run}/run_{run}_{field}_pyramid.npz'
+RUN_FIELD_FORMAT = '{folder}/run_{run}/run_{run}_{field}.npy'
+
+
+# Statistics kept for every pyramid entry, along with the padding value that
+# leaves them unchanged and how buckets of them are combined
+STATISTICS = ('sum', 'min', 'max')
+PADDING = {'sum': 0.0, 'min': np.inf, 'max': -np.inf}
+COMBINE = {'sum': np.add.reduce, 'min': np.minimum.reduce, 'max': np.maximum.reduce}
+
+
+# Reduces consecutive groups of `factor` values with the statistic
+def _bucketize(source, factor, statistic):
+    padding = (-source.size) % factor
+    if padding > 0:
+        source = np.concatenate((source, np.full(padding, PADDING[statistic])))
+    return COMBINE[statistic](source.reshape([source.size // factor, factor]), axis=1)
+
+
+# A multi-resolution summary of a run field.  Level k holds the sum, minimum
+# and maximum of every 2**(k+1) consecutive steps (the final entry may cover
+# fewer steps), so any bucket size with a power of two factor can be answered
+# from the coarsest level that divides it, without touching the raw steps.
+class RunPyramid:
+    def __init__(self):
+        self.length = 0
+        self._levels = list()
+        self._sizes = list()
+        self._lock = threading.Lock()
+
+    # Number of steps covered by each entry of a level
+    @staticmethod
+    def bucket_size(level):
+        return 2 ** (level + 1)
+
+    # Bytes held by the level buffers, including the room left to grow
+    @property
+    def nbytes(self):
+        return sum(buffer.nbytes for values in self._levels for buffer in values.values())
+
+    def level(self, level, statistic='sum'):
+        return self._levels[level][statistic][0:self._sizes[level]]
+
+    # Brings the pyramid up to date with the given steps.  Steps are assumed
+    # to only ever grow, so only the entries past the previously seen length
+    # are recomputed; a shorter array means the run was replaced.
+    def update(self, steps):
+        with self._lock:
+            self._update(steps)
+
+    def _update(self, steps):
+        total = len(steps)
+        if total < self.length:
+            self.length = 0
+            self._levels = list()
+            self._sizes = list()
+        if total == self.length:
+            return
+
+        # Walk up the levels, each built from the one beneath it, until a
+        # single entry covers the whole run
+        first = self.length
+        sources = {statistic: steps for statistic in STATISTICS}
+        level = 0
+        while len(sources['sum']) > 1:
+            first = first // 2
+            self._write(level, first, {
+                statistic: _bucketize(np.asarray(sources[statistic][2 * first:], dtype=np.float64), 2, statistic)
+                for statistic in STATISTICS
+            })
+            sources = {statistic: self.level(level, statistic) for statistic in STATISTICS}
+            level += 1
+        self.length = total
+
+    def _write(self, level, first, values):
+        size = values['sum'].size
+        if level == len(self._levels):
+            self._levels.append({statistic: np.zeros(max(16, size)) for statistic in STATISTICS})
+            self._sizes.append(0)
+        end = first + size
+        for statistic in STATISTICS:
+            buffer = self._levels[level][statistic]
+            if end > buffer.size:
+                grown = np.zeros(max(end, buffer.size * 2))
+                grown[0:first] = buffer[0:first]
+                buffer = grown
+                self._levels[level][statistic] = buffer
+            buffer[first:end] = values[statistic]
+        self._sizes[level] = end
+
+    # Returns the statistic per bucket for the compression, finishing the
+    # reduction from the closest level.  The raw steps are only read when the
+    # compression is odd, since no level can then be used.  Only the `count`
+    # buckets from `first` onwards are computed (or every bucket after it by
+    # default).
+    def _bucket_statistic(self, steps, compression, first, count, statistic):
+        level = -1
+        while (level + 1 < len(self._levels)
+               and compression % self.bucket_size(level + 1) == 0):
+            level += 1
+        if level < 0:
+            factor = compression
+            end = self.length if count is None else min((first + count) * factor, self.length)
+            source = np.asarray(steps[first * factor:end], dtype=np.float64)
+        else:
+            factor = compression // self.bucket_size(level)
+            end = None if count is None else (first + count) * factor
+            source = self.level(level, statistic)[first * factor:end]
+        return _bucketize(source, factor, statistic)
+
+    # Bucketizes the steps, where `mode` is the per-bucket 'mean' (equivalent
+    # to `compress_array`), 'min' or 'max'.  Only the `count` buckets from
+    # `first` onwards are returned (or every bucket after it by default).
+    def reduce(self, steps, compression, first=0, count=None, mode='mean'):
+        with self._lock:
+            if mode != 'mean':
+                return self._bucket_statistic(steps, compression, first, count, mode)
+
+            sums = self._bucket_statistic(steps, compression, first, count, 'sum')
+            counts = np.full(sums.size, compression, dtype=np.float64)
+
+            # The run's final bucket may be partial
+            if sums.size > 0 and (first + sums.size) * compression > self.length:
+                counts[-1] = self.length - (first + sums.size - 1) * compression
+            return sums / counts
+
+    def save(self, filename):
+        levels = {
+            '{}_{}'.format(statistic, idx): self.level(idx, statistic)
+            for idx in range(len(self._levels))
+            for statistic in STATISTICS
+        }
+        np.savez(filename, length=np.array(self.length), **levels)
+
+    @staticmethod
+    def load(filename):
+        pyramid = RunPyramid()
+        with np.load(filename) as archive:
+            # Pyramids saved before min and max were kept are rebuilt
+            if 'level_0' in archive:
+                return pyramid
+
+            pyramid.length = int(archive['length'])
+            level = 0
+            while all('{}_{}'.format(statistic, level) in archive for statistic in STATISTICS):
+                values = {
+                    statistic: np.array(archive['{}_{}'.format(statistic, level)], dtype=np.float64)
+                    for statistic in STATISTICS
+                }
+                pyramid._levels.append(values)
+                pyramid._sizes.append(values['sum'].size)
+                level += 1
+        return pyramid
+
+
+# Builds the pyramid for a full run field and stores it alongside the run
+def build_run_pyramid(folder, run_id, field):
+    steps = np.load(RUN_FIELD_FORMAT.format(folder=folder, run=run_id, field=field), mmap_mode='r')
+    pyramid = RunPyramid()
+    pyramid.update(steps)
+    pyramid.save(PYRAMID_FORMAT.format(folder=folder, run=run_id, field=field))
+    return pyramid
+
+
+#################### PROCESS-WIDE CACHE ####################
+
+# Bytes of pyramids kept in memory.  A pyramid takes about three times the
+# size of its steps, so the least recently used are dropped past this and
+# loaded again from their saved file when next asked for.
+PYRAMID_CACHE_BYTES = 1024 * 1024 * 1024
+PYRAMIDS = OrderedDict()
+PYRAMIDS_LOCK = threading.Lock()
+
+
+# Returns the pyramid for a run field, kept current with the steps provided.
+# Starts from the pyramid saved alongside the run if there is one, otherwise
+# builds it from scratch.  Runs are only ever appended to in place, so a
+# different file (such as a replaced run) means starting over.
+def get_run_pyramid(folder, run_id, field, steps):
+    key = (folder, str(run_id), field)
+    identity = _file_identity(RUN_FIELD_FORMAT.format(folder=folder, run=run_id, field=field))
+    with PYRAMIDS_LOCK:
+        cached = PYRAMIDS.get(key)
+        if cached is None or cached[0] != identity:
+            cached = (identity, _load_saved_pyramid(folder, run_id, field, len(steps)))
+            PYRAMIDS[key] = cached
+        PYRAMIDS.move_to_end(key)
+    pyramid = cached[1]
+    pyramid.update(steps)
+    _evict_pyramids()
+    return pyramid
+
+
+# Drops the least recently used pyramids until the rest fit the budget,
+# always keeping the one used last
+def _evict_pyramids():
+    with PYRAMIDS_LOCK:
+        total = sum(pyramid.nbytes for _, pyramid in PYRAMIDS.values())
+        while total > PYRAMID_CACHE_BYTES and len(PYRAMIDS) > 1:
+            _, (_, pyramid) = PYRAMIDS.popitem(last=False)
+            total -= pyramid.nbytes
+
+
+def _file_identity(filename):
+    try:
+        stat = os.stat(filename)
+        return stat.st_dev, stat.st_ino
+    except OSError:
+        return None
+
+
+def _load_saved_pyramid(folder, run_id, field, length):
+    filename = PYRAMID_FORMAT.format(folder=folder, run=run_id, field=field)
+    if os.path.exists(filename):
+        try:
+            pyramid = RunPyramid.load(filename)
+            if pyramid.length <= length:
+                return pyramid
+        except Exception as ex:
+            print("Failed to load pyramid {}: {}".format(filename, ex))
+    return RunPyramid()
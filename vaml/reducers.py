@@ -0,0 +1,109 @@
+import numpy as np
+
+
+# Reducers which return a single value per bucket
+BUCKET_MODES = ('mean', 'min', 'max')
+
+# Reducers which return several rows, along with the name of each row
+ROW_KEYS = {
+    'envelope': ['min', 'max', 'mean'],
+    'lttb': ['steps', 'values'],
+}
+
+# LTTB picks each point from the minimum and maximum of this many finer
+# buckets, so spikes are kept without having to read the raw steps
+LTTB_OVERSAMPLE = 16
+
+
+def is_valid_mode(mode):
+    return mode in BUCKET_MODES or mode in ROW_KEYS
+
+
+# Returns the row names for a reducer, or None if it has a single row
+def reducer_keys(mode):
+    return ROW_KEYS.get(mode)
+
+
+# Reduces the `count` buckets from `first` onwards (or every bucket after it by
+# default) with the given reducer.  Bucket modes return one value per bucket,
+# 'envelope' returns min, max and mean rows, and 'lttb' returns the steps and
+# values of the points picked by Largest-Triangle-Three-Buckets.
+def reduce_run(pyramid, steps, compression, first=0, count=None, mode='mean'):
+    if mode in BUCKET_MODES:
+        return pyramid.reduce(steps, compression, first, count, mode)
+    if mode == 'envelope':
+        return np.stack([
+            pyramid.reduce(steps, compression, first, count, statistic)
+            for statistic in ROW_KEYS['envelope']
+        ])
+    if mode == 'lttb':
+        return _reduce_lttb(pyramid, steps, compression, first, count)
+    raise ValueError("Invalid reducer: {}".format(mode))
+
+
+def _reduce_lttb(pyramid, steps, compression, first, count):
+    # Work from finer buckets, whose size divides the compression
+    fine = 1
+    for divisions in range(LTTB_OVERSAMPLE, compression + 1):
+        if compression % divisions == 0:
+            fine = compression // divisions
+            break
+    per_bucket = compression // fine
+    fine_first = first * per_bucket
+    fine_count = None if count is None else count * per_bucket
+
+    # The candidates are the minimum and maximum of every finer bucket, placed
+    # at the end of their bucket while picking
+    mins = pyramid.reduce(steps, fine, fine_first, fine_count, 'min')
+    maxs = pyramid.reduce(steps, fine, fine_first, fine_count, 'max')
+    positions = np.minimum((fine_first + np.arange(mins.size) + 1) * fine, pyramid.length)
+    x = np.repeat(positions, 2).astype(np.float64)
+    y = np.stack([mins, maxs], axis=1).reshape(-1)
+    picked = lttb(x, y, -(-mins.size // per_bucket))
+    if picked.size == 0:
+        return np.zeros((2, 0))
+
+    # Then moved to the step they are at, which only reads the finer buckets
+    # of the picked points (about 1/LTTB_OVERSAMPLE of the steps)
+    buckets = fine_first + picked // 2
+    indices = np.minimum(buckets[:, None] * fine + np.arange(fine), pyramid.length - 1)
+    values = np.asarray(steps[indices.reshape(-1)], dtype=np.float64).reshape(indices.shape)
+    chosen = np.where(picked % 2 == 0, np.argmin(values, axis=1), np.argmax(values, axis=1))
+    rows = np.arange(picked.size)
+    points = np.stack([indices[rows, chosen] + 1.0, values[rows, chosen]])
+    return points[:, np.argsort(points[0], kind='stable')]
+
+
+# Largest-Triangle-Three-Buckets downsampling, returning the indices of the
+# `threshold` points kept.  The first and last points are always kept, and
+# each bucket in between keeps the point forming the largest triangle with the
+# previously kept point and the average of the next bucket.
+def lttb(x, y, threshold):
+    size = x.size
+    if threshold >= size:
+        return np.arange(size)
+    if threshold <= 2:
+        return np.array([0, size - 1][2 - threshold:], dtype=np.int64)
+
+    # Bucket edges for the points between the first and last
+    edges = np.floor(np.linspace(1, size - 1, threshold - 1)).astype(np.int64)
+
+    # Average of every bucket, with the last point as the final "next bucket"
+    sums_x = np.add.reduceat(x[1:size - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:size - 1], edges[:-1] - 1)
+    lengths = np.diff(edges)
+    avg_x = np.append(sums_x / lengths, x[-1])
+    avg_y = np.append(sums_y / lengths, y[-1])
+
+    picked = np.zeros(threshold, dtype=np.int64)
+    picked[-1] = size - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        areas = np.abs(
+            (x[previous] - avg_x[bucket + 1]) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (avg_y[bucket + 1] - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        picked[bucket + 1] = previous
+    return picked
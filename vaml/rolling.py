@@ -0,0 +1,196 @@
+import math
+import threading
+import numpy as np
+from collections import OrderedDict
+
+from vaml.pyramid import RUN_FIELD_FORMAT, _file_identity
+
+
+# Rolling statistics over a trailing window of steps, and the exponentially
+# weighted moving average
+ROLLING_STATS = ('mean', 'std', 'ewma')
+# Smoothing factors kept per run, since each is a full copy of the run
+EWMA_CACHE_SIZE = 4
+# Most steps folded into the EWMA at once, bounding the growth of the
+# decay factors to e**EWMA_EXPONENT
+EWMA_EXPONENT = 500.0
+
+
+def is_valid_stat(stat):
+    return stat in ROLLING_STATS
+
+
+def _grow(buffer, size):
+    if size <= buffer.size:
+        return buffer
+    grown = np.zeros(max(size, buffer.size * 2))
+    grown[0:buffer.size] = buffer
+    return grown
+
+
+# A cumulative sum kept as the rounded running sums `high`, along with the
+# running total of the rounding error of every addition in `low`, so the sum
+# of any window is accurate to its own magnitude rather than the run's.
+class CompensatedSums:
+    def __init__(self):
+        self.high = np.zeros(16)
+        self.low = np.zeros(16)
+
+    @property
+    def nbytes(self):
+        return self.high.nbytes + self.low.nbytes
+
+    # Adds `values` after the first `start` values
+    def extend(self, start, values):
+        end = start + values.size
+        self.high = _grow(self.high, end + 1)
+        self.low = _grow(self.low, end + 1)
+        # A cumsum adds one value at a time, so the error of each addition
+        # can be recovered exactly afterwards (Knuth's TwoSum)
+        high = np.cumsum(np.concatenate(([self.high[start]], values)))
+        added = high[1:] - high[:-1]
+        errors = (high[:-1] - (high[1:] - added)) + (values - added)
+        self.high[start + 1:end + 1] = high[1:]
+        self.low[start + 1:end + 1] = self.low[start] + np.cumsum(errors)
+
+    # Sums of the windows [starts, ends)
+    def window(self, starts, ends):
+        return (self.high[ends] - self.high[starts]) + (self.low[ends] - self.low[starts])
+
+
+# Cumulative sums and sums of squares of a run field, so the mean and
+# standard deviation of any window are two lookups.  Steps are shifted by the
+# run's first step before being summed, and the sums are compensated, which
+# keeps the variance from cancelling out even for windows of a single step.
+# EWMAs are kept per smoothing factor for the last few asked for.
+class RunCumulativeSums:
+    def __init__(self):
+        self.length = 0
+        self.shift = 0.0
+        self._sums = CompensatedSums()
+        self._squares = CompensatedSums()
+        self._ewmas = {}
+        self._lock = threading.Lock()
+
+    # Bytes held by the sums and EWMAs, including the room left to grow
+    @property
+    def nbytes(self):
+        return self._sums.nbytes + self._squares.nbytes + sum(ewma.nbytes for ewma in list(self._ewmas.values()))
+
+    # Brings the sums up to date with the given steps.  As with the pyramids,
+    # steps are assumed to only ever grow, and a shorter array means the run
+    # was replaced.
+    def update(self, steps):
+        with self._lock:
+            self._update(steps)
+
+    def _update(self, steps):
+        total = len(steps)
+        if total < self.length:
+            self.length = 0
+            self._ewmas = {}
+        if total == self.length:
+            return
+
+        values = np.asarray(steps[self.length:total], dtype=np.float64)
+        if self.length == 0:
+            self.shift = float(values[0])
+        shifted = values - self.shift
+        self._sums.extend(self.length, shifted)
+        self._squares.extend(self.length, shifted * shifted)
+        for alpha in self._ewmas:
+            self._extend_ewma(alpha, values, self.length)
+        self.length = total
+
+    # Continues the EWMA of `alpha` with the steps from `first`.  Within
+    # a block, y[k] = decay**(k+1) * (y[-1] + alpha * sum(decay**-(j+1) * x[j]))
+    # so each block is a cumulative sum rather than a loop over the steps.
+    def _extend_ewma(self, alpha, values, first):
+        ewma = _grow(self._ewmas[alpha], first + values.size)
+        self._ewmas[alpha] = ewma
+        if alpha >= 1.0:
+            ewma[first:first + values.size] = values
+            return
+
+        decay = 1.0 - alpha
+        block = max(1, int(EWMA_EXPONENT / -math.log(decay)))
+        previous = ewma[first - 1] if first > 0 else values[0]
+        for start in range(0, values.size, block):
+            chunk = values[start:start + block]
+            growth = decay ** -np.arange(1, chunk.size + 1, dtype=np.float64)
+            result = (previous + alpha * np.cumsum(growth * chunk)) / growth
+            ewma[first + start:first + start + chunk.size] = result
+            previous = result[-1]
+
+    def _ewma(self, alpha, steps):
+        ewma = self._ewmas.pop(alpha, None)
+        if ewma is None:
+            if len(self._ewmas) >= EWMA_CACHE_SIZE:
+                del self._ewmas[next(iter(self._ewmas))]
+            self._ewmas[alpha] = np.zeros(max(16, self.length))
+            self._extend_ewma(alpha, np.asarray(steps[0:self.length], dtype=np.float64), 0)
+            ewma = self._ewmas[alpha]
+        # Most recently used last
+        self._ewmas[alpha] = ewma
+        return ewma
+
+    # The statistic at the end of each bucket of `compression` steps, over the
+    # `window` steps up to it (or the EWMA with smoothing factor `alpha`).
+    # Only the `count` buckets from `first` onwards are computed (or every
+    # bucket after it by default), and the run's final bucket may be partial.
+    def rolling(self, steps, stat, compression, window, alpha, first=0, count=None):
+        with self._lock:
+            buckets = -(-self.length // compression)
+            count = buckets - first if count is None else min(count, buckets - first)
+            if count <= 0:
+                return np.zeros(0)
+            ends = np.minimum(np.arange(first + 1, first + count + 1, dtype=np.int64) * compression, self.length)
+
+            if stat == 'ewma':
+                return self._ewma(alpha, steps)[ends - 1].copy()
+
+            starts = np.maximum(ends - window, 0)
+            sizes = ends - starts
+            means = self._sums.window(starts, ends) / sizes
+            if stat == 'mean':
+                return means + self.shift
+            squares = self._squares.window(starts, ends) / sizes
+            return np.sqrt(np.maximum(squares - means * means, 0.0))
+
+
+#################### PROCESS-WIDE CACHE ####################
+
+# Bytes of cumulative sums kept in memory, past which the least recently used
+# are dropped and rebuilt from the steps when next asked for
+CUMULATIVE_SUMS_BYTES = 512 * 1024 * 1024
+CUMULATIVE_SUMS = OrderedDict()
+CUMULATIVE_SUMS_LOCK = threading.Lock()
+
+
+# Returns the cumulative sums for a run field, kept current with the steps
+# provided.  A different file (such as a replaced run) means starting over,
+# and the sums of the old file are dropped.
+def get_run_sums(folder, run_id, field, steps):
+    key = (folder, str(run_id), field)
+    identity = _file_identity(RUN_FIELD_FORMAT.format(folder=folder, run=run_id, field=field))
+    with CUMULATIVE_SUMS_LOCK:
+        cached = CUMULATIVE_SUMS.get(key)
+        if cached is None or cached[0] != identity:
+            CUMULATIVE_SUMS.pop(key, None)
+            cached = (identity, RunCumulativeSums())
+            CUMULATIVE_SUMS[key] = cached
+        CUMULATIVE_SUMS.move_to_end(key)
+    sums = cached[1]
+    sums.update(steps)
+    _evict_sums()
+    return sums
+
+
+# Drops the least recently used sums until the rest fit the budget, always
+# keeping the one used last
+def _evict_sums():
+    with CUMULATIVE_SUMS_LOCK:
+        total = sum(sums.nbytes for _, sums in CUMULATIVE_SUMS.values())
+        while total > CUMULATIVE_SUMS_BYTES and len(CUMULATIVE_SUMS) > 1:
+            _, (_, sums) = CUMULATIVE_SUMS.popitem(last=False)
+            total -= sums.nbytes
@@ -0,0 +1,216 @@
+import json
+import os
+import struct
+import threading
+import numpy as np
+from collections import OrderedDict
+
+
+# A run store holds every episode of a run in a single file, in place of the
+# `episode_{N}_meta.json` and `episode_{N}_{field}.npy` pair per episode.  The
+# layout is:
+#   magic (8 bytes), header length (uint32), JSON header, padding
+#   episode ids (int64), step offsets (int64, one more than the episodes)
+#   one column per field, each the episodes' steps back to back
+# The header holds the offset (from the end of the header) and dtype of every
+# section along with the episode metadata table.  Sections are aligned so they
+# can be memory mapped.
+STORE_FORMAT = '{folder}/run_{run}/run_{run}_store.vrs'
+EP_METADATA_FORMAT = '{folder}/episode_{id}_meta.json'
+EP_FIELD_FORMAT = '{folder}/episode_{id}_{field}.npy'
+
+MAGIC = b'VAMLRUN\x01'
+ALIGNMENT = 64
+
+
+def _align(position):
+    return position + (-position) % ALIGNMENT
+
+
+def _data_start(header_length):
+    return _align(len(MAGIC) + 4 + header_length)
+
+
+# Writes a run store.  `episodes` is a list of (episode id, metadata, columns)
+# where columns maps each field name to that episode's steps.  The file is
+# written beside the target and then moved over it, so readers with the old
+# file mapped keep a consistent copy.
+def write_run_store(filename, episodes, fields=('rewards',)):
+    episode_ids = np.array([episode_id for episode_id, _, _ in episodes], dtype=np.int64)
+    lengths = [len(columns[fields[0]]) if len(fields) > 0 else 0 for _, _, columns in episodes]
+    offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64))).astype(np.int64)
+    columns = {
+        field: np.concatenate([np.asarray(c[field], dtype=np.float64) for _, _, c in episodes])
+        if len(episodes) > 0 else np.zeros(0)
+        for field in fields
+    }
+
+    # Section offsets are relative to the aligned end of the header
+    sections = [('episode_ids', episode_ids), ('offsets', offsets)]
+    sections += [(field, columns[field]) for field in fields]
+    header = {
+        'episodes': len(episodes),
+        'steps': int(offsets[-1]),
+        'metadata': [metadata for _, metadata, _ in episodes],
+        'sections': {},
+    }
+    position = 0
+    for name, array in sections:
+        header['sections'][name] = {
+            'offset': position,
+            'dtype': array.dtype.str,
+            'size': int(array.size)
+        }
+        position = _align(position + array.nbytes)
+    header_bytes = json.dumps(header).encode('utf8')
+    data_start = _data_start(len(header_bytes))
+
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'wb') as fh:
+        fh.write(MAGIC)
+        fh.write(struct.pack('<I', len(header_bytes)))
+        fh.write(header_bytes)
+        for name, array in sections:
+            fh.seek(data_start + header['sections'][name]['offset'])
+            fh.write(np.ascontiguousarray(array).tobytes())
+        fh.truncate(data_start + position)
+    os.replace(temp_filename, filename)
+
+
+# Read-only view of a run store.  Columns are memory mapped, so looking up an
+# episode is a dictionary lookup and a slice, without reading the rest of the
+# run.
+class RunStore:
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as fh:
+            if fh.read(len(MAGIC)) != MAGIC:
+                raise ValueError("Not a run store: {}".format(filename))
+            header_length = struct.unpack('<I', fh.read(4))[0]
+            header = json.loads(fh.read(header_length).decode('utf8'))
+
+        self._data_start = _data_start(header_length)
+        self.metadata = header['metadata']
+        self.steps = header['steps']
+        self._sections = header['sections']
+        self.episode_ids = self._map('episode_ids')
+        self.offsets = self._map('offsets')
+        self._positions = {int(episode_id): idx for idx, episode_id in enumerate(self.episode_ids)}
+        self._columns = {field: self._map(field) for field in self.fields}
+
+    def _map(self, name):
+        section = self._sections[name]
+        if section['size'] == 0:
+            return np.zeros(0, dtype=section['dtype'])
+        return np.memmap(self.filename, dtype=section['dtype'], mode='r',
+                         offset=self._data_start + section['offset'], shape=(section['size'],))
+
+    @property
+    def fields(self):
+        return [name for name in self._sections if name not in ('episode_ids', 'offsets')]
+
+    def has_episode(self, episode_id):
+        return int(episode_id) in self._positions
+
+    # Every step of a field across the run
+    def field(self, field):
+        return self._columns[field]
+
+    # Returns the steps of one episode, or None if the store does not have it
+    def episode_field(self, episode_id, field):
+        position = self._positions.get(int(episode_id))
+        if position is None or field not in self._columns:
+            return None
+        return self._columns[field][self.offsets[position]:self.offsets[position + 1]]
+
+    def episode_metadata(self, episode_id):
+        position = self._positions.get(int(episode_id))
+        return None if position is None else self.metadata[position]
+
+
+# Open stores, reopened when the file on disk is replaced
+STORE_CACHE_SIZE = 64
+STORE_CACHE = OrderedDict()
+STORE_CACHE_LOCK = threading.Lock()
+
+
+# Returns the store of a run, or None if the run has not been imported
+def load_run_store(folder, run_id):
+    filename = STORE_FORMAT.format(folder=folder, run=run_id)
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    with STORE_CACHE_LOCK:
+        cached = STORE_CACHE.get(filename)
+        if cached is not None and cached[0] == version:
+            STORE_CACHE.move_to_end(filename)
+            return cached[1]
+
+    store = RunStore(filename)
+    with STORE_CACHE_LOCK:
+        STORE_CACHE[filename] = (version, store)
+        STORE_CACHE.move_to_end(filename)
+        while len(STORE_CACHE) > STORE_CACHE_SIZE:
+            STORE_CACHE.popitem(last=False)
+    return store
+
+
+def list_episode_files(run_folder):
+    episode_ids = list()
+    for filename in os.listdir(run_folder):
+        tokens = filename.split('_')
+        if len(tokens) == 3 and tokens[0] == 'episode' and tokens[2] == 'meta.json':
+            try:
+                episode_ids.append(int(tokens[1]))
+            except ValueError:
+                pass
+    episode_ids.sort()
+    return episode_ids
+
+
+# Builds the store of a run from its `episode_{N}_*` files, returning the
+# number of episodes.  When `remove_episodes` is set, the episode files are
+# deleted once the store has been written.
+def import_run(folder, run_id, fields=('rewards',), remove_episodes=False, episode_ids=None):
+    return import_run_folder(
+        '{folder}/run_{run}'.format(folder=folder, run=run_id),
+        STORE_FORMAT.format(folder=folder, run=run_id),
+        fields, remove_episodes, episode_ids
+    )
+
+
+def import_run_folder(run_folder, filename, fields=('rewards',), remove_episodes=False, episode_ids=None):
+    if episode_ids is None:
+        episode_ids = list_episode_files(run_folder)
+    episodes = list()
+    for episode_id in episode_ids:
+        with open(EP_METADATA_FORMAT.format(folder=run_folder, id=episode_id), 'r') as fh:
+            metadata = json.load(fh)
+        columns = {
+            field: np.load(EP_FIELD_FORMAT.format(folder=run_folder, id=episode_id, field=field))
+            for field in fields
+        }
+        episodes.append((episode_id, metadata, columns))
+    write_run_store(filename, episodes, fields)
+
+    if remove_episodes:
+        for episode_id in episode_ids:
+            os.remove(EP_METADATA_FORMAT.format(folder=run_folder, id=episode_id))
+            for field in fields:
+                os.remove(EP_FIELD_FORMAT.format(folder=run_folder, id=episode_id, field=field))
+    return len(episodes)
+
+
+# Imports every run in a data folder
+def import_all(folder, remove_episodes=False):
+    for subfolder in sorted(os.listdir(folder)):
+        tokens = subfolder.split('_')
+        if len(tokens) == 2 and tokens[0] == 'run' and tokens[1].isdigit():
+            count = import_run(folder, int(tokens[1]), remove_episodes=remove_episodes)
+            print("Imported {} episodes into run {}".format(count, tokens[1]))
+
+
+if __name__ == '__main__':
+    import_all('../thesis_data')
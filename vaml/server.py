@@ -5,16 +5,36 @@ import json
 
 import os
 import threading
+import numpy as np
 import websockets
+from concurrent.futures import ThreadPoolExecutor
 from http.server import HTTPServer
 from http.server import BaseHTTPRequestHandler
 
-from vaml.data.feed_data import feed_folder
-from vaml.data_utils import load_run_field, load_metrics, load_predictions
+from vaml.catalog import get_catalog
+from vaml.http_cache import load_static_file, is_not_modified, is_compressible, negotiate_encoding, encode_body
+from vaml.http_cache import file_etag, content_etag, encoded_etag, http_date
+from vaml.instrumentation import RequestTimer, STATS, PROFILER, current_timer, request_context, timed, waiting
+from vaml.jobs import JOBS
+from vaml.live import NOTIFIER, handle_subscriptions
+from vaml.data_utils import load_run_field, load_run_field_numpy, load_predictions, load_predictions_numpy
+from vaml.data_utils import load_run_field_range, reduced_to_json, empty_reduced
+from vaml.data_utils import load_run_rolling, load_run_rolling_range
+from vaml.correctness import SAMPLE_LABELS, load_correctness, parse_labels
+from vaml.data_utils import load_episode_field_numpy, load_episode_metadata, load_prediction_grids
+from vaml.episode_index import INDEX_COLUMNS, episodes_in_range, find_episode, index_to_json
+from vaml.episode_index import load_episode_index, top_episodes
+from vaml.reducers import BUCKET_MODES, is_valid_mode, reducer_keys
+from vaml.rolling import ROLLING_STATS, is_valid_stat
+from vaml.warmup import WARMUP_BUDGET, WarmUp
+from vaml.metrics import DEFAULT_GROUP, load_all_groups, load_metrics, load_metrics_numpy, metrics_key
+from vaml.metrics import parse_percentiles
 
 SERVER = None
 FOLDER = '../thesis_data'
-TRANSFER_THREAD = None
+# Run fed from the TOO_FEED folder by /data/reset, and the delay between episodes
+RESET_FEED_RUN = 6
+RESET_EP_DELAY = 0.1
 
 def read_file(filename, root='www/'):
     with open('{root}{file}'.format(root=root, file=filename), 'rb') as f:
@@ -34,32 +54,68 @@ def parse_request_path(request_path):
     return path, params
 
 
-def transfer_thread():
-    global TRANSFER_THREAD
-    TRANSFER_THREAD = True
-    feed_folder(data_folder=FOLDER, feed_run=6, ep_delay=0.1, del_last=True)
-    TRANSFER_THREAD = None
+# Parses a comma separated list of run ids, where "all" is every run
+def parse_run_ids(runs):
+    if runs == 'all':
+        return get_catalog(FOLDER).run_ids()
+    return [int(run_id) for run_id in runs.split(',') if run_id != '']
+
+
+# HTTP server which hands every request to a bounded pool of worker threads
+# rather than handling them one at a time.
+class PooledHTTPServer(HTTPServer):
+    def __init__(self, server_address, handler_class, workers):
+        super().__init__(server_address, handler_class)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='http')
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._process_request_worker, request, client_address)
+
+    def _process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False)
 
 
 class VamlServer:
-    def __init__(self, hostname, port, websocket_port):
+    def __init__(self, hostname, port, websocket_port, workers=8, compute_workers=4, folder=None,
+                 warmup_budget=WARMUP_BUDGET):
         self.hostname = hostname
         self.port = port
         self.websocket_port = websocket_port
-        self.server = HTTPServer((hostname, port), VamlHandler)
+        self.server = PooledHTTPServer((hostname, port), VamlHandler, workers)
+
+        # Numpy-heavy work is bounded separately from the request workers, so
+        # static files and metadata are still served while data is computed
+        self.compute_pool = ThreadPoolExecutor(max_workers=compute_workers, thread_name_prefix='compute')
 
         # Assign this to the global value
-        global SERVER
+        global SERVER, FOLDER
         if SERVER is not None:
             print("Only one server can be created at a time.  Failing.")
             exit(1)
         SERVER = self
+        if folder is not None:
+            FOLDER = folder
+        self.started = time.time()
+        self.warmup = WarmUp(FOLDER, warmup_budget)
 
     def _server_websocket(self):
         print("Serving websocket server...")
-        start_server = websockets.serve(websocket_handler, self.hostname, self.websocket_port)
-        asyncio.get_event_loop().run_until_complete(start_server)
-        asyncio.get_event_loop().run_forever()
+        loop = asyncio.get_event_loop()
+        NOTIFIER.attach(loop)
+        loop.run_until_complete(self._start_websocket())
+        loop.run_forever()
+
+    async def _start_websocket(self):
+        return await websockets.serve(websocket_handler, self.hostname, self.websocket_port)
 
     def _serve_http(self):
         print(time.asctime(), 'Server Started - http://%s:%s' % (self.hostname, self.port))
@@ -71,16 +127,16 @@ class VamlServer:
         print(time.asctime(), 'Server Stopped')
 
     def serve(self):
+        get_catalog(FOLDER).start()
+        self.warmup.start()
         threading.Thread(target=self._serve_http).start()
         self._server_websocket()
 
 
-async def websocket_handler(websocket, path):
-    await websocket.send("Testing")
-    # while True:
-    #     now = datetime.datetime.utcnow().isoformat() + 'Z'
-    #     await websocket.send(now)
-    #     await asyncio.sleep(random.random() * 3)
+# Websocket clients subscribe to live runs, and are pushed the new compressed
+# buckets as the runs grow.
+async def websocket_handler(websocket, path=None):
+    await handle_subscriptions(websocket, SERVER.compute_pool, FOLDER)
 
 
 def utf8_reader(content: bytes):
@@ -101,22 +157,72 @@ class VamlHandler(BaseHTTPRequestHandler):
         self.end_headers()
 
     def _get_index(self, _):
-        content, content_type, converter = self._find_file('index.html')
-        self._send_simple(
-            content_type=content_type,
-            content=str(content).replace("${WEBSOCKET_PORT}", str(SERVER.websocket_port)),
-            converter=converter
-        )
-
+        def load_index():
+            content, content_type, converter = self._find_file('index.html')
+            content = str(content).replace("${WEBSOCKET_PORT}", str(SERVER.websocket_port))
+            return content_type, converter(content)
+        self._send_cached(load_static_file('www/index.html', load_index))
+
+    # Returns percentile bands of the rewards across a `group` of runs (every
+    # run but the newest by default, see /data/groups) or the given `runs`,
+    # along with the number of runs reaching each bucket.  `percentiles` picks
+    # the bands, such as `10,50,90`.
     def _get_metrics(self, parameters):
-        self._send_simple(
-            content_type='application/json',
-            content=json.dumps(load_metrics(
+        parameters = parameters or {}
+        mode = self._get_mode(parameters, BUCKET_MODES)
+        if mode is None:
+            return
+        compression = self._get_positive_int(parameters, 'compression')
+        if compression is None:
+            return
+
+        binary = self._wants_array(parameters)
+        try:
+            percentiles = parse_percentiles(parameters.get('percentiles', '25,50,75'))
+            result = self._compute(
+                load_metrics_numpy if binary else load_metrics,
                 folder=FOLDER,
-                compression=int(parameters['compression'])
-            )),
-            converter=bytes_utf8_converter
-        )
+                compression=compression,
+                mode=mode,
+                percentiles=percentiles,
+                group=parameters.get('group', DEFAULT_GROUP),
+                run_ids=parse_run_ids(parameters['runs']) if 'runs' in parameters else None
+            )
+        except ValueError as e:
+            self._send_simple(status_code=400, content_type='application/json',
+                              content=json.dumps({'error': str(e)}))
+            return
+
+        if binary:
+            bands, counts = result
+            keys = [metrics_key(p) for p in percentiles] + ['count']
+            self._send_array(np.vstack((bands, counts)), {'X-Array-Keys': ','.join(keys)})
+            return
+        self._send_json(result)
+
+    # Always answers while the server is up, with the warm-up's progress
+    def _get_health(self, parameters):
+        self._send_json({
+            'status': 'ok',
+            'uptime_s': time.time() - SERVER.started,
+            'runs': len(get_catalog(FOLDER).run_ids()),
+            'warmup': SERVER.warmup.to_json()
+        })
+
+    # 503 until the warm-up has finished or run out of budget
+    def _get_ready(self, parameters):
+        warmup = SERVER.warmup.to_json()
+        self._send_simple(status_code=200 if warmup['ready'] else 503, content_type='application/json',
+                          content=json.dumps(warmup))
+
+    # Lists the run groups metrics can be asked for, with their runs
+    def _get_groups(self, parameters):
+        self._send_json(load_all_groups(FOLDER))
+
+    # Lists every run along with its episode and step counts, fields, and
+    # whether it is still being written
+    def _get_runs(self, parameters):
+        self._send_json(get_catalog(FOLDER).to_json())
 
     def _get_run_metadata(self, parameters):
         self._forward_file(
@@ -128,55 +234,398 @@ class VamlHandler(BaseHTTPRequestHandler):
         )
 
     def _get_run_field(self, parameters):
+        parameters = parameters or {}
+        mode = self._get_mode(parameters)
+        if mode is None or not self._has_parameters(parameters, 'run', 'field'):
+            return
+
+        if 'start' in parameters or 'end' in parameters or 'points' in parameters:
+            self._get_run_field_range(parameters, mode)
+            return
+
+        compression = self._get_positive_int(parameters, 'compression')
+        if compression is None:
+            return
+
+        if self._wants_array(parameters):
+            self._send_array(self._compute(
+                load_run_field_numpy,
+                folder=FOLDER,
+                run_id=parameters['run'],
+                compression=compression,
+                field=parameters['field'],
+                mode=mode
+            ), self._reducer_headers(mode))
+            return
+
         # Load the data
-        data = load_run_field(
+        data = self._compute(
+            load_run_field,
             folder=FOLDER,
             run_id=parameters['run'],
-            compression=int(parameters['compression']),
-            field=parameters['field']
+            compression=compression,
+            field=parameters['field'],
+            mode=mode
         )
 
         # Send the data
-        self._send_simple(
-            content_type='application/json',
-            content=json.dumps(data),
-            converter=bytes_utf8_converter
+        self._send_json(data)
+
+    # Returns a window of steps in a run, with the server picking the bucket
+    # size that gives about `points` values
+    def _get_run_field_range(self, parameters, mode):
+        points = self._get_positive_int(parameters, 'points', 1000)
+        if points is None:
+            return
+        first_step, compression, values = self._compute(
+            load_run_field_range,
+            folder=FOLDER,
+            run_id=parameters['run'],
+            field=parameters['field'],
+            start=int(parameters.get('start', 0)),
+            end=int(parameters['end']) if 'end' in parameters else None,
+            points=points,
+            mode=mode
         )
 
+        if self._wants_array(parameters):
+            headers = self._reducer_headers(mode)
+            headers.update({
+                'X-Array-First-Step': str(first_step),
+                'X-Array-Compression': str(compression)
+            })
+            self._send_array(values, headers)
+            return
+
+        self._send_json({
+            'first_step': first_step,
+            'compression': compression,
+            'values': reduced_to_json(values, mode)
+        })
+
+    # Returns a smoothed run field, with the `stat` (mean, std or ewma) over a
+    # trailing `window` of steps, or the EWMA with smoothing factor `alpha`.
+    # Takes the same `compression`, or `start`, `end` and `points`, as
+    # /data/run_field.
+    def _get_run_rolling(self, parameters):
+        parameters = parameters or {}
+        if not self._has_parameters(parameters, 'run', 'field'):
+            return
+        stat = parameters.get('stat', 'mean')
+        window = int(parameters['window']) if 'window' in parameters else None
+        alpha = float(parameters['alpha']) if 'alpha' in parameters else None
+        if not is_valid_stat(stat) or (window is not None and window < 1) or (alpha is not None and not 0 < alpha <= 1):
+            self._send_simple(status_code=400, content_type='application/json',
+                              content=json.dumps({'error': 'Expected stat in {}, window >= 1 and 0 < alpha <= 1'.format(
+                                  ','.join(ROLLING_STATS))}))
+            return
+
+        if 'start' in parameters or 'end' in parameters or 'points' in parameters:
+            points = self._get_positive_int(parameters, 'points', 1000)
+            if points is None:
+                return
+            first_step, compression, values = self._compute(
+                load_run_rolling_range,
+                folder=FOLDER,
+                run_id=parameters['run'],
+                field=parameters['field'],
+                stat=stat,
+                start=int(parameters.get('start', 0)),
+                end=int(parameters['end']) if 'end' in parameters else None,
+                points=points,
+                window=window,
+                alpha=alpha
+            )
+            if self._wants_array(parameters):
+                self._send_array(values, {
+                    'X-Array-First-Step': str(first_step),
+                    'X-Array-Compression': str(compression)
+                })
+                return
+            self._send_json({
+                'first_step': first_step,
+                'compression': compression,
+                'values': values.tolist()
+            })
+            return
+
+        compression = self._get_positive_int(parameters, 'compression')
+        if compression is None:
+            return
+        values = self._compute(
+            load_run_rolling,
+            folder=FOLDER,
+            run_id=parameters['run'],
+            field=parameters['field'],
+            stat=stat,
+            compression=compression,
+            window=window,
+            alpha=alpha
+        )
+        if self._wants_array(parameters):
+            self._send_array(values)
+        else:
+            self._send_json(values.tolist())
+
+    def _get_run_fields(self, parameters):
+        parameters = parameters or {}
+        mode = self._get_mode(parameters)
+        if mode is None or not self._has_parameters(parameters, 'runs', 'field'):
+            return
+        compression = self._get_positive_int(parameters, 'compression')
+        if compression is None:
+            return
+
+        # Load all requested runs in parallel
+        binary = self._wants_array(parameters)
+        futures = [
+            (run_id, self._submit(
+                load_run_field_numpy if binary else load_run_field,
+                folder=FOLDER,
+                run_id=run_id,
+                compression=compression,
+                field=parameters['field'],
+                mode=mode
+            ))
+            for run_id in parse_run_ids(parameters['runs'])
+        ]
+        with waiting():
+            data = {str(run_id): future.result() for run_id, future in futures}
+
+        # Runs differ in length, so the binary form is every run back to back
+        # (along the last axis for reducers with several rows)
+        if binary:
+            runs = list(data.values())
+            headers = self._reducer_headers(mode)
+            headers.update({
+                'X-Array-Runs': ','.join(data.keys()),
+                'X-Array-Lengths': ','.join(str(run.shape[-1]) for run in runs)
+            })
+            self._send_array(np.concatenate(runs, axis=-1) if len(runs) > 0 else empty_reduced(mode), headers)
+            return
+
+        # Send the data as a single payload
+        self._send_json(data)
+
     def _get_predictions(self, parameters):
+        if self._wants_array(parameters):
+            self._send_array(self._compute(
+                load_predictions_numpy,
+                folder=FOLDER,
+                run_id=parameters['run'],
+                sample=parameters['sample']
+            ))
+            return
+
         # Load the data
-        data = load_predictions(
+        data = self._compute(
+            load_predictions,
             folder=FOLDER,
             run_id=parameters['run'],
             sample=parameters['sample']
         )
-        self._send_simple(
-            content_type='application/json',
-            content=json.dumps(data),
-            converter=bytes_utf8_converter
+        self._send_json(data)
+
+    # Returns the remapped prediction grids of every requested run and sample in
+    # one response.  The binary form is each run's (samples, checkpoints,
+    # actions) grid joined along the checkpoints.
+    def _get_prediction_grids(self, parameters):
+        parameters = parameters or {}
+        samples = parameters.get('samples')
+        samples, compression, runs = self._compute(
+            load_prediction_grids,
+            folder=FOLDER,
+            run_ids=parse_run_ids(parameters.get('runs', 'all')),
+            samples=samples.split(',') if samples else None
         )
 
-    def _get_episode_data(self, parameters):
-        # Returns the data about a specific episode
-        self._forward_file(
-            filename='{folder}/run_{run}/episode_{episode}.json'.format(
+        if self._wants_array(parameters):
+            grids = [grid for _, grid in runs]
+            self._send_array(np.concatenate(grids, axis=1) if len(grids) > 0 else np.zeros((0, 0, 0)), {
+                'X-Array-Runs': ','.join(str(run_id) for run_id, _ in runs),
+                'X-Array-Lengths': ','.join(str(grid.shape[1]) for grid in grids),
+                'X-Array-Samples': ','.join(samples),
+                'X-Array-Compression': str(compression or 0)
+            })
+            return
+
+        self._send_json({
+            'samples': samples,
+            'compression': compression,
+            'runs': {str(run_id): grid.tolist() for run_id, grid in runs}
+        })
+
+    # Returns how correct each run's predictions were at every checkpoint, for
+    # each of the `samples` (every labelled sample by default).  Samples are
+    # scored against their own labels unless `labels` gives the labels of
+    # each, as comma separated values separated by semicolons.
+    def _get_correctness(self, parameters):
+        parameters = parameters or {}
+        samples = parameters.get('samples')
+        samples = samples.split(',') if samples else list(SAMPLE_LABELS)
+        try:
+            labels = parameters.get('labels')
+            if labels is not None:
+                labels = [parse_labels(sample_labels) for sample_labels in labels.split(';')]
+                if len(labels) != len(samples):
+                    raise ValueError('Expected labels for {} samples'.format(len(samples)))
+            compression, runs = self._compute(
+                load_correctness,
                 folder=FOLDER,
-                run=parameters['run_id'],
-                episode=parameters['id']
-            ),
-            root=''
+                run_ids=parse_run_ids(parameters.get('runs', 'all')),
+                samples=samples,
+                labels=labels
+            )
+        except ValueError as e:
+            self._send_simple(status_code=400, content_type='application/json',
+                              content=json.dumps({'error': str(e)}))
+            return
+
+        if self._wants_array(parameters):
+            series = [values for _, values in runs]
+            self._send_array(np.concatenate(series, axis=1) if len(series) > 0 else np.zeros((0, 0)), {
+                'X-Array-Runs': ','.join(str(run_id) for run_id, _ in runs),
+                'X-Array-Lengths': ','.join(str(values.shape[1]) for values in series),
+                'X-Array-Samples': ','.join(samples),
+                'X-Array-Compression': str(compression or 0)
+            })
+            return
+
+        self._send_json({
+            'samples': samples,
+            'compression': compression,
+            'runs': {str(run_id): values.tolist() for run_id, values in runs}
+        })
+
+    # Looks up episodes of a run in its episode index, returning a column per
+    # summary value.  Either the episode holding `step`, the episodes with
+    # steps between `start` and `end`, the `top` episodes `by` a column (in
+    # `order` asc or desc), or a page of `limit` episodes from `offset`.
+    def _get_episodes(self, parameters):
+        index = self._compute(load_episode_index, folder=FOLDER, run_id=int(parameters['run']))
+        if index is None:
+            self._send_simple(status_code=404)
+            return
+
+        if 'step' in parameters:
+            rows = find_episode(index, int(parameters['step']))
+            if rows is None:
+                self._send_simple(status_code=404)
+                return
+        elif 'start' in parameters or 'end' in parameters:
+            rows = episodes_in_range(index, int(parameters.get('start', 0)), int(parameters.get('end', 2 ** 62)))
+        elif 'top' in parameters:
+            column = parameters.get('by', 'total')
+            if column not in INDEX_COLUMNS:
+                self._send_simple(status_code=400, content_type='application/json',
+                                  content=json.dumps({'error': 'Invalid column: {}'.format(column)}))
+                return
+            rows = top_episodes(index, int(parameters['top']), column, parameters.get('order') == 'asc')
+        else:
+            offset = int(parameters.get('offset', 0))
+            rows = index[offset:offset + int(parameters.get('limit', 100))]
+
+        self._send_json({
+            'run': int(parameters['run']),
+            'count': len(index),
+            'episodes': index_to_json(rows)
+        })
+
+    # Returns the metadata of an episode, or the steps of one of its fields
+    # when `field` is given
+    def _get_episode_data(self, parameters):
+        if 'field' in parameters:
+            try:
+                values = self._compute(
+                    load_episode_field_numpy,
+                    folder=FOLDER,
+                    run_id=parameters['run_id'],
+                    episode_id=parameters['id'],
+                    field=parameters['field']
+                )
+            except OSError:
+                self._send_simple(status_code=404)
+                return
+            if self._wants_array(parameters):
+                self._send_array(values)
+            else:
+                self._send_json(values.tolist())
+            return
+
+        metadata = self._compute(
+            load_episode_metadata,
+            folder=FOLDER,
+            run_id=parameters['run_id'],
+            episode_id=parameters['id']
         )
+        if metadata is None:
+            self._send_simple(status_code=404)
+            return
+        self._send_json(metadata)
 
+    # Replaces the newest run with a fresh feed of RESET_FEED_RUN, unless one
+    # is already running.  Returns the feed job straight away.
     def _reset_thread(self, parameters):
-        global TRANSFER_THREAD
-        if TRANSFER_THREAD is None:
+        running = [job for job in JOBS.running() if job.del_last and job.feed_run == RESET_FEED_RUN]
+        if len(running) == 0:
             print("Launching transfer thread.")
-            threading.Thread(target=transfer_thread).start()
+            job = JOBS.start(FOLDER, RESET_FEED_RUN, RESET_EP_DELAY, del_last=True, on_update=NOTIFIER.notify)
         else:
             print("Transfer thread already running.")
-
-        time.sleep(1)
-        self._send_ok()
+            job = running[0]
+        self._send_json(job.to_json())
+
+    # Lists every feed job with its progress
+    def _get_jobs(self, parameters):
+        self._send_json(JOBS.to_json())
+
+    # Starts feeding a run from the TOO_FEED folder, e.g.
+    # `feed_run=6&delay=0.1`.  `del_last=1` replaces the newest run, and no
+    # delay copies the run as fast as possible.
+    def _start_job(self, parameters):
+        delay = parameters.get('delay')
+        job = JOBS.start(
+            FOLDER,
+            int(parameters['feed_run']),
+            float(delay) if delay is not None else None,
+            del_last=parameters.get('del_last') == '1',
+            on_update=NOTIFIER.notify
+        )
+        self._send_json(job.to_json())
+
+    def _get_job(self, parameters):
+        job = JOBS.get(int(parameters['id']))
+        if job is None:
+            self._send_simple(status_code=404)
+            return
+        self._send_json(job.to_json())
+
+    def _cancel_job(self, parameters):
+        job = JOBS.cancel(int(parameters['id']))
+        if job is None:
+            self._send_simple(status_code=404)
+            return
+        self._send_json(job.to_json())
+
+    # Latency histograms and mean phase timings for every route, along with
+    # the slow requests caught by the profiler.  `reset=1` clears them.
+    def _get_stats(self, parameters):
+        if parameters is not None and parameters.get('reset') == '1':
+            STATS.reset()
+        self._send_json({
+            'routes': STATS.to_json(),
+            'profiler': PROFILER.to_json()
+        })
+
+    # Turns the sampling profiler on or off, e.g. `enabled=1&slow_ms=200`
+    def _set_profiler(self, parameters):
+        parameters = parameters or {}
+        PROFILER.configure(
+            enabled=parameters.get('enabled', '1') == '1',
+            slow_ms=parameters.get('slow_ms'),
+            interval_ms=parameters.get('interval_ms')
+        )
+        self._send_json(PROFILER.to_json())
 
     def _get_other(self):
         # Attempts to return the file with the requested name
@@ -188,32 +637,90 @@ class VamlHandler(BaseHTTPRequestHandler):
             '/': self._get_index,
             '/index.html': self._get_index,
             '/data/metrics': self._get_metrics,
+            '/data/runs': self._get_runs,
             '/data/run': self._get_run_metadata,
             '/data/run_field': self._get_run_field,
+            '/data/run_fields': self._get_run_fields,
             '/data/episode': self._get_episode_data,
             '/data/predictions': self._get_predictions,
+            '/data/prediction_grids': self._get_prediction_grids,
+            '/data/correctness': self._get_correctness,
+            '/data/episodes': self._get_episodes,
+            '/data/run_rolling': self._get_run_rolling,
+            '/data/groups': self._get_groups,
+            '/health': self._get_health,
+            '/ready': self._get_ready,
             '/data/reset': self._reset_thread,
+            '/data/jobs': self._get_jobs,
+            '/data/jobs/start': self._start_job,
+            '/data/jobs/status': self._get_job,
+            '/data/jobs/cancel': self._cancel_job,
+            '/data/stats': self._get_stats,
+            '/data/profile': self._set_profiler,
         }
 
-        # Split out the parameters (if any)
+        # Split out the parameters (if any), and time the request by route
         path, params = parse_request_path(self.path)
-        if path in known_paths:
-            known_paths[path](params)
-        else:
-            self._get_other()
+        timer = RequestTimer(path if path in known_paths else 'static', self.path)
+        with request_context(timer):
+            try:
+                if path in known_paths:
+                    known_paths[path](params)
+                else:
+                    self._get_other()
+            finally:
+                STATS.record(timer)
+                PROFILER.finish(timer)
+
+    # Runs numpy-heavy work on the server's compute pool and waits for the result
+    def _compute(self, function, **kwargs):
+        future = self._submit(function, **kwargs)
+        with waiting():
+            return future.result()
+
+    # Queues work on the compute pool, timed as part of the current request
+    def _submit(self, function, **kwargs):
+        timer = current_timer()
+        queued = time.perf_counter()
+
+        def run():
+            with request_context(timer):
+                if timer is not None:
+                    timer.add('queue', time.perf_counter() - queued)
+                with timed('compute'):
+                    return function(**kwargs)
+        return SERVER.compute_pool.submit(run)
 
     def _forward_file(self, filename, root='www/'):
         try:
-            content, content_type, converter = self._find_file(filename, root)
-            self._send_simple(
+            path = '{root}{file}'.format(root=root, file=filename)
+            if root == 'www/':
+                # Static files are kept in memory, already compressed
+                self._send_cached(load_static_file(path, lambda: self._read_file(filename, root)))
+                return
+
+            # Data files are only validated, which avoids reading unchanged ones
+            stat = os.stat(path)
+            if is_not_modified(self.headers, file_etag(stat), stat.st_mtime):
+                self._send_not_modified(file_etag(stat))
+                return
+            content_type, body = self._read_file(filename, root)
+            self._send_body(
                 content_type=content_type,
-                content=content,
-                converter=converter
+                body=body,
+                etag=file_etag(stat),
+                mtime=stat.st_mtime
             )
         except Exception as e:
             print(e)
             self._send_simple(status_code=500)
 
+    def _read_file(self, filename, root='www/'):
+        content, content_type, converter = self._find_file(filename, root)
+        if converter is not None:
+            content = converter(content)
+        return content_type, content
+
     def _find_file(self, filename, root='www/'):
         filetypes = {
             '.js': ('text/javascript', bytes_utf8_converter, utf8_reader),
@@ -235,12 +742,135 @@ class VamlHandler(BaseHTTPRequestHandler):
         return content, content_type, converter
 
     def _send_simple(self, status_code=200, content_type='', content='', converter=bytes_utf8_converter):
+        if converter is not None:
+            content = converter(content)
+        self._send_body(content_type=content_type, body=content, status_code=status_code)
+
+    def _send_json(self, data):
+        with timed('serialize'):
+            content = bytes_utf8_converter(json.dumps(data))
+        self._send_body(content_type='application/json', body=content)
+
+    def _send_cached(self, cached):
+        self._send_body(
+            content_type=cached.content_type,
+            body=cached.body,
+            etag=cached.etag,
+            mtime=cached.mtime,
+            gzipped=cached.gzipped
+        )
+
+    # Sends a response body along with its validators.  Successful responses
+    # get an ETag (a hash of the body unless one is given), are answered with
+    # 304 when the client's copy is still current, and are compressed when the
+    # client accepts it, with the encoding appended to the ETag.
+    def _send_body(self, content_type, body, etag=None, mtime=None, gzipped=None, status_code=200, headers=None):
+        # Compress if worthwhile, which gives the body its own ETag
+        encoding = negotiate_encoding(self.headers.get('Accept-Encoding'))
+        if encoding is None or not is_compressible(content_type, body):
+            encoding = None
+
+        if status_code == 200:
+            etag = encoded_etag(etag or content_etag(body), encoding)
+            if is_not_modified(self.headers, etag, mtime):
+                self._send_not_modified(etag)
+                return
+
+        # Reuse the gzipped copy if there is one
+        if encoding is not None:
+            with timed('encode'):
+                body = gzipped if encoding == 'gzip' and gzipped is not None else encode_body(body, encoding)
+
         self.send_response(status_code)
         self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Vary', 'Accept-Encoding')
+        if encoding is not None:
+            self.send_header('Content-Encoding', encoding)
+        if etag is not None:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        if mtime is not None:
+            self.send_header('Last-Modified', http_date(mtime))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self._send_server_timing()
         self.end_headers()
-        if converter is not None:
-            content = converter(content)
-        self.wfile.write(content)
+        with timed('write'):
+            self.wfile.write(body)
+
+    def _send_not_modified(self, etag):
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self._send_server_timing()
+        self.end_headers()
+
+    # Phases timed so far, which excludes writing the body
+    def _send_server_timing(self):
+        timer = current_timer()
+        if timer is not None:
+            self.send_header('Server-Timing', timer.server_timing())
+
+    # Reads the reducer for run fields from the `mode` parameter, defaulting to
+    # bucket means.  Sends a 400 and returns None if it is not supported.
+    def _get_mode(self, parameters, modes=None):
+        mode = parameters.get('mode', 'mean')
+        if not is_valid_mode(mode) or (modes is not None and mode not in modes):
+            self._send_simple(status_code=400, content_type='application/json',
+                              content=json.dumps({'error': 'Invalid mode: {}'.format(mode)}))
+            return None
+        return mode
+
+    # Reads a positive integer parameter such as the compression, using the
+    # default if there is one and the parameter is not given.  Sends a 400 and
+    # returns None if it is missing or not a positive integer.
+    def _get_positive_int(self, parameters, name, default=None):
+        try:
+            value = int(parameters[name]) if name in parameters else default
+        except ValueError:
+            value = None
+        if value is None or value < 1:
+            self._send_simple(status_code=400, content_type='application/json',
+                              content=json.dumps({'error': 'Expected a positive integer {}'.format(name)}))
+            return None
+        return value
+
+    # Sends a 400 and returns False unless every named parameter is given
+    def _has_parameters(self, parameters, *names):
+        missing = [name for name in names if name not in parameters]
+        if len(missing) > 0:
+            self._send_simple(status_code=400, content_type='application/json',
+                              content=json.dumps({'error': 'Missing parameters: {}'.format(','.join(missing))}))
+            return False
+        return True
+
+    # Names the rows of a binary response for reducers with several rows
+    def _reducer_headers(self, mode):
+        keys = reducer_keys(mode)
+        return {} if keys is None else {'X-Array-Keys': ','.join(keys)}
+
+    # Clients can ask for raw float32 arrays with `format=f32` or by accepting
+    # `application/octet-stream`.  JSON is the default.
+    def _wants_array(self, parameters):
+        if parameters is not None and 'format' in parameters:
+            return parameters['format'] == 'f32'
+        return 'application/octet-stream' in self.headers.get('Accept', '')
+
+    # Sends the raw little-endian float32 buffer of a numpy array, with the
+    # shape and dtype given in the headers.
+    def _send_array(self, array, headers=None):
+        array = np.ascontiguousarray(array, dtype='<f4')
+        array_headers = {
+            'X-Array-Shape': ','.join(str(size) for size in array.shape),
+            'X-Array-Dtype': 'float32'
+        }
+        array_headers.update(headers or {})
+        # Empty arrays with several dimensions cannot be cast to bytes
+        self._send_body(
+            content_type='application/octet-stream',
+            body=array.data.cast('B') if array.size > 0 else b'',
+            headers=array_headers
+        )
 
     def _send_ok(self):
         self._send_simple(status_code=200, content_type='application/json', content='{}')
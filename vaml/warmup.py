@@ -0,0 +1,121 @@
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+from vaml.catalog import get_catalog
+from vaml.correctness import SAMPLE_LABELS, load_correctness
+from vaml.data_utils import load_run_field_numpy
+from vaml.episode_index import load_episode_index
+from vaml.metrics import load_metrics_numpy
+
+
+# Bucket sizes the dashboard asks for when it opens (DATA_COMPRESSION_LINES
+# and DATA_COMPRESSION_SHAPE in ts/index.ts)
+WARMUP_COMPRESSIONS = [1000]
+# Seconds the warm-up may run for before giving up on the rest, where None
+# means no limit and 0 skips it
+WARMUP_BUDGET = 30.0
+
+
+# Loads what the dashboard asks for first on a background thread when the
+# server starts, so the first page load finds the arrays mapped, the pyramids
+# and cumulative state built and the metrics bands computed.  Stops once the
+# budget is spent; whatever is left is loaded by the first request for it.
+class WarmUp:
+    def __init__(self, folder, budget=WARMUP_BUDGET, compressions=WARMUP_COMPRESSIONS):
+        self.folder = folder
+        self.budget = budget
+        self.compressions = list(compressions)
+        self.state = 'pending'
+        self.tasks = 0
+        self.done = 0
+        self.failed = 0
+        self.current = None
+        self.started = None
+        self.finished = None
+        self.phases = OrderedDict()
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self.state in ('done', 'over_budget', 'failed')
+
+    # Every task as a (kind, run id, function) tuple, in the order the
+    # dashboard needs them.  Newest runs come first, as it opens on those.
+    def _plan(self):
+        run_ids = list(reversed(get_catalog(self.folder).run_ids()))
+        tasks = list()
+        for compression in self.compressions:
+            for run_id in run_ids:
+                tasks.append(('run_field', run_id, partial(
+                    load_run_field_numpy, self.folder, run_id, 'rewards', compression)))
+            tasks.append(('metrics', None, partial(load_metrics_numpy, self.folder, compression)))
+        for run_id in run_ids:
+            tasks.append(('correctness', run_id, partial(
+                load_correctness, self.folder, [run_id], list(SAMPLE_LABELS))))
+        for run_id in run_ids:
+            tasks.append(('episode_index', run_id, partial(load_episode_index, self.folder, run_id)))
+        return tasks
+
+    def _run(self):
+        self.started = time.time()
+        self.state = 'running'
+        try:
+            tasks = self._plan()
+        except Exception as e:
+            print("Warm-up failed: {}".format(e))
+            self.state = 'failed'
+            self.finished = time.time()
+            return
+
+        self.tasks = len(tasks)
+        state = 'done'
+        for kind, run_id, task in tasks:
+            if self.budget is not None and time.time() - self.started >= self.budget:
+                state = 'over_budget'
+                break
+            self.current = kind if run_id is None else '{} {}'.format(kind, run_id)
+            start = time.perf_counter()
+            try:
+                task()
+            except Exception as e:
+                self.failed += 1
+                print("Warm-up of {} failed: {}".format(self.current, e))
+            self.phases[kind] = self.phases.get(kind, 0.0) + time.perf_counter() - start
+            self.done += 1
+
+        self.current = None
+        self.finished = time.time()
+        self.state = state
+        print("Warm-up {state} after {done}/{tasks} tasks in {seconds:.1f}s".format(
+            state=state, done=self.done, tasks=self.tasks, seconds=self.finished - self.started))
+
+    def start(self):
+        if self._thread is not None:
+            return
+        if self.budget == 0:
+            self.state = 'done'
+            return
+        self._thread = threading.Thread(target=self._run, name='warmup', daemon=True)
+        self._thread.start()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def to_json(self):
+        elapsed = None
+        if self.started is not None:
+            elapsed = (self.finished or time.time()) - self.started
+        return {
+            'state': self.state,
+            'ready': self.ready,
+            'tasks': self.tasks,
+            'done': self.done,
+            'failed': self.failed,
+            'current': self.current,
+            'elapsed_s': elapsed,
+            'budget_s': self.budget,
+            'phases_s': dict(self.phases)
+        }